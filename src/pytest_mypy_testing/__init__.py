@@ -2,4 +2,10 @@
 # SPDX-License-Identifier: Apache-2.0 OR MIT
 """Pytest plugin to check mypy output."""
 
+import time
+
+
 __version__ = "0.2.0"
+
+# Start of the plugin import, see plugin.IMPORT_SECONDS
+_import_start = time.perf_counter()
@@ -0,0 +1,456 @@
+# SPDX-FileCopyrightText: David Fritzsche
+# SPDX-License-Identifier: Apache-2.0 OR MIT
+"""Backends running mypy."""
+
+import contextlib
+import io
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import traceback
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    TextIO,
+    Tuple,
+    Type,
+    cast,
+)
+
+from . import worker as worker_module
+
+
+__all__ = [
+    "BuildBackend",
+    "ForkServerBackend",
+    "InProcessBackend",
+    "MypyBackend",
+    "MypyOutput",
+    "SubprocessBackend",
+    "create_backend",
+    "run_with_timeout",
+]
+
+
+# Run the worker by path so that it works without importing this package
+_WORKER_BOOTSTRAP = (
+    "import runpy, sys; runpy.run_path(sys.argv.pop(1), run_name='__main__')"
+)
+
+
+class MypyOutput(NamedTuple):
+    out: str
+    err: str
+    returncode: int
+
+
+class MypyBackend:
+    """Base class of all backends."""
+
+    #: Whether the backend starts every check from a warm cache by itself
+    warms_cache = False
+    #: Whether :meth:`terminate` aborts running checks
+    terminable = False
+    #: Whether to time the hook callbacks of the configured mypy plugins
+    profile_plugin_hooks = False
+    _hook_timings: List[worker_module.HookTiming] = []
+
+    def run(
+        self,
+        flags: List[str],
+        filenames: List[str],
+        texts: Optional[Mapping[str, str]] = None,
+    ) -> MypyOutput:
+        """Run mypy with the command line options *flags* for *filenames*.
+
+        *texts* optionally maps file names to their source text. Backends
+        may use it instead of reading the files again.
+        """
+        raise NotImplementedError
+
+    def take_hook_timings(self) -> List[worker_module.HookTiming]:
+        """Return the plugin hook timings of the checks since the last call."""
+        timings, self._hook_timings = self._hook_timings, []
+        return timings
+
+    @contextlib.contextmanager
+    def _profiling(self) -> Iterator[None]:
+        """Record the plugin hook timings of mypy run in this process."""
+        if not self.profile_plugin_hooks:
+            yield
+            return
+        with worker_module.profile_plugin_hooks() as timings:
+            yield
+        self._hook_timings = self._hook_timings + timings
+
+    def close(self) -> None:
+        """Release all resources held by the backend."""
+
+    def terminate(self) -> None:
+        """Abort running checks as fast as possible (may be called from any thread).
+
+        :meth:`close` must still be called afterwards.
+        """
+
+
+class InProcessBackend(MypyBackend):
+    """Run mypy inside the pytest process using :func:`mypy.api.run`."""
+
+    def run(
+        self,
+        flags: List[str],
+        filenames: List[str],
+        texts: Optional[Mapping[str, str]] = None,
+    ) -> MypyOutput:
+        with self._profiling():
+            out, err, returncode = worker_module.mypy_api_run(flags + filenames)
+        return MypyOutput(out, err, returncode)
+
+
+class BuildBackend(MypyBackend):
+    """Run mypy inside the pytest process using :func:`mypy.build.build`.
+
+    The mypy options and the file system cache are created once per set
+    of flags and reused for all files. Source texts are passed to mypy
+    in memory.
+    """
+
+    def __init__(self) -> None:
+        self._options: Dict[Tuple[str, ...], Tuple[Any, Any]] = {}
+
+    def _get_options(self, flags: List[str], stdout: TextIO, stderr: TextIO):
+        from mypy.fscache import FileSystemCache
+        from mypy.main import process_options
+
+        other_flags, cache_dir = worker_module.split_cache_dir(flags)
+        other_flags, shadow_files = worker_module.split_shadow_files(other_flags)
+        key = tuple(other_flags)
+        if key not in self._options:
+            fscache = FileSystemCache()
+            _, options = process_options(
+                other_flags,
+                stdout=stdout,
+                stderr=stderr,
+                require_targets=False,
+                fscache=fscache,
+            )
+            self._options[key] = (options, fscache)
+        options, fscache = self._options[key]
+        changes: Dict[str, object] = {}
+        if cache_dir:
+            changes["cache_dir"] = cache_dir
+        if shadow_files:
+            changes["shadow_file"] = [list(pair) for pair in shadow_files]
+        if changes:
+            options = options.apply_changes(changes)
+        return options, fscache
+
+    def run(
+        self,
+        flags: List[str],
+        filenames: List[str],
+        texts: Optional[Mapping[str, str]] = None,
+    ) -> MypyOutput:
+        from mypy import build
+        from mypy.errors import CompileError
+        from mypy.find_sources import InvalidSourceList, create_source_list
+        from mypy.main import RECURSION_LIMIT
+        from mypy.modulefinder import BuildSource
+
+        sys.setrecursionlimit(max(sys.getrecursionlimit(), RECURSION_LIMIT))
+        texts = {os.path.normpath(path): text for path, text in (texts or {}).items()}
+        stdout, stderr = io.StringIO(), io.StringIO()
+        messages: List[str] = []
+
+        def flush_errors(
+            filename: Optional[str], new_messages: List[str], serious: bool
+        ) -> None:
+            messages.extend(new_messages)
+
+        blockers = False
+        try:
+            options, fscache = self._get_options(flags, stdout, stderr)
+            sources = [
+                BuildSource(
+                    src.path, src.module, texts.get(src.path or ""), src.base_dir
+                )
+                for src in create_source_list(filenames, options, fscache)
+            ]
+            with self._profiling(), worker_module.capture_crash_reports(stderr):
+                build.build(
+                    sources, options, None, flush_errors, fscache, stdout, stderr
+                )
+        except CompileError:
+            blockers = True
+        except InvalidSourceList as e:
+            return MypyOutput(stdout.getvalue(), f"{stderr.getvalue()}{e}\n", 2)
+        except SystemExit as e:
+            returncode = e.code if isinstance(e.code, int) else 2
+            return MypyOutput(stdout.getvalue(), stderr.getvalue(), returncode)
+        except Exception:
+            return MypyOutput(
+                stdout.getvalue(), stderr.getvalue() + traceback.format_exc(), 2
+            )
+
+        n_notes = sum(1 for msg in messages if ": note:" in msg)
+        returncode = (2 if blockers else 1) if n_notes < len(messages) else 0
+        out = "".join(msg + "\n" for msg in messages)
+        return MypyOutput(stdout.getvalue() + out, stderr.getvalue(), returncode)
+
+
+class _WorkerProcess:
+    def __init__(self, command: List[str]) -> None:
+        self.process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            encoding="utf-8",
+            bufsize=1,
+            # Own process group to terminate forked children together with it
+            start_new_session=hasattr(os, "killpg"),
+        )
+        self.files_checked = 0
+        self.busy = False
+
+    @property
+    def pid(self) -> int:
+        return self.process.pid
+
+    def request(self, request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Send *request* and return the response or `None` if the worker died."""
+        stdin = cast(IO[str], self.process.stdin)
+        stdout = cast(IO[str], self.process.stdout)
+        self.busy = True
+        try:
+            stdin.write(json.dumps(request) + "\n")
+            stdin.flush()
+            line = stdout.readline()
+        except OSError:
+            return None
+        if not line:
+            return None
+        self.busy = False
+        return cast(Dict[str, Any], json.loads(line))
+
+    def terminate(self, timeout: float = 1.0) -> None:
+        """Terminate the worker and all processes forked by it."""
+        self._signal(signal.SIGTERM)
+        try:
+            self.process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            pass
+        self._signal(getattr(signal, "SIGKILL", signal.SIGTERM))
+        self.process.wait()
+
+    def _signal(self, signum: int) -> None:
+        try:
+            if hasattr(os, "killpg"):
+                os.killpg(self.process.pid, signum)
+            elif self.process.poll() is None:  # pragma: no cover
+                self.process.terminate()
+        except ProcessLookupError:
+            pass
+
+    def stop(self) -> None:
+        if self.busy:
+            # Interrupted while waiting for a response
+            self.terminate()
+        if self.process.stdin:
+            try:
+                self.process.stdin.close()
+            except OSError:  # pragma: no cover
+                pass
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:  # pragma: no cover
+            self.process.kill()
+            self.process.wait()
+        if self.process.stdout:
+            self.process.stdout.close()
+
+
+class SubprocessBackend(MypyBackend):
+    """Run mypy in a worker subprocess.
+
+    The worker is replaced by a fresh process after it has checked
+    *max_files_per_worker* files or when its resident set size exceeds
+    *max_worker_rss* bytes. A crashed worker is replaced as well.
+    """
+
+    terminable = True
+
+    def __init__(
+        self,
+        *,
+        python: Optional[str] = None,
+        max_files_per_worker: Optional[int] = None,
+        max_worker_rss: Optional[int] = None,
+    ) -> None:
+        self.python = python or sys.executable
+        self.max_files_per_worker = max_files_per_worker
+        self.max_worker_rss = max_worker_rss
+        self._worker: Optional[_WorkerProcess] = None
+
+    @property
+    def worker_command(self) -> List[str]:
+        return [self.python, "-c", _WORKER_BOOTSTRAP, worker_module.__file__]
+
+    def run(
+        self,
+        flags: List[str],
+        filenames: List[str],
+        texts: Optional[Mapping[str, str]] = None,
+    ) -> MypyOutput:
+        if self._worker is None:
+            self._worker = _WorkerProcess(self.worker_command)
+        worker = self._worker
+
+        response = worker.request(
+            {"flags": flags, "files": filenames, "profile": self.profile_plugin_hooks}
+        )
+        if response is None:
+            if self._worker is worker:
+                self._worker = None
+            worker.stop()
+            returncode = worker.process.returncode
+            return MypyOutput(
+                "",
+                f"mypy worker process {worker.pid} terminated unexpectedly "
+                f"(exit code {returncode})\n",
+                2,
+            )
+
+        self._hook_timings = self._hook_timings + [
+            worker_module.HookTiming(*timing)
+            for timing in response.get("hook_timings", [])
+        ]
+        if self._worker is not worker:
+            # Terminated after responding
+            worker.stop()
+        worker.files_checked += len(filenames)
+        rss = response.get("rss")
+        if (
+            self.max_files_per_worker
+            and worker.files_checked >= self.max_files_per_worker
+        ) or (self.max_worker_rss and rss and rss > self.max_worker_rss):
+            self._stop_worker()
+
+        return MypyOutput(response["out"], response["err"], response["returncode"])
+
+    def close(self) -> None:
+        self._stop_worker()
+
+    def terminate(self) -> None:
+        # Never reuse the terminated worker, even if it still responded
+        worker, self._worker = self._worker, None
+        if worker is not None:
+            worker.terminate()
+
+    def _stop_worker(self) -> None:
+        worker, self._worker = self._worker, None
+        if worker is not None:
+            worker.stop()
+
+
+class ForkServerBackend(SubprocessBackend):
+    """Run mypy in children forked from a pre-warmed zygote process.
+
+    The zygote imports mypy and builds a warm mypy cache of the standard
+    library once per set of mypy flags. It then forks a copy-on-write
+    child for every check. Requires :func:`os.fork`.
+    """
+
+    warms_cache = True
+
+    @property
+    def worker_command(self) -> List[str]:
+        return super().worker_command + ["--zygote"]
+
+
+BACKENDS: Dict[str, Type[MypyBackend]] = {
+    "inprocess": InProcessBackend,
+    "build": BuildBackend,
+    "subprocess": SubprocessBackend,
+    "forkserver": ForkServerBackend,
+}
+
+
+RunFunction = Callable[[List[str], List[str], Optional[Mapping[str, str]]], MypyOutput]
+
+
+def run_with_timeout(
+    backend: MypyBackend,
+    flags: List[str],
+    filenames: List[str],
+    texts: Optional[Mapping[str, str]] = None,
+    timeout: Optional[float] = None,
+    *,
+    run: Optional[RunFunction] = None,
+) -> Optional[MypyOutput]:
+    """Run mypy with *backend*, terminating it after *timeout* seconds.
+
+    Mypy is run by calling *run* in place of ``backend.run`` if given.
+    Returns `None` if the check was terminated. *backend* must be
+    terminable if a *timeout* is given.
+    """
+    if run is None:
+        run = backend.run
+    if timeout is None:
+        return run(flags, filenames, texts)
+    timed_out = threading.Event()
+
+    def expire() -> None:
+        timed_out.set()
+        backend.terminate()
+
+    timer = threading.Timer(timeout, expire)
+    timer.daemon = True
+    timer.start()
+    try:
+        output = run(flags, filenames, texts)
+    finally:
+        timer.cancel()
+    return None if timed_out.is_set() else output
+
+
+def is_backend_supported(name: str) -> bool:
+    return name != "forkserver" or hasattr(os, "fork")
+
+
+def create_backend(
+    config, *, out_of_process: bool = False, python: Optional[str] = None
+) -> MypyBackend:
+    """Create the backend selected by the pytest *config*.
+
+    With *out_of_process* in-process backends are replaced by the
+    subprocess backend. With *python* mypy runs out of process with
+    this Python interpreter.
+    """
+    option = config.option
+    backend_cls = BACKENDS[option.mypy_testing_backend]
+    if (out_of_process or python) and not issubclass(backend_cls, SubprocessBackend):
+        backend_cls = SubprocessBackend
+    backend: MypyBackend
+    if issubclass(backend_cls, SubprocessBackend):
+        max_worker_rss = option.mypy_testing_max_worker_rss
+        backend = backend_cls(
+            python=python,
+            max_files_per_worker=option.mypy_testing_max_files_per_worker,
+            max_worker_rss=max_worker_rss * 1024 * 1024 if max_worker_rss else None,
+        )
+    else:
+        backend = backend_cls()
+    backend.profile_plugin_hooks = bool(
+        getattr(option, "mypy_testing_profile_plugins", False)
+    )
+    return backend
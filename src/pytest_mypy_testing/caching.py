@@ -0,0 +1,217 @@
+# SPDX-FileCopyrightText: David Fritzsche
+# SPDX-License-Identifier: Apache-2.0 OR MIT
+"""Warm mypy caches shared by all checks with the same mypy flags."""
+
+import hashlib
+import importlib.metadata
+import importlib.util
+import json
+import os
+import shutil
+import site
+import stat
+import sys
+import sysconfig
+import tempfile
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from .backends import MypyBackend
+from .worker import seed_cache_dir, split_cache_dir, split_shadow_files
+
+
+__all__ = ["WarmCaches", "installed_packages"]
+
+_WARM_MODULE = "pytest_mypy_testing_warm.py"
+
+
+def _flags_key(flags: List[str]) -> Tuple[str, ...]:
+    other_flags, _ = split_cache_dir(flags)
+    other_flags, _ = split_shadow_files(other_flags)
+    return tuple(other_flags)
+
+
+def _mypy_version() -> str:
+    try:
+        return importlib.metadata.version("mypy")
+    except importlib.metadata.PackageNotFoundError:  # pragma: no cover
+        return "unknown"
+
+
+def installed_packages(names: Iterable[str]) -> List[str]:
+    """Return the top-level modules of *names* installed in site-packages.
+
+    The modules are located without importing them. Standard library
+    and local modules are skipped.
+    """
+    site_dirs = [
+        os.path.realpath(path)
+        for path in {
+            sysconfig.get_paths()["purelib"],
+            sysconfig.get_paths()["platlib"],
+            *site.getsitepackages(),
+            site.getusersitepackages(),
+        }
+    ]
+    packages = []
+    for name in sorted(set(names)):
+        if name in sys.stdlib_module_names or name == "__future__":
+            continue
+        try:
+            spec = importlib.util.find_spec(name)
+        except (ImportError, ValueError):
+            continue
+        if spec is None:
+            continue
+        locations = list(spec.submodule_search_locations or [])
+        if spec.origin and spec.has_location:
+            locations.append(spec.origin)
+        if any(
+            os.path.realpath(location).startswith(site_dir + os.sep)
+            for location in locations
+            for site_dir in site_dirs
+        ):
+            packages.append(name)
+    return packages
+
+
+def _package_versions(packages: Sequence[str]) -> Dict[str, List[str]]:
+    """Return the installed distributions providing each of *packages*."""
+    distributions = importlib.metadata.packages_distributions()
+    return {
+        package: sorted(
+            f"{name}=={importlib.metadata.version(name)}"
+            for name in distributions.get(package.partition(".")[0], [])
+        )
+        for package in packages
+    }
+
+
+class WarmCaches:
+    """Warm mypy caches of the standard library, one per set of mypy flags.
+
+    The first check with a set of flags type checks a module importing
+    *packages* and the installed packages imported by the checks with
+    these flags (and nothing else) to analyze the standard library and
+    these packages. The cache directory of every check is then seeded
+    from this warm cache via hard links. As creating the warm cache costs
+    about as much as a cold check, only flags announced for at least two
+    checks via :meth:`expect` get a warm cache.
+
+    With *snapshot_dir* the warm caches are read-only snapshots stored
+    in this directory and reused by later sessions. They are keyed by the
+    flags, the packages and their installed versions, the Python
+    environment and the mypy version.
+    """
+
+    def __init__(
+        self, snapshot_dir: Optional[str] = None, packages: Sequence[str] = ()
+    ) -> None:
+        self.snapshot_dir = snapshot_dir
+        self.packages = list(packages)
+        self._tmp_dir: Optional[str] = None
+        self._cache_dirs: Dict[Tuple[str, ...], Optional[str]] = {}
+        self._expected: Dict[Tuple[str, ...], int] = {}
+        self._imports: Dict[Tuple[str, ...], Set[str]] = {}
+        self._lock = threading.Lock()
+
+    def expect(self, flags: List[str], packages: Iterable[str] = ()) -> None:
+        """Announce a check with *flags* importing the installed *packages*."""
+        key = _flags_key(flags)
+        self._expected[key] = self._expected.get(key, 0) + 1
+        self._imports.setdefault(key, set()).update(packages)
+
+    def packages_for(self, flags: List[str]) -> List[str]:
+        """Return the packages analyzed by the warm cache for *flags*."""
+        imports = self._imports.get(_flags_key(flags), set())
+        return self.packages + sorted(imports.difference(self.packages))
+
+    def seed(self, backend: MypyBackend, flags: List[str], cache_dir: str) -> None:
+        """Seed *cache_dir* with the warm cache for *flags*."""
+        warm_cache_dir = self.get(backend, flags)
+        if warm_cache_dir is not None:
+            seed_cache_dir(warm_cache_dir, cache_dir)
+
+    def get(self, backend: MypyBackend, flags: List[str]) -> Optional[str]:
+        """Return the warm cache directory for *flags*, creating it if needed.
+
+        Returns `None` if mypy fails for the warm-up module.
+        """
+        key = _flags_key(flags)
+        if self.snapshot_dir is None and self._expected.get(key, 0) < 2:
+            return None
+        with self._lock:
+            if key not in self._cache_dirs:
+                if self.snapshot_dir is None:
+                    self._cache_dirs[key] = self._create(backend, list(key))
+                else:
+                    self._cache_dirs[key] = self._snapshot(backend, list(key))
+            return self._cache_dirs[key]
+
+    def snapshot_name(self, flags: List[str]) -> str:
+        """Return the name of the snapshot directory for *flags*."""
+        data = {
+            "flags": list(_flags_key(flags)),
+            "packages": _package_versions(self.packages_for(flags)),
+            "python": sys.version,
+            "prefix": sys.prefix,
+            "mypy": _mypy_version(),
+        }
+        return hashlib.sha256(json.dumps(data).encode("utf-8")).hexdigest()[:32]
+
+    def _create(self, backend: MypyBackend, flags: List[str]) -> Optional[str]:
+        if self._tmp_dir is None:
+            self._tmp_dir = tempfile.mkdtemp(prefix="pytest-mypy-testing-warm-")
+        warm_dir = os.path.join(self._tmp_dir, str(len(self._cache_dirs)))
+        os.makedirs(warm_dir)
+        return self._warm_up(backend, flags, warm_dir)
+
+    def _snapshot(self, backend: MypyBackend, flags: List[str]) -> Optional[str]:
+        assert self.snapshot_dir is not None
+        snapshot = os.path.join(self.snapshot_dir, self.snapshot_name(flags))
+        if not os.path.isdir(snapshot):
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            build_dir = tempfile.mkdtemp(prefix=".build-", dir=self.snapshot_dir)
+            try:
+                cache_dir = self._warm_up(backend, flags, build_dir)
+                if cache_dir is None:
+                    return None
+                _make_read_only(cache_dir)
+                try:
+                    os.rename(build_dir, snapshot)
+                except OSError:
+                    # Created by a concurrent session in the meantime
+                    if not os.path.isdir(snapshot):
+                        raise
+            finally:
+                shutil.rmtree(build_dir, ignore_errors=True)
+        return os.path.join(snapshot, "mypy_cache")
+
+    def _warm_up(
+        self, backend: MypyBackend, flags: List[str], warm_dir: str
+    ) -> Optional[str]:
+        cache_dir = os.path.join(warm_dir, "mypy_cache")
+        warm_module = os.path.join(warm_dir, _WARM_MODULE)
+        os.makedirs(cache_dir)
+        with open(warm_module, "w", encoding="utf-8") as f:
+            f.writelines(f"import {package}\n" for package in self.packages_for(flags))
+        output = backend.run(flags + [f"--cache-dir={cache_dir}"], [warm_module])
+        # Errors in the imported packages do not spoil the cache
+        return cache_dir if output.returncode in (0, 1) else None
+
+    def close(self) -> None:
+        with self._lock:
+            tmp_dir, self._tmp_dir = self._tmp_dir, None
+            self._cache_dirs.clear()
+            self._expected.clear()
+            self._imports.clear()
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _make_read_only(path: str) -> None:
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            file_path = os.path.join(dirpath, filename)
+            mode = os.stat(file_path).st_mode
+            os.chmod(file_path, mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
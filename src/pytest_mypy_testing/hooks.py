@@ -0,0 +1,81 @@
+# SPDX-FileCopyrightText: David Fritzsche
+# SPDX-License-Identifier: Apache-2.0 OR MIT
+"""Hook specifications of the mypy-testing plugin.
+
+Plugins and ``conftest.py`` files implement these hooks to change the
+mypy command line, to run mypy in a custom way, or to cache results.
+The hooks may be called from worker threads if ``--mypy-testing-jobs``
+is used.
+"""
+
+from typing import TYPE_CHECKING, List, Mapping, Optional, Sequence, Union
+
+import pytest
+
+
+if TYPE_CHECKING:
+    from _pytest.config import Config
+
+    from .backends import MypyBackend, MypyOutput
+    from .message import Message
+
+
+@pytest.hookspec
+def pytest_mypy_testing_mypy_args(
+    config: "Config", path: str, mypy_args: List[str]
+) -> None:
+    """Adjust the mypy command line *mypy_args* for checking *path* in place.
+
+    The ``--shadow-file`` and ``--cache-dir`` options are appended
+    after this hook, so it sees the arguments that identify the result.
+    """
+
+
+@pytest.hookspec(firstresult=True)
+def pytest_mypy_testing_run_mypy(
+    config: "Config",
+    backend: "MypyBackend",
+    mypy_args: List[str],
+    filenames: List[str],
+    texts: Optional[Mapping[str, str]],
+) -> "Union[MypyOutput, Sequence[Message], None]":
+    """Run mypy for *filenames* with the command line *mypy_args*.
+
+    *texts* maps file names to the source text to check in place of the
+    file contents. Return the raw output of mypy or the parsed messages;
+    stops at the first non-`None` result. The default implementation
+    runs mypy with the selected *backend*.
+    """
+
+
+@pytest.hookspec(firstresult=True)
+def pytest_mypy_testing_lookup_result(
+    config: "Config",
+    path: str,
+    mypy_args: List[str],
+    mypy_version: Optional[str],
+    source_text: str,
+) -> "Optional[MypyOutput]":
+    """Return a stored mypy output for checking *source_text* as *path*.
+
+    Called before mypy (in version *mypy_version*) is run with the
+    command line *mypy_args*, which excludes temporary paths. Stops at
+    the first non-`None` result.
+    """
+
+
+@pytest.hookspec
+def pytest_mypy_testing_store_result(
+    config: "Config",
+    path: str,
+    mypy_args: List[str],
+    mypy_version: Optional[str],
+    source_text: str,
+    output: "MypyOutput",
+) -> None:
+    """Store the mypy *output* of checking *source_text* as *path*.
+
+    Called after mypy completed without a timeout, crash or other failure
+    (exit code 0 or 1), with the same arguments passed to
+    :func:`pytest_mypy_testing_lookup_result`.
+    """
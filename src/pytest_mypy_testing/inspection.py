@@ -0,0 +1,200 @@
+# SPDX-FileCopyrightText: David Fritzsche
+# SPDX-License-Identifier: Apache-2.0 OR MIT
+"""Check files expecting only revealed types with warm inspection engines.
+
+Files whose only expectations are revealed types (``# R:`` comments) are
+checked by a fine-grained incremental mypy engine (the engine behind
+``dmypy``) kept per set of mypy flags, so the standard library is only
+analyzed by the first check. The revealed types are then looked up at
+the position of the ``reveal_type`` arguments, the way ``dmypy inspect``
+does, instead of being parsed from the mypy output.
+"""
+
+import ast
+import os
+import shutil
+import tempfile
+import threading
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from .backends import MypyOutput
+from .message import Message, Severity
+from .output_processing import parse_messages
+from .parser import MypyTestFile
+
+
+__all__ = ["RevealInspector", "RevealSpan", "reveal_spans"]
+
+
+class RevealSpan(NamedTuple):
+    """Position of the argument of a ``reveal_type`` call (columns 1-based)."""
+
+    line: int
+    column: int
+    end_line: int
+    end_column: int
+
+
+def reveal_spans(mypy_file: MypyTestFile) -> Optional[List[RevealSpan]]:
+    """Return the positions of the types revealed by the ``reveal_type`` calls.
+
+    Returns `None` unless every expected message of *mypy_file* is a
+    revealed type on a line with exactly one ``reveal_type`` call.
+    """
+    if not mypy_file.source_lines or not mypy_file.messages:
+        return None
+    lines = set()
+    for msg in mypy_file.messages:
+        if msg.severity != Severity.NOTE or msg.revealed_type is None:
+            return None
+        lines.add(msg.lineno)
+
+    tree = ast.parse("\n".join(mypy_file.source_lines) + "\n")
+    spans: Dict[int, List[RevealSpan]] = {}
+    for node in ast.walk(tree):
+        if (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Name)
+            and node.func.id == "reveal_type"
+            and len(node.args) == 1
+            and not node.keywords
+        ):
+            arg = node.args[0]
+            end_line = getattr(arg, "end_lineno", None)
+            end_column = getattr(arg, "end_col_offset", None)
+            if end_line is None or end_column is None:  # pragma: no cover
+                return None
+            spans.setdefault(arg.lineno, []).append(
+                RevealSpan(arg.lineno, arg.col_offset + 1, end_line, end_column)
+            )
+    if any(len(spans.get(line, ())) != 1 for line in lines):
+        return None
+    return sorted(span for line_spans in spans.values() for span in line_spans)
+
+
+class _Engine:
+    """Fine-grained incremental mypy engine checking one file at a time."""
+
+    def __init__(self, flags: List[str]) -> None:
+        from mypy.dmypy_server import Server, process_start_options
+
+        self._tmp_dir = tempfile.mkdtemp(prefix="pytest-mypy-testing-inspect-")
+        options = process_start_options(flags, allow_sources=False)
+        self.server = Server(options, os.path.join(self._tmp_dir, "status.json"))
+        self.lock = threading.Lock()
+
+    def check(
+        self, filename: str, spans: Sequence[RevealSpan]
+    ) -> Optional[Tuple[MypyOutput, List[Message]]]:
+        """Check *filename* and inspect the types revealed at *spans*.
+
+        Returns the mypy output without the notes of the inspected
+        ``reveal_type`` calls and the messages with the inspected types.
+        Returns `None` if the file could not be checked incrementally.
+        """
+        from mypy.inspections import InspectionEngine
+        from mypy.types import TypeStrVisitor
+
+        response = self.server.cmd_check(
+            [filename], export_types=True, is_tty=False, terminal_width=80
+        )
+        manager = self.server.fine_grained_manager
+        if "error" in response or response.get("status") == 2 or manager is None:
+            return None
+        # Unlike dmypy inspect, also accept files without a Python extension
+        abs_filename = os.path.abspath(filename)
+        state = next(
+            (s for s in manager.graph.values() if s.abspath == abs_filename), None
+        )
+        if state is None or state.tree is None:
+            # Not part of the build, e.g. the file could not be read
+            return None
+        engine = InspectionEngine(manager)
+
+        def revealed_type(expression):
+            # Formats the type like mypy's reveal_type note
+            typ = manager.manager.all_types.get(expression)
+            if typ is None:
+                return "", False
+            return typ.accept(TypeStrVisitor(options=manager.manager.options)), True
+
+        revealed: Dict[Tuple[int, int], Message] = {}
+        for span in spans:
+            result = engine.run_inspection_by_exact_location(
+                state.tree, *span, revealed_type
+            )
+            if result.get("status") != 0:
+                continue
+            revealed[(span.line, span.column)] = Message(
+                abs_filename,
+                lineno=span.line,
+                colno=span.column,
+                severity=Severity.NOTE,
+                message="Revealed type is {!r}".format(result["out"]),
+                revealed_type=str(result["out"]),
+            )
+
+        out_lines = []
+        failed = False
+        for line in str(response.get("out", "")).splitlines():
+            messages = parse_messages([line])
+            if messages:
+                msg = messages[0]
+                if (
+                    msg.filename == abs_filename
+                    and msg.severity == Severity.NOTE
+                    and msg.revealed_type is not None
+                    and (msg.lineno, msg.colno) in revealed
+                ):
+                    continue
+                failed = failed or msg.severity != Severity.NOTE
+            out_lines.append(line + "\n")
+        output = MypyOutput(
+            "".join(out_lines), str(response.get("err", "")), int(failed)
+        )
+        return output, list(revealed.values())
+
+    def close(self) -> None:
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)
+
+
+class RevealInspector:
+    """Inspection engines checking files with only revealed type expectations.
+
+    Every set of mypy flags gets its own engine. Engines check one file
+    at a time, checks with different flags may run in parallel.
+    """
+
+    def __init__(self) -> None:
+        self._engines: Dict[Tuple[str, ...], Optional[_Engine]] = {}
+        self._lock = threading.Lock()
+
+    def check(
+        self, flags: List[str], filename: str, spans: Sequence[RevealSpan]
+    ) -> Optional[Tuple[MypyOutput, List[Message]]]:
+        """Check *filename* with *flags* and inspect the types revealed at *spans*.
+
+        See :meth:`_Engine.check` for the result. Returns `None` if dmypy
+        does not support *flags*.
+        """
+        key = tuple(flags)
+        with self._lock:
+            if key not in self._engines:
+                try:
+                    self._engines[key] = _Engine(list(flags))
+                except SystemExit:
+                    # Options not supported by dmypy, e.g. follow_imports=silent
+                    self._engines[key] = None
+            engine = self._engines[key]
+        if engine is None:
+            return None
+        with engine.lock:
+            return engine.check(filename, spans)
+
+    def close(self) -> None:
+        with self._lock:
+            engines = list(self._engines.values())
+            self._engines.clear()
+        for engine in engines:
+            if engine is not None:
+                engine.close()
@@ -0,0 +1,108 @@
+# SPDX-FileCopyrightText: David Fritzsche
+# SPDX-License-Identifier: Apache-2.0 OR MIT
+"""Check mypy test files with several mypy versions in one session.
+
+Every Python interpreter (or virtual environment) of the matrix has its
+own mypy installation. The mypy version of each interpreter is queried
+once per session and labels the items checked with it, e.g.
+``[mypy-1.19]mypy_test_foo``.
+"""
+
+import os
+import subprocess
+import sys
+from typing import List, NamedTuple, Optional, Sequence
+
+
+__all__ = [
+    "MypyVersion",
+    "detect_versions",
+    "installed_mypy_version",
+    "resolve_python",
+    "version_matches",
+]
+
+_VERSION_SCRIPT = "import importlib.metadata as m; print(m.version('mypy'))"
+
+
+class MypyVersion(NamedTuple):
+    #: Label of the items checked with this version, e.g. ``mypy-1.19``
+    label: str
+    #: Python interpreter running this version
+    python: str
+    #: Full version number of mypy, e.g. ``1.19.0``
+    version: str
+
+
+def resolve_python(path: str) -> str:
+    """Return the interpreter for *path*, which may be a virtual environment."""
+    if not os.path.isdir(path):
+        return path
+    if sys.platform == "win32":  # pragma: no cover
+        return os.path.join(path, "Scripts", "python.exe")
+    return os.path.join(path, "bin", "python")
+
+
+def detect_versions(pythons: Sequence[str]) -> List[MypyVersion]:
+    """Return the mypy version installed for each interpreter of *pythons*.
+
+    The interpreters are queried in parallel. Versions are labeled by
+    their major and minor version unless that is ambiguous. Raises
+    `ValueError` if an interpreter cannot run mypy or two interpreters
+    have the same mypy version.
+    """
+    pythons = [resolve_python(path) for path in pythons]
+    processes = []
+    for python in pythons:
+        try:
+            process = subprocess.Popen(
+                [python, "-c", _VERSION_SCRIPT],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                encoding="utf-8",
+            )
+        except OSError as e:
+            raise ValueError(f"Cannot run {python}: {e}") from None
+        processes.append(process)
+
+    versions = []
+    for python, process in zip(pythons, processes, strict=True):
+        out, err = process.communicate()
+        if process.returncode != 0:
+            raise ValueError(f"mypy is not installed for {python}: {err.strip()}")
+        versions.append(out.strip())
+
+    if len(set(versions)) < len(versions):
+        raise ValueError(f"Several interpreters have the same mypy version: {versions}")
+    short_versions = [".".join(version.split(".")[:2]) for version in versions]
+    if len(set(short_versions)) == len(short_versions):
+        labels = short_versions
+    else:
+        labels = versions
+    return [
+        MypyVersion(f"mypy-{label}", python, version)
+        for label, python, version in zip(labels, pythons, versions, strict=True)
+    ]
+
+
+def installed_mypy_version() -> Optional[str]:
+    """Return the version of mypy installed for the running interpreter."""
+    import importlib.metadata
+
+    try:
+        return importlib.metadata.version("mypy")
+    except importlib.metadata.PackageNotFoundError:  # pragma: no cover
+        return None
+
+
+def version_matches(version: Optional[str], specifier: str) -> bool:
+    """Return `True` if the mypy *version* satisfies the version *specifier*.
+
+    *specifier* is a comma separated list of version specifiers (PEP 440),
+    e.g. ``>=1.10,<1.19``. An unknown *version* matches any specifier.
+    """
+    from packaging.specifiers import SpecifierSet
+
+    if version is None:
+        return True
+    return SpecifierSet(specifier).contains(version, prereleases=True)
@@ -216,7 +216,8 @@ class Message:
         return self.to_string(prefix=f"{self._prefix} ")
 
     def to_string(self, prefix: Optional[str] = None) -> str:
-        prefix = prefix or f"{self._prefix} "
+        if prefix is None:
+            prefix = f"{self._prefix} "
         error_code = f"  [{self.error_code}]" if self.error_code else ""
         return f"{prefix}{self.severity.name.lower()}: {self.message}{error_code}"
 
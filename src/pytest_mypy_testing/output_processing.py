@@ -3,20 +3,27 @@
 
 import dataclasses
 import difflib
+import functools
 import itertools
-from typing import Dict, Iterator, List, Sequence, Tuple
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 
 from .message import Message, Severity
+from .parser import MypyTestItem
 from .strutil import common_prefix
 
 
 @dataclasses.dataclass
 class OutputMismatch:
+    """Mismatch between the actual and expected messages of a line.
+
+    The :attr:`error_message` and :attr:`lines` describing the mismatch
+    are only rendered when first accessed, as most mismatches of large
+    regressions are never shown.
+    """
+
     actual: List[Message] = dataclasses.field(default_factory=lambda: [])
     expected: List[Message] = dataclasses.field(default_factory=lambda: [])
     lineno: int = dataclasses.field(init=False, default=0)
-    lines: List[str] = dataclasses.field(init=False, default_factory=lambda: [])
-    error_message: str = dataclasses.field(init=False, default="")
 
     @property
     def actual_lineno(self) -> int:
@@ -42,12 +49,22 @@ class OutputMismatch:
             raise RuntimeError("No expected messages")
         return Severity(max(msg.severity.value for msg in self.expected))
 
-    def __post_init__(self) -> None:
-        def _fmt(msg: Message, actual_expected: str = "", *, indent: str = "  ") -> str:
-            if actual_expected:
-                actual_expected += ": "
-            return msg.to_string(prefix=f"{indent}{actual_expected}")
+    @property
+    def kind(self) -> str:
+        """Either ``"mismatch"``, ``"unexpected"`` or ``"missing"``."""
+        if self.actual and self.expected:
+            return "mismatch"
+        return "unexpected" if self.actual else "missing"
 
+    @property
+    def error_message(self) -> str:
+        return self._rendered[0]
+
+    @property
+    def lines(self) -> List[str]:
+        return self._rendered[1]
+
+    def __post_init__(self) -> None:
         if not any([self.actual, self.expected]):
             raise ValueError("At least one of actual and expected must be given")
 
@@ -56,12 +73,20 @@ class OutputMismatch:
         elif self.expected:
             self.lineno = self.expected_lineno
 
-        assert self.lines == []
-
         if self.actual and self.expected:
             if self.actual_lineno != self.expected_lineno:
                 raise ValueError("line numbers do not match")
-            self.error_message = f"{self.actual[0].severity} (mismatch):"
+
+    @functools.cached_property
+    def _rendered(self) -> Tuple[str, List[str]]:
+        def _fmt(msg: Message, actual_expected: str = "", *, indent: str = "  ") -> str:
+            if actual_expected:
+                actual_expected += ": "
+            return msg.to_string(prefix=f"{indent}{actual_expected}")
+
+        lines: List[str] = []
+        if self.actual and self.expected:
+            error_message = f"{self.actual[0].severity} (mismatch):"
             if len(self.actual) == len(self.expected) == 1:
                 sp = " " * len(
                     common_prefix(self.actual[0].message, self.expected[0].message)
@@ -69,28 +94,94 @@ class OutputMismatch:
                 sp_lines = [f"        {sp}^"]
             else:
                 sp_lines = []
-            self.lines = (
+            lines = (
                 [_fmt(msg, "A") for msg in self.actual]
                 + [_fmt(msg, "E") for msg in self.expected]
                 + sp_lines
             )
         elif self.actual:
             if len(self.actual) == 1:
-                self.error_message = (
+                error_message = (
                     f"{self.actual_severity} (unexpected): {self.actual[0].message}"
                 )
             else:
-                self.error_message = f"{self.actual_severity} (unexpected):"
-                self.lines = [_fmt(msg, "A") for msg in self.actual]
+                error_message = f"{self.actual_severity} (unexpected):"
+                lines = [_fmt(msg, "A") for msg in self.actual]
         else:
-            assert self.expected
             if len(self.expected) == 1:
-                self.error_message = (
+                error_message = (
                     f"{self.expected_severity} (missing): {self.expected[0].message}"
                 )
             else:
-                self.error_message = f"{self.expected_severity} (missing):"
-                self.lines = [_fmt(msg, "E") for msg in self.expected]
+                error_message = f"{self.expected_severity} (missing):"
+                lines = [_fmt(msg, "E") for msg in self.expected]
+        return error_message, lines
+
+
+def parse_messages(lines: Iterable[str]) -> List[Message]:
+    """Parse mypy output *lines*, ignoring all lines that are no messages."""
+    messages = []
+    for line in lines:
+        try:
+            messages.append(Message.from_output(line))
+        except ValueError:
+            pass
+    return messages
+
+
+def find_crash(returncode: int, lines: Sequence[str]) -> Optional[str]:
+    """Return the crash report if mypy crashed, `None` otherwise.
+
+    Mypy crashed if it failed (*returncode* 2 or higher) with a traceback
+    (``--show-traceback``) or without any message, e.g., because the
+    worker process running it died. Blocking errors like syntax errors
+    are no crash.
+    """
+    if returncode in (0, 1):
+        return None
+    for index, line in enumerate(lines):
+        if line.startswith("Traceback (most recent call last):") or (
+            ": error: INTERNAL ERROR" in line
+        ):
+            return "\n".join(lines[index:])
+    if not parse_messages(lines):
+        return "\n".join(lines) or f"mypy failed with exit code {returncode}"
+    return None
+
+
+_MISSING_IMPORTS_NOTE = (
+    "See https://mypy.readthedocs.io/en/stable/running_mypy.html#missing-imports"
+)
+
+
+def select_file_messages(messages: Iterable[Message], filename: str) -> List[Message]:
+    """Select the messages about *filename* which are relevant for tests."""
+    return [
+        msg
+        for msg in messages
+        if (msg.filename == filename)
+        and not (msg.severity is Severity.NOTE and msg.message == _MISSING_IMPORTS_NOTE)
+    ]
+
+
+def split_messages_by_item(
+    items: Sequence[MypyTestItem], messages: Iterable[Message]
+) -> Tuple[List[List[Message]], List[Message]]:
+    """Assign *messages* to the test *items* they belong to.
+
+    Return the list of messages of every item and the list of messages
+    not belonging to any item.
+    """
+    item_messages: List[List[Message]] = [[] for _ in items]
+    non_item_messages: List[Message] = []
+    for msg in messages:
+        for i, item in enumerate(items):
+            if item.lineno <= msg.lineno <= item.end_lineno:
+                item_messages[i].append(msg)
+                break
+        else:
+            non_item_messages.append(msg)
+    return item_messages, non_item_messages
 
 
 def diff_message_sequences(
@@ -4,18 +4,20 @@
 
 import ast
 import dataclasses
+import functools
 import io
 import itertools
 import os
 import pathlib
 import sys
 import tokenize
-from typing import Iterable, Iterator, List, Optional, Set, Tuple, Union
+import warnings
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
 
 from .message import Message
 
 
-__all__ = ["parse_file"]
+__all__ = ["parse_file", "parse_files"]
 
 
 @dataclasses.dataclass
@@ -26,7 +28,11 @@ class MypyTestItem:
     expected_messages: List[Message]
     func_node: Optional[Union[ast.FunctionDef, ast.AsyncFunctionDef]] = None
     marks: Set[str] = dataclasses.field(default_factory=lambda: set())
-    actual_messages: List[Message] = dataclasses.field(default_factory=lambda: [])
+    mark_kwargs: Dict[str, Dict[str, Any]] = dataclasses.field(
+        default_factory=lambda: {}
+    )
+    line_offset: int = 0
+    """Offset of the lines of a parametrized variant to its template."""
 
     @classmethod
     def from_ast_node(
@@ -34,6 +40,7 @@ class MypyTestItem:
         func_node: Union[ast.FunctionDef, ast.AsyncFunctionDef],
         marks: Optional[Set[str]] = None,
         unfiltered_messages: Optional[Iterable[Message]] = None,
+        mark_kwargs: Optional[Dict[str, Dict[str, Any]]] = None,
     ) -> "MypyTestItem":
         if not isinstance(func_node, (ast.FunctionDef, ast.AsyncFunctionDef)):
             raise ValueError(
@@ -60,6 +67,7 @@ class MypyTestItem:
             expected_messages=expected_messages,
             func_node=func_node,
             marks=(marks or set()),
+            mark_kwargs=(mark_kwargs or {}),
         )
 
 
@@ -69,6 +77,25 @@ class MypyTestFile:
     source_lines: List[str] = dataclasses.field(default_factory=lambda: [])
     items: List[MypyTestItem] = dataclasses.field(default_factory=lambda: [])
     messages: List[Message] = dataclasses.field(default_factory=lambda: [])
+    generated: bool = False
+    """`True` if *source_lines* contain expanded parametrized variants."""
+    imports: List[str] = dataclasses.field(default_factory=lambda: [])
+    """Top-level names of the modules imported with absolute imports."""
+
+    def reduced_source_lines(
+        self, selected: Iterable[str], source_lines: Optional[List[str]] = None
+    ) -> List[str]:
+        """Return the source lines with all items except *selected* blanked out.
+
+        Blank lines replace the removed items, so line numbers are preserved.
+        """
+        lines = list(self.source_lines if source_lines is None else source_lines)
+        selected = set(selected)
+        for item in self.items:
+            if item.name not in selected:
+                for lineno in range(item.lineno, min(item.end_lineno, len(lines)) + 1):
+                    lines[lineno - 1] = ""
+        return lines
 
 
 def iter_comments(
@@ -105,11 +132,83 @@ def generate_per_line_token_lists(source: str) -> Iterator[List[tokenize.TokenIn
 
 
 def parse_file(filename: Union[os.PathLike, str, pathlib.Path], config) -> MypyTestFile:
-    """Parse *filename* and return information about mypy test cases."""
+    """Parse *filename* and return information about mypy test cases.
+
+    Test functions with ``pytest.mark.parametrize`` marks are templates:
+    Every variant is appended to the source lines as a separate function
+    and the template itself is blanked out (see `expand_templates`).
+    Files not mentioning ``mypy_testing`` are neither tokenized nor parsed,
+    as they cannot contain test items.
+    """
     filename = pathlib.Path(filename).resolve()
     with open(filename, "r", encoding="utf-8") as f:
         source_text = f.read()
 
+    if "mypy_testing" not in source_text:
+        return MypyTestFile(
+            filename=str(filename), source_lines=source_text.splitlines()
+        )
+
+    expanded = expand_templates(source_text, filename=str(filename))
+    if expanded is None:
+        return _parse_source(filename, source_text)
+
+    generated_text, variants = expanded
+    mypy_file = _parse_source(filename, generated_text)
+    mypy_file.generated = True
+    for item in mypy_file.items:
+        if item.name in variants:
+            item.name, item.line_offset = variants[item.name]
+    # Report the variants in place of their templates
+    mypy_file.items.sort(key=lambda item: item.lineno - item.line_offset)
+    return mypy_file
+
+
+def parse_files(
+    filenames: Iterable[Union[os.PathLike, str, pathlib.Path]],
+    jobs: int,
+    *,
+    keep_ast: bool = True,
+) -> Dict[str, MypyTestFile]:
+    """Parse *filenames* in a pool of *jobs* worker processes.
+
+    Returns the parsed files by resolved file name. Files without test
+    items are returned without source lines. Files that cannot be parsed
+    are left out, so that parsing them again reports the error. The ASTs
+    of the test functions are dropped unless *keep_ast* is set.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    filenames = [str(filename) for filename in filenames]
+    # Several files per task to amortize the inter-process communication
+    chunksize = max(1, min(64, len(filenames) // (jobs * 4)))
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        results = pool.map(
+            functools.partial(_parse_in_worker, keep_ast=keep_ast),
+            filenames,
+            chunksize=chunksize,
+        )
+        return {
+            mypy_file.filename: mypy_file
+            for mypy_file in results
+            if mypy_file is not None
+        }
+
+
+def _parse_in_worker(filename: str, keep_ast: bool) -> Optional[MypyTestFile]:
+    try:
+        mypy_file = parse_file(filename, config=None)
+    except Exception:
+        return None
+    if not mypy_file.items:
+        return MypyTestFile(filename=mypy_file.filename)
+    if not keep_ast:
+        for item in mypy_file.items:
+            item.func_node = None
+    return mypy_file
+
+
+def _parse_source(filename: pathlib.Path, source_text: str) -> MypyTestFile:
     source_lines = source_text.splitlines()
     token_lists = list(generate_per_line_token_lists(source_text))
     messages = list(iter_mypy_comments(filename, token_lists))
@@ -127,7 +226,10 @@ def parse_file(filename: Union[os.PathLike, str, pathlib.Path], config) -> MypyT
         if "mypy_testing" in marks:
             items.append(
                 MypyTestItem.from_ast_node(
-                    node, marks=marks, unfiltered_messages=messages
+                    node,
+                    marks=marks,
+                    unfiltered_messages=messages,
+                    mark_kwargs=_find_mark_kwargs(node),
                 )
             )
 
@@ -136,7 +238,223 @@ def parse_file(filename: Union[os.PathLike, str, pathlib.Path], config) -> MypyT
         source_lines=source_lines,
         items=items,
         messages=messages,
+        imports=_imported_modules(tree),
+    )
+
+
+def _imported_modules(tree: ast.AST) -> List[str]:
+    names: Set[str] = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.partition(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names.add(node.module.partition(".")[0])
+    return sorted(names)
+
+
+def expand_templates(
+    source_text: str, filename: str = "<unknown>"
+) -> Optional[Tuple[str, Dict[str, Tuple[str, int]]]]:
+    """Expand the parametrized mypy test functions of *source_text*.
+
+    Every test function with ``pytest.mark.parametrize`` marks with literal
+    argument names and values is a template. For every combination of
+    values a copy of the template is appended to the source, with the
+    arguments removed from the signature and every use of an argument
+    name replaced by the value. String values are inserted as source code
+    (e.g. a type), all other values by their `repr`. In comments,
+    ``{name}`` is replaced as well, so that expected messages can refer
+    to the value. The templates are blanked out, keeping the line numbers
+    of all other lines. Functions whose parametrize marks cannot be
+    expanded are kept as plain functions with a warning.
+
+    Returns `None` if there are no templates, otherwise the generated
+    source and a mapping of the generated function names to the pytest
+    style variant names (like ``mypy_test_list[int]``) and the offsets
+    of the variants' lines to the lines of their templates.
+    """
+    if "parametrize" not in source_text:
+        return None
+    tree = ast.parse(source_text, filename=filename)
+    source_lines = source_text.splitlines()
+    lines = list(source_lines)
+    variants: Dict[str, Tuple[str, int]] = {}
+    for node in ast.iter_child_nodes(tree):
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        if "mypy_testing" not in _find_marks(node):
+            continue
+        parametrize_nodes = [
+            decorator
+            for name, decorator in _iter_func_decorators(node)
+            if name == "pytest.mark.parametrize"
+        ]
+        if not parametrize_nodes:
+            continue
+        start = min([node.lineno] + [dec.lineno for dec in node.decorator_list])
+        end = node.end_lineno or node.lineno
+        try:
+            template = _Template(node, source_lines[start - 1 : end], start, filename)
+            node_variants = list(_iter_variants(node, parametrize_nodes, filename))
+        except ValueError as e:
+            warnings.warn(f"{e}, checking it without parameters", stacklevel=2)
+            continue
+        for dec in parametrize_nodes:
+            template.blank(dec)
+        for index, (variant_id, values) in enumerate(node_variants):
+            generated_name = f"{node.name}__mypy_testing_{index}"
+            variants[generated_name] = (
+                f"{node.name}[{variant_id}]",
+                len(lines) + 1 - start,
+            )
+            lines.extend(template.instantiate(generated_name, values))
+        for lineno in range(start, end + 1):
+            lines[lineno - 1] = ""
+
+    if not variants:
+        return None
+    return "\n".join(lines) + "\n", variants
+
+
+class _Template:
+    def __init__(
+        self,
+        node: Union[ast.FunctionDef, ast.AsyncFunctionDef],
+        lines: List[str],
+        start: int,
+        filename: str,
+    ) -> None:
+        if not node.body or node.body[0].lineno == node.lineno:
+            raise ValueError(
+                f"{filename}:{node.lineno}: The body of the parametrized "
+                f"mypy test {node.name} must start on a separate line"
+            )
+        self.node = node
+        self.lines = list(lines)
+        self.start = start
+
+    def blank(self, node: ast.expr) -> None:
+        for lineno in range(node.lineno, (node.end_lineno or node.lineno) + 1):
+            self.lines[lineno - self.start] = ""
+
+    def instantiate(self, name: str, values: Dict[str, Any]) -> List[str]:
+        node = self.node
+        lines = list(self.lines)
+        for lineno in range(node.lineno, node.body[0].lineno):
+            lines[lineno - self.start] = ""
+        prefix = "async def" if isinstance(node, ast.AsyncFunctionDef) else "def"
+        returns = f" -> {ast.unparse(node.returns)}" if node.returns else ""
+        lines[node.lineno - self.start] = (
+            " " * node.col_offset + f"{prefix} {name}(){returns}:"
+        )
+        texts = {
+            key: value if isinstance(value, str) else repr(value)
+            for key, value in values.items()
+        }
+        return _substitute(lines, texts)
+
+
+def _substitute(lines: List[str], texts: Dict[str, str]) -> List[str]:
+    """Replace the names *texts* in the code and ``{name}`` in the comments."""
+    replacements: Dict[int, List[Tuple[int, int, str]]] = {}
+    prev: Optional[tokenize.TokenInfo] = None
+    source = "\n".join(lines) + "\n"
+    for tok in tokenize.generate_tokens(io.StringIO(source).readline):
+        (row, col), (_, end_col) = tok.start, tok.end
+        if tok.type == tokenize.NAME and tok.string in texts:
+            if prev is None or prev.string != ".":
+                replacements.setdefault(row, []).append(
+                    (col, end_col, texts[tok.string])
+                )
+        elif tok.type == tokenize.COMMENT:
+            comment = tok.string
+            for key, text in texts.items():
+                comment = comment.replace("{" + key + "}", text)
+            replacements.setdefault(row, []).append((col, end_col, comment))
+        if tok.type not in (tokenize.NL, tokenize.COMMENT):
+            prev = tok
+
+    result = list(lines)
+    for row, row_replacements in replacements.items():
+        line = result[row - 1]
+        for col, end_col, text in sorted(row_replacements, reverse=True):
+            line = line[:col] + text + line[end_col:]
+        result[row - 1] = line
+    return result
+
+
+def _iter_variants(
+    node: Union[ast.FunctionDef, ast.AsyncFunctionDef],
+    parametrize_nodes: List[ast.expr],
+    filename: str,
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Yield the ids and argument values of all variants of *node*.
+
+    Like pytest, the mark closest to the function varies slowest and
+    comes first in the ids.
+    """
+    parameter_sets = [
+        _get_parameter_set(node, dec, filename) for dec in reversed(parametrize_nodes)
+    ]
+    combinations = list(itertools.product(*parameter_sets))
+    ids = ["-".join(variant_id for variant_id, _ in combo) for combo in combinations]
+    duplicates = {variant_id for variant_id in ids if ids.count(variant_id) > 1}
+    for index, (variant_id, combo) in enumerate(zip(ids, combinations, strict=True)):
+        if variant_id in duplicates:
+            variant_id = f"{variant_id}{index}"
+        values: Dict[str, Any] = {}
+        for _, combo_values in combo:
+            values.update(combo_values)
+        yield variant_id, values
+
+
+def _get_parameter_set(
+    node: Union[ast.FunctionDef, ast.AsyncFunctionDef],
+    decorator: ast.expr,
+    filename: str,
+) -> List[Tuple[str, Dict[str, Any]]]:
+    error = ValueError(
+        f"{filename}:{node.lineno}: The parametrize mark of mypy test {node.name} "
+        "needs literal argument names and values"
+    )
+    if not isinstance(decorator, ast.Call):
+        raise error
+    arg_nodes: Dict[str, ast.AST] = dict(
+        zip(["argnames", "argvalues"], decorator.args[:2], strict=False)
     )
+    arg_nodes.update((kw.arg, kw.value) for kw in decorator.keywords if kw.arg)
+    try:
+        argnames = ast.literal_eval(arg_nodes["argnames"])
+        argvalues = ast.literal_eval(arg_nodes["argvalues"])
+        ids = ast.literal_eval(arg_nodes["ids"]) if "ids" in arg_nodes else None
+    except (KeyError, TypeError, ValueError, SyntaxError):
+        raise error from None
+    if isinstance(argnames, str):
+        argnames = [name.strip() for name in argnames.split(",") if name.strip()]
+    if len(argnames) == 1:
+        argvalues = [(value,) for value in argvalues]
+    if not all(
+        isinstance(value, tuple) and len(value) == len(argnames) for value in argvalues
+    ) or not (ids is None or len(ids) == len(argvalues)):
+        raise error
+
+    parameter_set = []
+    for index, values in enumerate(argvalues):
+        if ids is not None and ids[index] is not None:
+            variant_id = str(ids[index])
+        else:
+            variant_id = "-".join(
+                _value_id(name, value, index)
+                for name, value in zip(argnames, values, strict=True)
+            )
+        parameter_set.append((variant_id, dict(zip(argnames, values, strict=True))))
+    return parameter_set
+
+
+def _value_id(name: str, value: Any, index: int) -> str:
+    if isinstance(value, (str, int, float, complex, bool)) or value is None:
+        return str(value)
+    return f"{name}{index}"
 
 
 def _add_end_lineno_if_missing(tree, line_count: int):
@@ -158,9 +476,35 @@ def _find_marks(func_node: Union[ast.FunctionDef, ast.AsyncFunctionDef]) -> Set[
     }
 
 
+def _find_mark_kwargs(
+    func_node: Union[ast.FunctionDef, ast.AsyncFunctionDef],
+) -> Dict[str, Dict[str, Any]]:
+    """Return the literal keyword arguments of the pytest marks of *func_node*.
+
+    Keyword arguments whose value is not a Python literal are ignored.
+    """
+    return {
+        name.split(".", 2)[2]: _get_literal_kwargs(node)
+        for name, node in _iter_func_decorators(func_node)
+        if name.startswith("pytest.mark.") and isinstance(node, ast.Call)
+    }
+
+
+def _get_literal_kwargs(call_node: ast.Call) -> Dict[str, Any]:
+    kwargs: Dict[str, Any] = {}
+    for keyword in call_node.keywords:
+        if keyword.arg is None:
+            continue
+        try:
+            kwargs[keyword.arg] = ast.literal_eval(keyword.value)
+        except (TypeError, ValueError):
+            pass
+    return kwargs
+
+
 def _iter_func_decorators(
     func_node: Union[ast.FunctionDef, ast.AsyncFunctionDef],
-) -> Iterator[Tuple[str, ast.AST]]:
+) -> Iterator[Tuple[str, ast.expr]]:
     def dotted(*nodes):
         return ".".join(_get_node_name(node) for node in reversed(nodes))
 
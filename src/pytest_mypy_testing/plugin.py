@@ -1,41 +1,262 @@
 # SPDX-FileCopyrightText: 2020 David Fritzsche
 # SPDX-License-Identifier: Apache-2.0 OR MIT
 
+import argparse
+import dataclasses
+import functools
+import json
 import os
 import pathlib
+import shlex
 import tempfile
-from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+import time
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
 
-import mypy.api
 import pytest
 from _pytest._code.code import ReprEntry, ReprFileLocation
 from _pytest.config import Config
 from _pytest.python import path_matches_patterns
 
-from .message import Message, Severity
-from .output_processing import OutputMismatch, diff_message_sequences
-from .parser import MypyTestItem, parse_file
+from . import _import_start
+
+
+# Keep the import of the plugin cheap for projects without mypy tests:
+# mypy and the modules running it are only imported once needed.
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+
+    from .backends import MypyBackend, MypyOutput
+    from .caching import WarmCaches
+    from .inspection import RevealInspector
+    from .matrix import MypyVersion
+    from .message import Message
+    from .output_processing import OutputMismatch
+    from .parser import MypyTestFile, MypyTestItem
+    from .scheduling import MypyExecutor
+    from .worker import HookTiming
 
 
 PYTEST_VERSION = pytest.__version__
 PYTEST_VERSION_INFO = tuple(int(part) for part in PYTEST_VERSION.split(".")[:3])
 
+# Same as backends.BACKENDS
+BACKEND_NAMES = ("inprocess", "build", "subprocess", "forkserver")
+
+_backend_key: "pytest.StashKey[MypyBackend]" = pytest.StashKey()
+_terminable_backend_key: "pytest.StashKey[MypyBackend]" = pytest.StashKey()
+_executors_key: "pytest.StashKey[List[MypyExecutor]]" = pytest.StashKey()
+_matrix_key: "pytest.StashKey[List[MypyVersion]]" = pytest.StashKey()
+_version_backends_key: "pytest.StashKey[Dict[str, MypyBackend]]" = pytest.StashKey()
+_durations_key = pytest.StashKey[Dict[str, float]]()
+_warm_caches_key: "pytest.StashKey[WarmCaches]" = pytest.StashKey()
+_reveal_inspector_key: "pytest.StashKey[RevealInspector]" = pytest.StashKey()
+_mismatch_stats_key = pytest.StashKey["MismatchStats"]()
+_mismatch_records_key = pytest.StashKey[List[Dict[str, object]]]()
+_parsed_files_key: "pytest.StashKey[Dict[str, MypyTestFile]]" = pytest.StashKey()
+_hook_profile_key = pytest.StashKey[Dict[Tuple[str, Optional[str], str], List[float]]]()
+
+FlagsKey = Tuple[str, ...]
+
+# mypy options of the import-following policies for non-local modules
+FOLLOW_IMPORTS_FLAGS: Dict[str, Tuple[str, ...]] = {
+    # Analyze installed packages and report their errors
+    "full": ("--no-silence-site-packages",),
+    # Analyze installed packages, but silence their errors (mypy's default)
+    "silent": (),
+    # Treat imports of installed packages as Any without analyzing them
+    "skip": ("--no-site-packages", "--ignore-missing-imports"),
+}
+
 
 class MypyResult(NamedTuple):
     mypy_args: List[str]
     returncode: int
     output_lines: List[str]
-    file_messages: List[Message]
-    non_item_messages: List[Message]
+    file_messages: List["Message"]
+    non_item_messages: List["Message"]
+    duration: float = 0.0
+    crash: Optional["MypyCrash"] = None
+    timeout: Optional[float] = None
+    #: Messages of the checked test functions by name
+    item_messages: Optional[Dict[str, List["Message"]]] = None
+
+
+class MypyCrash:
+    """A crash of mypy while checking the test functions *items* of a file."""
+
+    def __init__(self, report: str, items: Set[str]) -> None:
+        self.report = report
+        self.items = items
+        self.reported_by: Optional[str] = None
+
+
+class MypyRun(NamedTuple):
+    mypy_args: List[str]
+    output: "MypyOutput"
+    duration: float
+    #: Timeout in seconds after which mypy was terminated, if it was
+    timeout: Optional[float] = None
+    #: Time spent in the hooks of the configured mypy plugins (if profiled)
+    hook_timings: Optional[List["HookTiming"]] = None
+    #: Messages with the revealed types inspected instead of parsed from
+    #: the output (see :mod:`pytest_mypy_testing.inspection`)
+    revealed_messages: Optional[List["Message"]] = None
+
+    def relocate(self, old_filename: str, new_filename: str) -> "MypyRun":
+        """Return a copy with *old_filename* replaced by *new_filename*."""
+        from .backends import MypyOutput
+
+        if old_filename == new_filename:
+            return self
+        # mypy reports files below the working directory by relative path
+        prefixes = {old_filename + ":"}
+        try:
+            prefixes.add(os.path.relpath(old_filename) + ":")
+        except ValueError:  # pragma: no cover  # different drive on Windows
+            pass
+
+        def fix_line(line: str) -> str:
+            for prefix in prefixes:
+                if line.startswith(prefix):
+                    return new_filename + line[len(prefix) - 1 :]
+            return line
+
+        def fix(text: str) -> str:
+            return "".join(map(fix_line, text.splitlines(keepends=True)))
+
+        out, err, returncode = self.output
+        hook_timings = self.hook_timings
+        if hook_timings is not None:
+            hook_timings = [
+                timing._replace(path=new_filename)
+                if timing.path == old_filename
+                else timing
+                for timing in hook_timings
+            ]
+        revealed_messages = self.revealed_messages
+        if revealed_messages is not None:
+            new_path = os.path.abspath(new_filename)
+            revealed_messages = [
+                dataclasses.replace(msg, filename=new_path) for msg in revealed_messages
+            ]
+        return MypyRun(
+            [new_filename if arg == old_filename else arg for arg in self.mypy_args],
+            MypyOutput(fix(out), fix(err), returncode),
+            self.duration,
+            self.timeout,
+            hook_timings,
+            revealed_messages,
+        )
+
+
+class SharedMypyRun:
+    """A mypy run shared by files with identical content and mypy flags.
+
+    Mypy runs for the first file only; the other files get a copy of its
+    output with the file name rewritten. The output is released once all
+    files have fetched it.
+    """
+
+    def __init__(self, files: List["PytestMypyFile"]) -> None:
+        self.files = files
+        self._run: Optional[MypyRun] = None
+        self._pending = len(files)
+
+    def get(
+        self, filename: Union[pathlib.Path, os.PathLike, str], flags_key: FlagsKey
+    ) -> MypyRun:
+        leader = self.files[0]
+        if self._run is None:
+            self._run = leader._own_run(leader.path, flags_key)
+        run = self._run.relocate(str(leader.path), str(filename))
+        self._pending -= 1
+        if self._pending <= 0:
+            self._run = None
+        return run
+
+
+class MismatchStats:
+    """Number of mismatches of the failed items of a session."""
+
+    def __init__(self) -> None:
+        self.items = 0
+        self.shown = 0
+        self.hidden = 0
 
 
 class MypyAssertionError(AssertionError):
-    def __init__(self, item, errors: Iterable[OutputMismatch]):
+    def __init__(self, item, errors: Iterable["OutputMismatch"]):
         super().__init__(item, errors)
         self.item = item
         self.errors = errors
 
 
+class MypyFileAssertionError(MypyAssertionError):
+    def __init__(self, item, errors_by_function: Dict[str, List["OutputMismatch"]]):
+        super().__init__(
+            item, [error for errors in errors_by_function.values() for error in errors]
+        )
+        self.errors_by_function = errors_by_function
+
+
+class MypyCrashError(AssertionError):
+    """Mypy crashed while checking the test function *name*.
+
+    Only the first failing test function of the file shows the crash report.
+    """
+
+    def __init__(self, name: str, crash: MypyCrash):
+        super().__init__(name, crash)
+        if crash.reported_by is None:
+            crash.reported_by = name
+        self.name = name
+        self.crash = crash
+
+    def __str__(self) -> str:
+        if self.crash.reported_by != self.name:
+            return f"mypy crashed, see {self.crash.reported_by}"
+        return f"mypy crashed\n{self.crash.report}"
+
+
+class MypyTimeoutError(AssertionError):
+    def __init__(self, duration: float, timeout: float):
+        super().__init__(duration, timeout)
+        self.duration = duration
+        self.timeout = timeout
+
+    def __str__(self) -> str:
+        return (
+            f"mypy was terminated after {self.duration:.2f} s, exceeding the "
+            f"timeout of {self.timeout:.2f} s"
+        )
+
+
+class MypyTimeBudgetError(AssertionError):
+    def __init__(self, item, duration: float, max_seconds: float):
+        super().__init__(item, duration, max_seconds)
+        self.item = item
+        self.duration = duration
+        self.max_seconds = max_seconds
+
+    def __str__(self) -> str:
+        return (
+            f"mypy took {self.duration:.2f} s, exceeding the "
+            f"time budget of {self.max_seconds:.2f} s"
+        )
+
+
 class PytestMypyTestItem(pytest.Item):
     parent: "PytestMypyFile"
 
@@ -44,7 +265,8 @@ class PytestMypyTestItem(pytest.Item):
         name: str,
         parent: "PytestMypyFile",
         *,
-        mypy_item: MypyTestItem,
+        mypy_item: "MypyTestItem",
+        mypy_version: Optional["MypyVersion"] = None,
         config: Optional[Config] = None,
         **kwargs,
     ) -> None:
@@ -53,49 +275,260 @@ class PytestMypyTestItem(pytest.Item):
         super().__init__(name, parent=parent, config=config, **kwargs)
         self.add_marker("mypy")
         self.mypy_item = mypy_item
+        self.mypy_version = mypy_version
         for mark in self.mypy_item.marks:
-            self.add_marker(mark)
+            mark_kwargs = self.mypy_item.mark_kwargs.get(mark)
+            if mark_kwargs:
+                self.add_marker(getattr(pytest.mark, mark)(**mark_kwargs))
+            else:
+                self.add_marker(mark)
 
     @classmethod
-    def from_parent(cls, parent, *, name=None, mypy_item=None):  # type: ignore
-        return super().from_parent(parent=parent, name=name, mypy_item=mypy_item)
+    def from_parent(  # type: ignore
+        cls, parent, *, name=None, mypy_item=None, mypy_version=None
+    ):
+        return super().from_parent(
+            parent=parent, name=name, mypy_item=mypy_item, mypy_version=mypy_version
+        )
 
     def runtest(self) -> None:
-        returncode, actual_messages = self.parent.run_mypy(self.mypy_item)
+        from .output_processing import diff_message_sequences
+
+        returncode, actual_messages = self.parent.run_mypy(
+            self.mypy_item, self.mypy_version
+        )
 
         errors = diff_message_sequences(
             actual_messages, self.mypy_item.expected_messages
         )
 
         if errors:
+            _record_mismatches(
+                self, self.mypy_item.name, self.mypy_item.line_offset, errors
+            )
             raise MypyAssertionError(item=self, errors=errors)
 
+        max_seconds = self.max_seconds
+        duration = self.parent.mypy_duration(self.mypy_version)
+        if max_seconds is not None and duration > max_seconds:
+            raise MypyTimeBudgetError(
+                item=self, duration=duration, max_seconds=max_seconds
+            )
+
+    def teardown(self) -> None:
+        self.parent.item_done()
+
+    @property
+    def max_seconds(self) -> Optional[float]:
+        """Time budget for type checking the file of this item.
+
+        Taken from the ``max_seconds`` argument of the ``mypy_testing``
+        marker, falling back to the ``mypy_testing_max_seconds`` ini value.
+        """
+        marker = self.get_closest_marker("mypy_testing")
+        if marker is not None and marker.kwargs.get("max_seconds") is not None:
+            return float(marker.kwargs["max_seconds"])
+        ini_value = self.config.getini("mypy_testing_max_seconds")
+        return float(ini_value) if ini_value else None
+
     def reportinfo(self) -> Tuple[Union["os.PathLike[str]", str], Optional[int], str]:
-        return self.parent.path, self.mypy_item.lineno, self.name
+        lineno = self.mypy_item.lineno - self.mypy_item.line_offset
+        return self.parent.path, lineno, self.name
 
     def repr_failure(self, excinfo, style=None):
+        if excinfo.errisinstance((MypyCrashError, MypyTimeoutError)):
+            return f"{self.parent.path}: {excinfo.value}"
+        if excinfo.errisinstance(MypyTimeBudgetError):
+            lineno = self.mypy_item.lineno - self.mypy_item.line_offset
+            return f"{self.parent.path}:{lineno}: {excinfo.value}"
         if not excinfo.errisinstance(MypyAssertionError):
             return super().repr_failure(excinfo, style=style)  # pragma: no cover
-        reprfileloc_key = "reprfileloc"
-        exception_repr = excinfo.getrepr(style="short")
-        exception_repr.reprcrash.message = ""
-        exception_repr.reprtraceback.reprentries = [
-            ReprEntry(
-                lines=mismatch.lines,
-                style="short",
-                reprlocals=None,
-                reprfuncargs=None,
-                **{
-                    reprfileloc_key: ReprFileLocation(
-                        path=str(self.parent.path),
-                        lineno=mismatch.lineno,
-                        message=mismatch.error_message,
-                    )
-                },
-            )
-            for mismatch in excinfo.value.errors
+        return _repr_mismatches(
+            self,
+            excinfo,
+            [("", self.mypy_item.line_offset, error) for error in excinfo.value.errors],
+        )
+
+
+class PytestMypyFileItem(pytest.Item):
+    """A single item checking all test functions of a file.
+
+    Used with the ini value ``mypy_testing_granularity = file``. Test
+    functions marked with ``skip`` are not checked, mismatches of test
+    functions marked with ``xfail`` are ignored.
+    """
+
+    parent: "PytestMypyFile"
+
+    def __init__(
+        self,
+        name: str,
+        parent: "PytestMypyFile",
+        *,
+        mypy_version: Optional["MypyVersion"] = None,
+        config: Optional[Config] = None,
+        **kwargs,
+    ) -> None:
+        if config is None:
+            config = parent.config
+        super().__init__(name, parent=parent, config=config, **kwargs)
+        self.add_marker("mypy")
+        self.mypy_version = mypy_version
+
+    def runtest(self) -> None:
+        from .output_processing import diff_message_sequences
+
+        errors_by_function: Dict[str, List["OutputMismatch"]] = {}
+        for mypy_item in self.parent.mypy_file.items:
+            if "skip" in mypy_item.marks or self.parent.version_skip_reason(
+                mypy_item, self.mypy_version
+            ):
+                continue
+            returncode, actual_messages = self.parent.run_mypy(
+                mypy_item, self.mypy_version
+            )
+            errors = diff_message_sequences(
+                actual_messages, mypy_item.expected_messages
+            )
+            if errors and "xfail" not in mypy_item.marks:
+                _record_mismatches(self, mypy_item.name, mypy_item.line_offset, errors)
+                errors_by_function[mypy_item.name] = errors
+
+        if errors_by_function:
+            raise MypyFileAssertionError(self, errors_by_function)
+
+        max_seconds = self.max_seconds
+        duration = self.parent.mypy_duration(self.mypy_version)
+        if max_seconds is not None and duration > max_seconds:
+            raise MypyTimeBudgetError(
+                item=self, duration=duration, max_seconds=max_seconds
+            )
+
+    def teardown(self) -> None:
+        self.parent.item_done()
+
+    @property
+    def max_seconds(self) -> Optional[float]:
+        """Smallest time budget of the test functions of the file."""
+        budgets = [
+            float(mypy_item.mark_kwargs["mypy_testing"]["max_seconds"])
+            for mypy_item in self.parent.mypy_file.items
+            if mypy_item.mark_kwargs.get("mypy_testing", {}).get("max_seconds")
+            is not None
         ]
-        return exception_repr
+        ini_value = self.config.getini("mypy_testing_max_seconds")
+        if ini_value:
+            budgets.append(float(ini_value))
+        return min(budgets) if budgets else None
+
+    def reportinfo(self) -> Tuple[Union["os.PathLike[str]", str], Optional[int], str]:
+        return self.parent.path, 0, self.name
+
+    def repr_failure(self, excinfo, style=None):
+        if excinfo.errisinstance(
+            (MypyCrashError, MypyTimeoutError, MypyTimeBudgetError)
+        ):
+            return f"{self.parent.path}: {excinfo.value}"
+        if not excinfo.errisinstance(MypyFileAssertionError):
+            return super().repr_failure(excinfo, style=style)  # pragma: no cover
+        line_offsets = {
+            mypy_item.name: mypy_item.line_offset
+            for mypy_item in self.parent.mypy_file.items
+        }
+        return _repr_mismatches(
+            self,
+            excinfo,
+            [
+                (f"{name}: ", line_offsets[name], error)
+                for name, errors in excinfo.value.errors_by_function.items()
+                for error in errors
+            ],
+        )
+
+
+def _repr_mismatches(
+    item: pytest.Item, excinfo, errors: List[Tuple[str, int, "OutputMismatch"]]
+):
+    """Represent the mismatches *errors* with an optional message prefix each.
+
+    The line numbers of the mismatches are reduced by the line offset of
+    each error, mapping the lines of parametrized variants to their template.
+    At most ``mypy_testing_max_mismatches`` mismatches are shown per item
+    and ``mypy_testing_max_session_mismatches`` per session, followed by
+    the number of mismatches not shown.
+    """
+    config = item.config
+    stats = config.stash.setdefault(_mismatch_stats_key, MismatchStats())
+    limit = len(errors)
+    max_mismatches = int(config.getini("mypy_testing_max_mismatches") or 0)
+    if max_mismatches > 0:
+        limit = min(limit, max_mismatches)
+    max_session_mismatches = int(
+        config.getini("mypy_testing_max_session_mismatches") or 0
+    )
+    if max_session_mismatches > 0:
+        limit = min(limit, max(max_session_mismatches - stats.shown, 0))
+    stats.items += 1
+    stats.shown += limit
+    stats.hidden += len(errors) - limit
+
+    path = str(item.path)
+    exception_repr = excinfo.getrepr(style="short")
+    exception_repr.reprcrash.message = ""
+    entries = [
+        _repr_entry(
+            mismatch.lines,
+            path,
+            mismatch.lineno - line_offset,
+            prefix + mismatch.error_message,
+        )
+        for prefix, line_offset, mismatch in errors[:limit]
+    ]
+    if limit < len(errors):
+        _, line_offset, mismatch = errors[limit]
+        entries.append(
+            _repr_entry(
+                [],
+                path,
+                mismatch.lineno - line_offset,
+                f"... {len(errors) - limit} more mismatch(es) not shown",
+            )
+        )
+    exception_repr.reprtraceback.reprentries = entries
+    return exception_repr
+
+
+def _repr_entry(lines: List[str], path: str, lineno: int, message: str) -> ReprEntry:
+    reprfileloc_key = "reprfileloc"
+    return ReprEntry(
+        lines=lines,
+        style="short",
+        reprlocals=None,
+        reprfuncargs=None,
+        **{
+            reprfileloc_key: ReprFileLocation(path=path, lineno=lineno, message=message)
+        },
+    )
+
+
+def _record_mismatches(
+    item: pytest.Item, name: str, line_offset: int, errors: List["OutputMismatch"]
+) -> None:
+    """Record *errors* of the test function *name* for the JSON report."""
+    if item.config.option.mypy_testing_json_report is None:
+        return
+    records = item.config.stash.setdefault(_mismatch_records_key, [])
+    for mismatch in errors:
+        records.append(
+            {
+                "nodeid": item.nodeid,
+                "function": name,
+                "line": mismatch.lineno - line_offset,
+                "kind": mismatch.kind,
+                "actual": [msg.to_string(prefix="") for msg in mismatch.actual],
+                "expected": [msg.to_string(prefix="") for msg in mismatch.expected],
+            }
+        )
 
 
 class PytestMypyFile(pytest.File):
@@ -118,90 +551,696 @@ class PytestMypyFile(pytest.File):
             **kwargs,
         )
         self.add_marker("mypy")
-        self.mypy_file = parse_file(self.path, config=config)
-        self._mypy_result: Optional[MypyResult] = None
+        parsed_files = config.stash.get(_parsed_files_key, None) if config else None
+        mypy_file = None
+        if parsed_files:
+            mypy_file = parsed_files.pop(str(self.path.resolve()), None)
+        if mypy_file is None:
+            from .parser import parse_file
+
+            mypy_file = parse_file(self.path, config=config)
+        self.mypy_file = mypy_file
+        self._mypy_results: Dict[FlagsKey, MypyResult] = {}
+        self._version_results: Dict[str, Dict[FlagsKey, MypyResult]] = {}
+        self._mypy_futures: Dict[Tuple[Optional[str], FlagsKey], "Future[MypyRun]"] = {}
+        self._mypy_share: Optional[SharedMypyRun] = None
+        self._selected: Optional[Set[str]] = None
+        self._pending_items: Optional[int] = None
         args = getattr(config, "option", None)
         self._config_file: Optional[str] = getattr(args, "mypy_config_file", None)
+        self._dir_flags = _directory_flags(config, self.path) if config else []
+        self._follow_imports = (
+            _follow_imports_policy(config, self.path) if config else "full"
+        )
+        self._lean = bool(config.getini("mypy_testing_lean")) if config else False
+        self._granularity = (
+            config.getini("mypy_testing_granularity") if config else "function"
+        )
 
     @classmethod
     def from_parent(cls, parent, **kwargs):
         return super().from_parent(parent=parent, **kwargs)
 
-    def collect(self) -> Iterator[PytestMypyTestItem]:
-        for item in self.mypy_file.items:
-            yield PytestMypyTestItem.from_parent(
-                parent=self, name="[mypy]" + item.name, mypy_item=item
-            )
+    def collect(self) -> Iterator[Union[PytestMypyTestItem, PytestMypyFileItem]]:
+        versions: List[Optional["MypyVersion"]] = [None]
+        if self.config is not None:
+            versions = list(self.config.stash.get(_matrix_key, versions))
+        for version in versions:
+            label = "mypy" if version is None else version.label
+            if self._granularity == "file":
+                yield PytestMypyFileItem.from_parent(
+                    parent=self, name=f"[{label}-file]", mypy_version=version
+                )
+                continue
+            for item in self.mypy_file.items:
+                test_item = PytestMypyTestItem.from_parent(
+                    parent=self,
+                    name=f"[{label}]{item.name}",
+                    mypy_item=item,
+                    mypy_version=version,
+                )
+                reason = self.version_skip_reason(item, version)
+                if reason is not None:
+                    test_item.add_marker(pytest.mark.skip(reason=reason))
+                yield test_item
+        if self._lean:
+            for item in self.mypy_file.items:
+                item.func_node = None
+
+    def expect_items(self, count: int) -> None:
+        """Announce that *count* items of this file are going to run."""
+        self._pending_items = count
 
-    def run_mypy(self, item: MypyTestItem) -> Tuple[int, List[Message]]:
-        if self._mypy_result is None:
-            self._mypy_result = self._run_mypy(self.path)
+    def item_done(self) -> None:
+        """Release the mypy results once the last announced item has run.
+
+        The items of a file need not run consecutively (e.g. with
+        ``--failed-first``), so pytest tearing down the file node does not
+        mean that all of them have run.
+        """
+        if self._pending_items is None:
+            return
+        self._pending_items -= 1
+        if self._pending_items <= 0 and self._lean:
+            self._mypy_results.clear()
+            self._version_results.clear()
+            self.mypy_file.source_lines = []
+
+    def version_skip_reason(
+        self, item: "MypyTestItem", version: Optional["MypyVersion"] = None
+    ) -> Optional[str]:
+        """Return why *item* is not checked with the mypy *version* (if it is not).
+
+        Test functions are restricted to some mypy versions by the
+        ``mypy_versions`` argument of their ``mypy_testing`` marker.
+        `None` stands for the mypy version of the pytest interpreter.
+        """
+        specifier = item.mark_kwargs.get("mypy_testing", {}).get("mypy_versions")
+        if specifier is None:
+            return None
+        from .matrix import installed_mypy_version, version_matches
+
+        number = installed_mypy_version() if version is None else version.version
+        if version_matches(number, specifier):
+            return None
+        return f"requires mypy{specifier}, got mypy {number}"
+
+    def run_mypy(
+        self, item: "MypyTestItem", version: Optional["MypyVersion"] = None
+    ) -> Tuple[int, List["Message"]]:
+        flags_key = tuple(self.mypy_flags(item))
+        results = self._results(version)
+        result = results.get(flags_key)
+        if result is None:
+            result = results[flags_key] = self._run_mypy(self.path, flags_key, version)
+        if result.timeout is not None:
+            raise MypyTimeoutError(result.duration, result.timeout)
+        if result.crash is not None and item.name in result.crash.items:
+            raise MypyCrashError(item.name, result.crash)
+        item_messages = (result.item_messages or {}).get(item.name, [])
         return (
-            self._mypy_result.returncode,
+            result.returncode,
             sorted(
-                item.actual_messages + self._mypy_result.non_item_messages,
+                item_messages + result.non_item_messages,
                 key=lambda msg: msg.lineno,
             ),
         )
 
-    def _run_mypy(self, filename: Union[pathlib.Path, os.PathLike, str]) -> MypyResult:
-        filename = pathlib.Path(filename)
+    def _results(self, version: Optional["MypyVersion"]) -> Dict[FlagsKey, MypyResult]:
+        if version is None:
+            return self._mypy_results
+        return self._version_results.setdefault(version.label, {})
+
+    def mypy_duration(self, version: Optional["MypyVersion"] = None) -> float:
+        """Wall clock time in seconds spent in the mypy *version* for this file."""
+        return sum(result.duration for result in self._results(version).values())
+
+    def mypy_flags(self, item: Optional["MypyTestItem"] = None) -> List[str]:
+        """Return the mypy command line options except the cache directory.
+
+        These are the fixed options of the plugin (including those of the
+        import-following policy of the file) followed by the options for
+        the directory of the file and the options of the ``flags``
+        argument of *item*'s ``mypy_testing`` marker.
+        """
+        flags: List[str] = []
+        if self._config_file:
+            flags.append("--config-file={}".format(self._config_file))
+        flags += [
+            "--check-untyped-defs",
+            "--hide-error-context",
+            "--no-color-output",
+            "--no-error-summary",
+            "--no-pretty",
+            "--soft-error-limit=-1",
+            *FOLLOW_IMPORTS_FLAGS[self._follow_imports],
+            "--no-warn-unused-configs",
+            "--show-column-numbers",
+            "--show-error-codes",
+            "--show-traceback",
+        ]
+        flags += self._dir_flags
+        if item is not None:
+            item_flags = item.mark_kwargs.get("mypy_testing", {}).get("flags", [])
+            if isinstance(item_flags, str):
+                item_flags = shlex.split(item_flags)
+            flags += item_flags
+        return flags
+
+    def mypy_args(
+        self, flags_key: FlagsKey, filename: Optional[pathlib.Path] = None
+    ) -> List[str]:
+        """Return the mypy arguments for checking the group *flags_key*.
+
+        These are the options of the group as modified by the
+        ``pytest_mypy_testing_mypy_args`` hook.
+        """
+        mypy_args = list(flags_key)
+        self.config.hook.pytest_mypy_testing_mypy_args(
+            config=self.config,
+            path=str(self.path if filename is None else filename),
+            mypy_args=mypy_args,
+        )
+        return mypy_args
+
+    def mypy_timeout(self, names: Optional[Set[str]] = None) -> Optional[float]:
+        """Return the timeout in seconds for checking the test functions *names*.
+
+        This is the largest timeout of these functions: the ``timeout``
+        argument of their ``mypy_testing`` marker, falling back to the
+        ``--mypy-testing-timeout`` option and the ``mypy_testing_timeout``
+        ini value. `None` (or 0) means no timeout.
+        """
+        timeouts: List[Optional[float]] = []
+        default_used = False
+        for item in self.mypy_file.items:
+            if names is not None and item.name not in names:
+                continue
+            timeout = item.mark_kwargs.get("mypy_testing", {}).get("timeout")
+            if timeout is not None:
+                timeouts.append(float(timeout))
+            elif not default_used:
+                timeouts.append(self._default_timeout())
+                default_used = True
+        if not timeouts or not all(timeouts):
+            return None
+        return max(timeout for timeout in timeouts if timeout)
+
+    def _default_timeout(self) -> Optional[float]:
+        timeout = getattr(self.config.option, "mypy_testing_timeout", None)
+        if timeout is None:
+            ini_value = self.config.getini("mypy_testing_timeout")
+            timeout = float(ini_value) if ini_value else None
+        return timeout
+
+    def flag_groups(self) -> Dict[FlagsKey, Optional[Set[str]]]:
+        """Group the selected test items by their mypy options.
+
+        Maps the options of each group to the names of its items, or to
+        `None` if a single group contains all items.
+        """
+        groups: Dict[FlagsKey, Set[str]] = {}
+        for item in self.mypy_file.items:
+            if self._selected is None or item.name in self._selected:
+                groups.setdefault(tuple(self.mypy_flags(item)), set()).add(item.name)
+        if not groups:
+            return {tuple(self.mypy_flags()): self._selected}
+        if len(groups) == 1 and self._selected is None:
+            return dict.fromkeys(groups)
+        selected_groups: Dict[FlagsKey, Optional[Set[str]]] = dict(groups)
+        return selected_groups
+
+    def select_items(self, names: Optional[Iterable[str]]) -> None:
+        """Only type check the test items *names* (`None` selects all).
+
+        The other items are blanked out of the checked module.
+        """
+        self._selected = None if names is None else set(names)
+
+    def source_text(self, selected: Optional[Set[str]] = None) -> str:
+        """Return the source text to be type checked.
+
+        All test items except *selected* are blanked out (if given).
+        """
+        source_lines = self.mypy_file.source_lines
+        if not source_lines and (selected is not None or self.mypy_file.generated):
+            # Released in lean mode, but needed to check the file again
+            from .parser import parse_file
+
+            source_lines = parse_file(self.path, config=self.config).source_lines
+        if selected is not None:
+            source_lines = self.mypy_file.reduced_source_lines(selected, source_lines)
+        return "\n".join(source_lines) + "\n" if source_lines else ""
+
+    def content_key(self) -> Optional[Tuple[str, ...]]:
+        """Return a key identifying files with equal content and flags.
+
+        Returns `None` for Python files, as their module names (and thus
+        mypy's output) depend on their location.
+        """
+        groups = self.flag_groups()
+        if (
+            self.path.suffix == ".py"
+            or not self.mypy_file.source_lines
+            or len(groups) != 1
+        ):
+            return None
+        import hashlib
+
+        ((flags_key, selected),) = groups.items()
+        digest = hashlib.sha256(self.source_text(selected).encode("utf-8")).hexdigest()
+        return (digest, *flags_key)
+
+    def share_run(self, share: SharedMypyRun) -> None:
+        """Get the mypy output from *share* instead of running mypy."""
+        self._mypy_share = share
+
+    def prefetch(
+        self,
+        flags_key: FlagsKey,
+        future: "Future[MypyRun]",
+        version: Optional["MypyVersion"] = None,
+    ) -> None:
+        """Use the result of *future* instead of running mypy on demand."""
+        label = None if version is None else version.label
+        self._mypy_futures[(label, flags_key)] = future
+
+    def check(
+        self,
+        backend: "MypyBackend",
+        filename: Union[pathlib.Path, os.PathLike, str, None] = None,
+        flags_key: Optional[FlagsKey] = None,
+        items: Optional[Set[str]] = None,
+        version: Optional["MypyVersion"] = None,
+    ) -> MypyRun:
+        """Run mypy with *backend* for the items with the options *flags_key*.
+
+        Only the test functions *items* are checked if given. Mypy is
+        terminated once it exceeds the timeout of the checked functions.
+        *backend* must run the mypy *version* (if given). Only reads the
+        file's state, so it may run in a worker thread.
+        """
+        from .backends import MypyOutput, run_with_timeout
+
+        filename = pathlib.Path(self.path if filename is None else filename)
+        groups = self.flag_groups()
+        if flags_key is None:
+            flags_key = next(iter(groups))
+        selected = groups.get(flags_key, set()) if items is None else items
+        timeout = self.mypy_timeout(selected)
+        if timeout is not None and not backend.terminable:
+            backend = _get_backend(self.config, terminable=True, version=version)
+        texts = {}
+        source_text = self.source_text(selected)
+        if source_text:
+            texts[str(filename)] = source_text
+
+        hook = self.config.hook
+        mypy_args = self.mypy_args(flags_key, filename)
+        if version is None:
+            from .matrix import installed_mypy_version
+
+            mypy_version = installed_mypy_version()
+        else:
+            mypy_version = version.version
+        result_key = {
+            "config": self.config,
+            "path": str(filename),
+            "mypy_args": list(mypy_args),
+            "mypy_version": mypy_version,
+            "source_text": source_text or filename.read_text(encoding="utf-8"),
+        }
+        output = hook.pytest_mypy_testing_lookup_result(**result_key)
+        if output is not None:
+            return MypyRun(mypy_args + [str(filename)], output, 0.0)
+        if (
+            version is None
+            and timeout is None
+            and selected is None
+            and not self.mypy_file.generated
+            and not backend.profile_plugin_hooks
+        ):
+            inspected = self._inspect(filename, mypy_args)
+            if inspected is not None:
+                return inspected
+
+        def run(flags, filenames, texts):
+            return _as_output(
+                hook.pytest_mypy_testing_run_mypy(
+                    config=self.config,
+                    backend=backend,
+                    mypy_args=flags,
+                    filenames=filenames,
+                    texts=texts,
+                )
+            )
+
         with tempfile.TemporaryDirectory(prefix="pytest-mypy-testing-") as tmp_dir_name:
             mypy_cache_dir = os.path.join(tmp_dir_name, "mypy_cache")
             os.makedirs(mypy_cache_dir)
+            warm_caches = None
+            if version is None:
+                warm_caches = _get_warm_caches(self.config, backend)
+            if warm_caches is not None:
+                warm_caches.seed(backend, mypy_args, mypy_cache_dir)
 
-            mypy_args: List[str] = []
-            if self._config_file:
-                mypy_args.append("--config-file={}".format(self._config_file))
-            mypy_args += [
-                "--cache-dir={}".format(mypy_cache_dir),
-                "--check-untyped-defs",
-                "--hide-error-context",
-                "--no-color-output",
-                "--no-error-summary",
-                "--no-pretty",
-                "--soft-error-limit=-1",
-                "--no-silence-site-packages",
-                "--no-warn-unused-configs",
-                "--show-column-numbers",
-                "--show-error-codes",
-                "--show-traceback",
-                str(filename),
-            ]
+            run_args = list(mypy_args)
+            if selected is not None or self.mypy_file.generated:
+                # Check the reduced or generated module in place of the file
+                shadow_file = os.path.join(tmp_dir_name, filename.name)
+                with open(shadow_file, "w", encoding="utf-8") as f:
+                    f.write(source_text)
+                run_args += ["--shadow-file", str(filename), shadow_file]
+            run_args.append("--cache-dir={}".format(mypy_cache_dir))
+
+            start = time.perf_counter()
+            output = run_with_timeout(
+                backend, run_args, [str(filename)], texts, timeout, run=run
+            )
+            duration = time.perf_counter() - start
+            run_args.append(str(filename))
 
-            out, err, returncode = mypy.api.run(mypy_args)
+        hook_timings = None
+        if backend.profile_plugin_hooks:
+            hook_timings = backend.take_hook_timings()
+        if output is None:
+            return MypyRun(run_args, MypyOutput("", "", 2), duration, timeout)
+        if output.returncode in (0, 1):
+            # Do not cache crashes, dead workers and other failures
+            hook.pytest_mypy_testing_store_result(**result_key, output=output)
+        return MypyRun(run_args, output, duration, hook_timings=hook_timings)
 
-        lines = (out + err).splitlines()
+    def _inspect(
+        self, filename: pathlib.Path, mypy_args: List[str]
+    ) -> Optional[MypyRun]:
+        """Check the file with the session's inspection engine (if enabled).
+
+        Returns `None` unless all expected messages are revealed types
+        and the engine could check the file.
+        """
+        inspector = _get_reveal_inspector(self.config)
+        if inspector is None:
+            return None
+        from .inspection import reveal_spans
 
-        file_messages = [
-            msg
-            for msg in map(Message.from_output, lines)
-            if (msg.filename == self.mypy_file.filename)
-            and not (
-                msg.severity is Severity.NOTE
-                and msg.message
-                == "See https://mypy.readthedocs.io/en/stable/running_mypy.html#missing-imports"
+        spans = reveal_spans(self.mypy_file)
+        if spans is None:
+            return None
+        start = time.perf_counter()
+        result = inspector.check(mypy_args, str(filename), spans)
+        if result is None:
+            return None
+        output, revealed_messages = result
+        return MypyRun(
+            mypy_args + [str(filename)],
+            output,
+            time.perf_counter() - start,
+            revealed_messages=revealed_messages,
+        )
+
+    def _own_run(
+        self,
+        filename: Union[pathlib.Path, os.PathLike, str],
+        flags_key: FlagsKey,
+        version: Optional["MypyVersion"] = None,
+    ) -> MypyRun:
+        label = None if version is None else version.label
+        future = self._mypy_futures.pop((label, flags_key), None)
+        if future is not None and not future.cancelled():
+            return future.result()
+        backend = _get_backend(self.config, version=version)
+        return self.check(backend, filename, flags_key, version=version)
+
+    def _run_mypy(
+        self,
+        filename: Union[pathlib.Path, os.PathLike, str],
+        flags_key: Optional[FlagsKey] = None,
+        version: Optional["MypyVersion"] = None,
+    ) -> MypyResult:
+        if flags_key is None:
+            flags_key = next(iter(self.flag_groups()))
+        if self._mypy_share is not None:
+            run = self._mypy_share.get(filename, flags_key)
+        else:
+            run = self._own_run(filename, flags_key, version)
+        mypy_args, (out, err, returncode) = run.mypy_args, run.output
+        duration, timeout = run.duration, run.timeout
+        if run.hook_timings:
+            self._record_hook_timings(run.hook_timings, version)
+        if self._selected is None:
+            # Record the time for checking all groups of the file
+            durations = self.config.stash.setdefault(_durations_key, {})
+            durations[self.nodeid] = round(
+                duration
+                + sum(
+                    result.duration
+                    for key, result in self._results(version).items()
+                    if key != flags_key
+                ),
+                3,
             )
-        ]
 
-        non_item_messages = []
+        from .output_processing import find_crash
 
-        for msg in file_messages:
-            for item in self.mypy_file.items:
-                if item.lineno <= msg.lineno <= item.end_lineno:
-                    item.actual_messages.append(msg)
-                    break
-            else:
-                non_item_messages.append(msg)
+        lines = (out + err).splitlines()
+        if timeout is not None:
+            return MypyResult(
+                mypy_args, returncode, [], [], [], duration=duration, timeout=timeout
+            )
+        report = find_crash(returncode, lines)
+        crash = None
+        if report is None:
+            runs: List[Tuple[List[str], Optional[Set[str]]]] = [(lines, None)]
+        else:
+            names = self._group_items(flags_key)
+            crash = MypyCrash(report, set(names))
+            runs = []
+            if self.config.getini("mypy_testing_bisect_crashes") and len(names) > 1:
+                crash.items, runs = self._bisect_crash(
+                    filename, flags_key, names, version
+                )
 
+        item_messages, file_messages, non_item_messages = self._assign_messages(
+            runs, run.revealed_messages or ()
+        )
         return MypyResult(
             mypy_args=mypy_args,
             returncode=returncode,
-            output_lines=lines,
+            output_lines=[] if self._lean else lines,
             file_messages=file_messages,
             non_item_messages=non_item_messages,
+            duration=duration,
+            crash=crash,
+            item_messages=item_messages,
         )
 
+    def _record_hook_timings(
+        self, timings: List["HookTiming"], version: Optional["MypyVersion"]
+    ) -> None:
+        """Attribute the plugin hook *timings* to the test functions by line.
+
+        Time spent outside of the test functions (or in other files) is
+        attributed to the file.
+        """
+        filename = os.path.realpath(self.mypy_file.filename)
+        label = "mypy" if version is None else version.label
+        profile = self.config.stash.setdefault(_hook_profile_key, {})
+        for timing in timings:
+            name = None
+            if timing.path is not None and os.path.realpath(timing.path) == filename:
+                for item in self.mypy_file.items:
+                    if item.lineno <= timing.line <= item.end_lineno:
+                        name = item.name
+                        break
+            nodeid = self.nodeid if name is None else f"{self.nodeid}::[{label}]{name}"
+            total = profile.setdefault((nodeid, name, timing.hook), [0, 0.0])
+            total[0] += timing.calls
+            total[1] += timing.seconds
+
+    def _group_items(self, flags_key: FlagsKey) -> List[str]:
+        """Return the names of the test functions checked with *flags_key*."""
+        selected = self.flag_groups().get(flags_key)
+        return [
+            item.name
+            for item in self.mypy_file.items
+            if selected is None or item.name in selected
+        ]
+
+    def _bisect_crash(
+        self,
+        filename: Union[pathlib.Path, os.PathLike, str],
+        flags_key: FlagsKey,
+        names: List[str],
+        version: Optional["MypyVersion"] = None,
+    ) -> Tuple[Set[str], List[Tuple[List[str], Optional[Set[str]]]]]:
+        """Find the test functions of *names* that make mypy crash.
+
+        Repeatedly checks halves of the crashing test functions. Returns
+        the names of the crashing functions and the output lines of the
+        runs without crash together with the names of the functions checked.
+        If all halves of some functions pass, the crash only occurs for
+        their combination and all of them count as crashing.
+        """
+        from .output_processing import find_crash
+
+        backend = _get_backend(self.config, version=version)
+        crashed: Set[str] = set()
+        runs: List[Tuple[List[str], Optional[Set[str]]]] = []
+        pending = [names]
+        while pending:
+            names = pending.pop()
+            if len(names) == 1:
+                crashed.update(names)
+                continue
+            half = len(names) // 2
+            passed = []
+            for part in (names[:half], names[half:]):
+                run = self.check(
+                    backend, filename, flags_key, items=set(part), version=version
+                )
+                out, err, returncode = run.output
+                lines = (out + err).splitlines()
+                if run.timeout is None and find_crash(returncode, lines) is None:
+                    passed.append((lines, set(part)))
+                else:
+                    pending.append(part)
+            if len(passed) == 2:
+                crashed.update(names)
+            else:
+                runs += passed
+        return crashed, runs
+
+    def _assign_messages(
+        self,
+        runs: List[Tuple[List[str], Optional[Set[str]]]],
+        extra_messages: Sequence["Message"] = (),
+    ) -> Tuple[Dict[str, List["Message"]], List["Message"], List["Message"]]:
+        """Assign the messages of the output lines of *runs* to the test functions.
+
+        Every run contributes the messages of its test functions (`None`
+        for all of them), the first run also *extra_messages*. Returns the
+        messages of each test function, all messages about the file and
+        the messages outside of test functions of the first run.
+        """
+        from .output_processing import (
+            parse_messages,
+            select_file_messages,
+            split_messages_by_item,
+        )
+
+        item_messages: Dict[str, List["Message"]] = {}
+        file_messages: List["Message"] = []
+        non_item_messages: List["Message"] = []
+        for index, (lines, names) in enumerate(runs):
+            run_messages = select_file_messages(
+                parse_messages(lines), self.mypy_file.filename
+            )
+            if index == 0 and extra_messages:
+                run_messages = sorted(
+                    [*run_messages, *extra_messages], key=lambda msg: msg.lineno
+                )
+            run_item_messages, run_non_item_messages = split_messages_by_item(
+                self.mypy_file.items, run_messages
+            )
+            for item, messages in zip(
+                self.mypy_file.items, run_item_messages, strict=True
+            ):
+                if names is None or item.name in names:
+                    item_messages.setdefault(item.name, []).extend(messages)
+                    file_messages.extend(messages)
+            if index == 0:
+                non_item_messages = run_non_item_messages
+                file_messages.extend(run_non_item_messages)
+        file_messages.sort(key=lambda msg: msg.lineno)
+        return item_messages, file_messages, non_item_messages
+
+
+def _as_output(
+    result: "Union[MypyOutput, Sequence[Message], None]",
+) -> "MypyOutput":
+    """Return the result of the run hook as mypy output."""
+    from .backends import MypyOutput
+    from .message import Severity
+
+    if result is None:
+        raise RuntimeError("No pytest_mypy_testing_run_mypy hook returned a result")
+    if isinstance(result, MypyOutput):
+        return result
+    out = "".join(f"{msg}\n" for msg in result)
+    failed = any(msg.severity == Severity.ERROR for msg in result)
+    return MypyOutput(out, "", 1 if failed else 0)
+
+
+def pytest_addhooks(pluginmanager):
+    from . import hooks
+
+    pluginmanager.add_hookspecs(hooks)
+
+
+@pytest.hookimpl(trylast=True)
+def pytest_mypy_testing_run_mypy(backend, mypy_args, filenames, texts):
+    """Run mypy with the selected backend."""
+    return backend.run(mypy_args, filenames, texts)
+
+
+def pytest_collection(session) -> None:
+    jobs = session.config.option.mypy_testing_parse_jobs
+    if jobs != 1:
+        _parse_candidates(session.config, (os.cpu_count() or 1) if jobs == 0 else jobs)
+
+
+def _parse_candidates(config: Config, jobs: int) -> None:
+    """Parse the candidate mypy test files of the session in a process pool.
+
+    ``PytestMypyFile`` takes the parsed files from the stash instead of
+    parsing them during collection.
+    """
+    filenames = _candidate_files(config)
+    if len(filenames) < 2:
+        return
+    from .parser import parse_files
+
+    config.stash[_parsed_files_key] = parse_files(
+        filenames,
+        min(jobs, len(filenames)),
+        keep_ast=not config.getini("mypy_testing_lean"),
+    )
+
+
+def _candidate_files(config: Config) -> List[pathlib.Path]:
+    """Return the files below the command line arguments that may be collected.
+
+    These are all ``.mypy-testing`` files and the Python files matching
+    ``python_files``, skipping the directories matched by
+    ``norecursedirs`` and virtual environments.
+    """
+    import fnmatch
+
+    fn_patterns = config.getini("python_files") + ["__init__.py"]
+    dir_patterns = config.getini("norecursedirs")
+    filenames: List[pathlib.Path] = []
+    for arg in config.args:
+        path = config.invocation_params.dir / arg.split("::")[0]
+        if path.is_file():
+            if path.suffix in (".py", ".mypy-testing"):
+                filenames.append(path)
+            continue
+        for dirpath, dirnames, names in os.walk(path):
+            dirnames[:] = [
+                name
+                for name in sorted(dirnames)
+                if not any(fnmatch.fnmatch(name, pattern) for pattern in dir_patterns)
+                and not os.path.exists(os.path.join(dirpath, name, "pyvenv.cfg"))
+            ]
+            for name in sorted(names):
+                file_path = pathlib.Path(dirpath, name)
+                if file_path.suffix == ".mypy-testing" or (
+                    file_path.suffix == ".py"
+                    and path_matches_patterns(file_path, fn_patterns)
+                ):
+                    filenames.append(file_path)
+    return filenames
+
 
 def pytest_collect_file(file_path: pathlib.Path, parent):
     if file_path.suffix == ".mypy-testing" or _is_pytest_test_file(file_path, parent):
@@ -211,6 +1250,56 @@ def pytest_collect_file(file_path: pathlib.Path, parent):
     return None
 
 
+def _directory_flags(config: Config, path: pathlib.Path) -> List[str]:
+    """Return the mypy options of the ``mypy_testing_flags`` ini value for *path*.
+
+    Every line has the form ``DIR: OPTIONS`` with *DIR* relative to the
+    rootdir. The options of all lines whose directory contains *path*
+    are used in order.
+    """
+    flags: List[str] = []
+    rootpath = pathlib.Path(config.rootpath)
+    for line in config.getini("mypy_testing_flags"):
+        directory, sep, options = line.partition(":")
+        if not sep:
+            raise pytest.UsageError(
+                f"Invalid mypy_testing_flags line (expected DIR: OPTIONS): {line!r}"
+            )
+        directory = (rootpath / directory.strip()).resolve()
+        if directory == path or directory in path.parents:
+            flags += shlex.split(options)
+    return flags
+
+
+def _follow_imports_policy(config: Config, path: pathlib.Path) -> str:
+    """Return the import-following policy for non-local modules of *path*.
+
+    The ``--mypy-testing-follow-imports`` option applies to all files.
+    Otherwise every line of the ``mypy_testing_follow_imports`` ini value
+    has the form ``POLICY`` or ``DIR: POLICY`` with *DIR* relative to the
+    rootdir; the last line applying to *path* wins.
+    """
+    option: Optional[str] = getattr(config.option, "mypy_testing_follow_imports", None)
+    if option is not None:
+        return option
+    policy = "full"
+    rootpath = pathlib.Path(config.rootpath)
+    for line in config.getini("mypy_testing_follow_imports"):
+        directory, sep, value = line.rpartition(":")
+        value = value.strip()
+        if value not in FOLLOW_IMPORTS_FLAGS:
+            raise pytest.UsageError(
+                "Invalid mypy_testing_follow_imports line (expected [DIR:] "
+                f"{'|'.join(FOLLOW_IMPORTS_FLAGS)}): {line!r}"
+            )
+        if sep:
+            directory_path = (rootpath / directory.strip()).resolve()
+            if directory_path != path and directory_path not in path.parents:
+                continue
+        policy = value
+    return policy
+
+
 def _is_pytest_test_file(file_path: pathlib.Path, parent):
     """Return `True` if *path* is considered to be a pytest test file."""
     # Based on _pytest/python.py::pytest_collect_file
@@ -228,6 +1317,31 @@ def pytest_configure(config):
     """
     _add_reveal_type_to_builtins()
 
+    granularity = config.getini("mypy_testing_granularity")
+    if granularity not in ("function", "file"):
+        raise pytest.UsageError(
+            f"mypy_testing_granularity must be 'function' or 'file', "
+            f"got {granularity!r}"
+        )
+
+    backend = config.option.mypy_testing_backend
+    if backend != "inprocess":  # The default backend is supported everywhere
+        from .backends import is_backend_supported
+
+        if not is_backend_supported(backend):
+            raise pytest.UsageError(
+                f"--mypy-testing-backend={backend} is not supported on this platform"
+            )
+
+    pythons = config.option.mypy_testing_python or config.getini("mypy_testing_pythons")
+    if pythons:
+        from .matrix import detect_versions
+
+        try:
+            config.stash[_matrix_key] = detect_versions(pythons)
+        except ValueError as e:
+            raise pytest.UsageError(f"mypy-testing: {e}") from None
+
     config.addinivalue_line(
         "markers", "mypy_testing: mark functions to be used for mypy testing."
     )
@@ -236,12 +1350,645 @@ def pytest_configure(config):
     )
 
 
+def pytest_report_header(config) -> List[str]:
+    lines = []
+    if config.option.verbose > 0:
+        lines.append(f"mypy-testing: plugin imported in {IMPORT_SECONDS * 1000:.1f} ms")
+    for version in config.stash.get(_matrix_key, []):
+        lines.append(f"mypy-testing: {version.label} ({version.python})")
+    return lines
+
+
+def pytest_collection_modifyitems(session, config, items):
+    shard = config.option.mypy_testing_shard
+    if shard is None:
+        return
+    from .scheduling import assign_shards, load_durations
+
+    index, count = shard
+    files = {item.parent.nodeid for item in items if _is_mypy_item(item)}
+    shards = assign_shards(files, load_durations(config), count)
+    selected, deselected = [], []
+    for item in items:
+        if _is_mypy_item(item) and shards[item.parent.nodeid] != index:
+            deselected.append(item)
+        else:
+            selected.append(item)
+    if deselected:
+        config.hook.pytest_deselected(items=deselected)
+        items[:] = selected
+
+
+def _is_mypy_item(item) -> bool:
+    return isinstance(item, (PytestMypyTestItem, PytestMypyFileItem))
+
+
+def _is_xdist_worker(config: Config) -> bool:
+    return hasattr(config, "workerinput")
+
+
+def _parse_shard(value: str) -> Tuple[int, int]:
+    """Parse ``K/N`` into the zero based shard index and the shard count."""
+    try:
+        k, n = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"expected K/N, e.g. 1/4, got {value!r}"
+        ) from None
+    if not 1 <= k <= n:
+        raise argparse.ArgumentTypeError(
+            f"shard K/N requires 1 <= K <= N, got {value!r}"
+        )
+    return k - 1, n
+
+
+def pytest_collection_finish(session):
+    if _parsed_files_key in session.config.stash:
+        del session.config.stash[_parsed_files_key]
+    files = _selected_files(session)
+    if not files:
+        return
+    # An xdist worker collects all items, but runs only those the
+    # scheduler sends to it: It cannot tell when a file has been used up
+    if not _is_xdist_worker(session.config):
+        counts: Dict[PytestMypyFile, int] = {}
+        for item in session.items:
+            if _is_mypy_item(item):
+                counts[item.parent] = counts.get(item.parent, 0) + 1
+        for file, count in counts.items():
+            file.expect_items(count)
+    if session.config.getini("mypy_testing_reduce"):
+        _select_items(session)
+    if session.config.getini("mypy_testing_dedupe") and (
+        _matrix_key not in session.config.stash
+    ):
+        _share_runs(files)
+    warm_caches = _get_warm_caches(session.config, _get_backend(session.config))
+    if warm_caches is not None:
+        from .caching import installed_packages
+
+        imports = {name for file in files for name in file.mypy_file.imports}
+        installed = set(installed_packages(imports))
+        for file in files:
+            if file._mypy_share is None or file._mypy_share.files[0] is file:
+                packages = installed.intersection(file.mypy_file.imports)
+                for flags_key in file.flag_groups():
+                    warm_caches.expect(file.mypy_args(flags_key), packages)
+
+
+def _select_items(session) -> None:
+    """Only type check the selected items of files with deselected items."""
+    selected: Dict[PytestMypyFile, Set[str]] = {}
+    for item in session.items:
+        if isinstance(item, PytestMypyTestItem):
+            selected.setdefault(item.parent, set()).add(item.mypy_item.name)
+        elif isinstance(item, PytestMypyFileItem):
+            selected.setdefault(item.parent, set()).update(
+                mypy_item.name for mypy_item in item.parent.mypy_file.items
+            )
+    for file, names in selected.items():
+        if len(names) < len(file.mypy_file.items):
+            file.select_items(names)
+
+
+def _selected_files(session) -> List[PytestMypyFile]:
+    """Return the files of the selected mypy test items."""
+    return list({item.parent: None for item in session.items if _is_mypy_item(item)})
+
+
+def _share_runs(files: Iterable[PytestMypyFile]) -> None:
+    """Let files with equal content and mypy flags share one mypy run."""
+    groups: Dict[Tuple[str, ...], List[PytestMypyFile]] = {}
+    for file in files:
+        key = file.content_key()
+        if key is not None:
+            groups.setdefault(key, []).append(file)
+    for group in groups.values():
+        if len(group) > 1:
+            share = SharedMypyRun(group)
+            for file in group:
+                file.share_run(share)
+
+
+@pytest.hookimpl(wrapper=True)
+def pytest_runtestloop(session):
+    config = session.config
+    # xdist workers check files on demand: Their session.items include the
+    # items the scheduler sends to other workers
+    if (
+        not config.option.collectonly
+        and not _is_xdist_worker(config)
+        and (_get_jobs(config) > 1 or _matrix_key in config.stash)
+    ):
+        _prefetch(session)
+    try:
+        result = yield
+    except BaseException:
+        _close_executors(config, cancel=True)
+        raise
+    _close_executors(config, cancel=bool(session.shouldfail or session.shouldstop))
+    if config.option.mypy_testing_watch:
+        _watch(session)
+    return result
+
+
+def _close_executors(config: Config, *, cancel: bool) -> None:
+    """Shut down the mypy executors, cancelling outstanding checks if *cancel*."""
+    executors = config.stash.get(_executors_key, [])
+    if executors:
+        del config.stash[_executors_key]
+    for executor in executors:
+        if cancel:
+            executor.cancel()
+        else:
+            executor.close()
+
+
+def _get_jobs(config: Config) -> int:
+    jobs = config.option.mypy_testing_jobs
+    return (os.cpu_count() or 1) if jobs == 0 else jobs
+
+
+def _prefetch(session) -> None:
+    """Start mypy for all files with selected items, longest files first.
+
+    Every mypy version of the matrix gets its own pool of workers, so
+    that all versions check the files in parallel.
+    """
+    config = session.config
+    # Files sharing the mypy run of another file need no check of their own
+    files = [
+        file
+        for file in _selected_files(session)
+        if file._mypy_share is None or file._mypy_share.files[0] is file
+    ]
+    if not files:
+        return
+    from .backends import create_backend
+    from .scheduling import MypyExecutor, estimate_duration, load_durations
+
+    durations = load_durations(config)
+    costs = [estimate_duration(file.nodeid, file.path, durations) for file in files]
+    units = [(file, flags_key) for file in files for flags_key in file.flag_groups()]
+    costs = [
+        cost / len(file.flag_groups())
+        for file, cost in zip(files, costs, strict=True)
+        for _ in file.flag_groups()
+    ]
+    versions: List[Optional["MypyVersion"]] = [None]
+    versions = list(config.stash.get(_matrix_key, versions))
+    executors = config.stash[_executors_key] = []
+    for version in versions:
+        executor = MypyExecutor(
+            min(_get_jobs(config), len(files)),
+            functools.partial(
+                create_backend,
+                config,
+                out_of_process=True,
+                python=None if version is None else version.python,
+            ),
+        )
+        executors.append(executor)
+        futures = executor.submit_all(
+            functools.partial(_check_unit, version=version), units, costs
+        )
+        for (file, flags_key), future in zip(units, futures, strict=True):
+            file.prefetch(flags_key, future, version)
+
+
+def _check_unit(
+    backend: "MypyBackend",
+    unit: Tuple[PytestMypyFile, FlagsKey],
+    version: Optional["MypyVersion"] = None,
+) -> MypyRun:
+    file, flags_key = unit
+    return file.check(backend, flags_key=flags_key, version=version)
+
+
+def pytest_sessionfinish(session):
+    durations = session.config.stash.get(_durations_key, None)
+    # Shards are assigned by the recorded durations: Recording new ones in
+    # a sharded session would change the assignment of the later shards
+    if durations and session.config.option.mypy_testing_shard is None:
+        from .scheduling import store_durations
+
+        store_durations(session.config, durations)
+    report_path = session.config.option.mypy_testing_json_report
+    if report_path is not None:
+        _write_json_report(session.config, report_path)
+
+
+def _write_json_report(config: Config, report_path: str) -> None:
+    """Write the mismatches of all failed mypy test functions as JSON.
+
+    The plugin hook profile is included if the hooks were profiled.
+    """
+    report: Dict[str, object] = {
+        "mismatches": config.stash.get(_mismatch_records_key, [])
+    }
+    if config.option.mypy_testing_profile_plugins:
+        report["plugin_hooks"] = [
+            {
+                "nodeid": nodeid,
+                "function": name,
+                "hook": hook,
+                "calls": int(calls),
+                "seconds": round(seconds, 6),
+            }
+            for (nodeid, name, hook), (calls, seconds) in sorted(
+                config.stash.get(_hook_profile_key, {}).items()
+            )
+        ]
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, separators=(",", ":"))
+        f.write("\n")
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    stats = config.stash.get(_mismatch_stats_key, None)
+    if stats is not None and stats.hidden:
+        terminalreporter.write_line(
+            f"mypy-testing: {stats.shown + stats.hidden} mismatch(es) in "
+            f"{stats.items} failed item(s), {stats.hidden} not shown "
+            "(see mypy_testing_max_mismatches and --mypy-testing-json-report)"
+        )
+    if config.option.mypy_testing_profile_plugins:
+        _report_hook_profile(terminalreporter, config.stash.get(_hook_profile_key, {}))
+
+
+def _report_hook_profile(
+    terminalreporter,
+    profile: Dict[Tuple[str, Optional[str], str], List[float]],
+    max_rows: int = 20,
+) -> None:
+    """Show the most expensive plugin hooks per test function and per hook."""
+    terminalreporter.write_sep("=", "mypy plugin hook profile")
+    if not profile:
+        terminalreporter.write_line("no plugin hook was called")
+        return
+    rows = sorted(profile.items(), key=lambda entry: -entry[1][1])
+    terminalreporter.write_line(f"{'seconds':>9} {'calls':>7}  hook  (test function)")
+    for (nodeid, _, hook), (calls, seconds) in rows[:max_rows]:
+        terminalreporter.write_line(f"{seconds:9.4f} {int(calls):7d}  {hook}  {nodeid}")
+    if len(rows) > max_rows:
+        terminalreporter.write_line(
+            f"({len(rows) - max_rows} more, see --mypy-testing-json-report)"
+        )
+    per_hook: Dict[str, List[float]] = {}
+    for (_, _, hook), (calls, seconds) in rows:
+        total = per_hook.setdefault(hook, [0, 0.0])
+        total[0] += calls
+        total[1] += seconds
+    terminalreporter.write_line("")
+    terminalreporter.write_line(f"{'seconds':>9} {'calls':>7}  hook  (total)")
+    for hook, (calls, seconds) in sorted(per_hook.items(), key=lambda e: -e[1][1]):
+        terminalreporter.write_line(f"{seconds:9.4f} {int(calls):7d}  {hook}")
+
+
+def _watch(session) -> None:
+    from .watch import WatchedFile, WatchEngine, partition_files, watch
+
+    reporter = session.config.pluginmanager.get_plugin("terminalreporter")
+    write_line = reporter.write_line if reporter is not None else print
+    # The test functions to check per file, grouped by their mypy arguments
+    groups: Dict[Tuple[str, ...], Dict[str, Optional[Set[str]]]] = {}
+    for file in _selected_files(session):
+        for flags_key, names in file.flag_groups().items():
+            files = groups.setdefault(tuple(file.mypy_args(flags_key)), {})
+            selected = files.get(str(file.path), set())
+            if names is None or selected is None:
+                files[str(file.path)] = None
+            else:
+                files[str(file.path)] = selected | names
+    engines: List[WatchEngine] = []
+    watched_files: List[WatchedFile] = []
+    try:
+        for mypy_args, files in groups.items():
+            try:
+                partitions = partition_files(list(files), list(mypy_args))
+            except SystemExit as e:
+                raise pytest.UsageError(
+                    "--mypy-testing-watch does not support the mypy options of "
+                    f"{', '.join(files)}: {e.code}"
+                ) from None
+            for filenames in partitions:
+                engine = WatchEngine(
+                    filenames, list(mypy_args), str(session.config.rootpath)
+                )
+                engines.append(engine)
+                watched_files += [
+                    WatchedFile(filename, engine, files[filename])
+                    for filename in filenames
+                ]
+        watch(watched_files, write_line)
+    except KeyboardInterrupt:
+        write_line("mypy-testing: stopped watching")
+    finally:
+        for engine in engines:
+            engine.close()
+
+
+def pytest_unconfigure(config):
+    _close_executors(config, cancel=True)
+    warm_caches = config.stash.get(_warm_caches_key, None)
+    if warm_caches is not None:
+        warm_caches.close()
+        del config.stash[_warm_caches_key]
+    inspector = config.stash.get(_reveal_inspector_key, None)
+    if inspector is not None:
+        inspector.close()
+        del config.stash[_reveal_inspector_key]
+    for key in (_backend_key, _terminable_backend_key):
+        backend = config.stash.get(key, None)
+        if backend is not None:
+            backend.close()
+            del config.stash[key]
+    for backend in config.stash.get(_version_backends_key, {}).values():
+        backend.close()
+    config.stash[_version_backends_key] = {}
+
+
 def pytest_addoption(parser):
     parser.addoption(
         "--mypy-config-file",
         action="store",
         default=os.environ.get("PYTEST_MYPY_CONFIG_FILE"),
     )
+    parser.addoption(
+        "--mypy-testing-backend",
+        action="store",
+        choices=sorted(BACKEND_NAMES),
+        default=os.environ.get("PYTEST_MYPY_TESTING_BACKEND", "inprocess"),
+        help="Run mypy in the pytest process (inprocess, or build to reuse "
+        "mypy options between files), in worker subprocesses or in children "
+        "forked from a pre-warmed zygote process (forkserver).",
+    )
+    parser.addoption(
+        "--mypy-testing-max-files-per-worker",
+        action="store",
+        type=int,
+        default=50,
+        help="Replace a mypy worker subprocess after checking this many files.",
+    )
+    parser.addoption(
+        "--mypy-testing-max-worker-rss",
+        action="store",
+        type=int,
+        default=None,
+        metavar="MIB",
+        help="Replace a mypy worker subprocess once its memory usage exceeds MIB.",
+    )
+    parser.addoption(
+        "--mypy-testing-jobs",
+        action="store",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Run up to N mypy checks in parallel worker processes, starting "
+        "with the files that took longest in previous runs (0: one per CPU).",
+    )
+    parser.addoption(
+        "--mypy-testing-parse-jobs",
+        action="store",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Parse the candidate mypy test files in N worker processes "
+        "before collecting them (0: one per CPU, 1: parse during collection).",
+    )
+    parser.addoption(
+        "--mypy-testing-shard",
+        action="store",
+        type=_parse_shard,
+        default=None,
+        metavar="K/N",
+        help="Only run the mypy test files of shard K out of N shards. Files "
+        "are balanced by their recorded mypy durations.",
+    )
+    parser.addoption(
+        "--mypy-testing-warm-cache",
+        action="store",
+        default=os.environ.get("PYTEST_MYPY_TESTING_WARM_CACHE"),
+        metavar="DIR",
+        help="Keep read-only snapshots of warm mypy caches (standard library "
+        "and the packages of mypy_testing_warm_cache_packages) in DIR and "
+        "seed every check from them.",
+    )
+    parser.addoption(
+        "--mypy-testing-watch",
+        action="store_true",
+        default=False,
+        help="After the test run, watch the mypy test files and re-check "
+        "them on every change using mypy's fine-grained incremental mode.",
+    )
+    parser.addoption(
+        "--mypy-testing-timeout",
+        action="store",
+        type=float,
+        default=None,
+        metavar="SECONDS",
+        help="Terminate mypy if checking a file takes longer than SECONDS and "
+        "fail all items of the file (overrides the mypy_testing_timeout ini "
+        "value). In-process backends run such checks in a worker subprocess.",
+    )
+    parser.addoption(
+        "--mypy-testing-python",
+        action="append",
+        default=None,
+        metavar="PYTHON",
+        help="Check every mypy test file with the mypy installed for the Python "
+        "interpreter or virtual environment PYTHON (may be repeated). Items are "
+        "labeled with the mypy version, e.g. [mypy-1.19]. Overrides the "
+        "mypy_testing_pythons ini value.",
+    )
+    parser.addoption(
+        "--mypy-testing-profile-plugins",
+        action="store_true",
+        default=False,
+        help="Time the hook callbacks of the configured mypy plugins, attribute "
+        "them to the test functions by line and show the most expensive "
+        "ones in the terminal summary and the JSON report.",
+    )
+    parser.addoption(
+        "--mypy-testing-follow-imports",
+        action="store",
+        choices=sorted(FOLLOW_IMPORTS_FLAGS),
+        default=None,
+        help="Analyze installed (non-local) packages imported by the mypy test "
+        "files and report their errors (full), analyze them silently "
+        "(silent) or treat them as Any (skip). Overrides the "
+        "mypy_testing_follow_imports ini value.",
+    )
+    parser.addoption(
+        "--mypy-testing-inspect-reveals",
+        action="store_true",
+        default=False,
+        help="Check files expecting only revealed types (# R: comments) with "
+        "warm fine-grained mypy engines and inspect the revealed types "
+        "instead of parsing them from the mypy output.",
+    )
+    parser.addoption(
+        "--mypy-testing-json-report",
+        action="store",
+        default=None,
+        metavar="PATH",
+        help="Write all mismatches of failed mypy test items to PATH as JSON.",
+    )
+    parser.addini(
+        "mypy_testing_lean",
+        "Release ASTs, source lines and mypy output as soon as possible.",
+        type="bool",
+        default=True,
+    )
+    parser.addini(
+        "mypy_testing_flags",
+        "Additional mypy options for test files in a directory, one "
+        "'DIR: OPTIONS' line per directory (DIR relative to the rootdir).",
+        type="linelist",
+        default=[],
+    )
+    parser.addini(
+        "mypy_testing_follow_imports",
+        "Import-following policy for installed packages (full, silent or "
+        "skip), one 'POLICY' or 'DIR: POLICY' line per directory (DIR "
+        "relative to the rootdir, the last matching line wins).",
+        type="linelist",
+        default=[],
+    )
+    parser.addini(
+        "mypy_testing_share_cache",
+        "Seed the mypy cache of every check from a warm cache of the "
+        "standard library shared by all checks with the same options.",
+        type="bool",
+        default=True,
+    )
+    parser.addini(
+        "mypy_testing_warm_cache_packages",
+        "Third-party packages to analyze for the warm mypy caches.",
+        type="linelist",
+        default=[],
+    )
+    parser.addini(
+        "mypy_testing_dedupe",
+        "Run mypy only once for non-Python test files with equal content "
+        "and mypy flags.",
+        type="bool",
+        default=True,
+    )
+    parser.addini(
+        "mypy_testing_reduce",
+        "Only type check the selected test functions of a file if some of "
+        "its mypy test items are deselected.",
+        type="bool",
+        default=True,
+    )
+    parser.addini(
+        "mypy_testing_pythons",
+        "Python interpreters or virtual environments with the mypy versions "
+        "to check every mypy test file with, one per line.",
+        type="linelist",
+        default=[],
+    )
+    parser.addini(
+        "mypy_testing_granularity",
+        "Collect one pytest item per mypy test 'function' (default) or per 'file'.",
+        default="function",
+    )
+    parser.addini(
+        "mypy_testing_bisect_crashes",
+        "If mypy crashes, check halves of the test functions of the file "
+        "to find the functions causing the crash.",
+        type="bool",
+        default=False,
+    )
+    parser.addini(
+        "mypy_testing_max_mismatches",
+        "Maximum number of mismatches shown per failed mypy test item (0: no limit).",
+        default="20",
+    )
+    parser.addini(
+        "mypy_testing_max_session_mismatches",
+        "Maximum number of mismatches shown per session (0: no limit).",
+        default="200",
+    )
+    parser.addini(
+        "mypy_testing_timeout",
+        "Default timeout in seconds for type checking a mypy test file.",
+        default=None,
+    )
+    parser.addini(
+        "mypy_testing_max_seconds",
+        "Default time budget in seconds for type checking a mypy test file.",
+        default=None,
+    )
+
+
+def _get_backend(
+    config: Config,
+    *,
+    terminable: bool = False,
+    version: Optional["MypyVersion"] = None,
+) -> "MypyBackend":
+    """Return the backend of the session.
+
+    With *terminable* an out-of-process backend is returned if the
+    selected backend cannot terminate running checks. With *version*
+    the backend runs mypy with the interpreter of this mypy version.
+    """
+    if version is not None:
+        backends = config.stash.setdefault(_version_backends_key, {})
+        backend = backends.get(version.label)
+        if backend is None:
+            from .backends import create_backend
+
+            backend = backends[version.label] = create_backend(
+                config, python=version.python
+            )
+        return backend
+    backend = config.stash.get(_backend_key, None)
+    if backend is None:
+        from .backends import create_backend
+
+        backend = config.stash[_backend_key] = create_backend(config)
+    if terminable and not backend.terminable:
+        backend = config.stash.get(_terminable_backend_key, None)
+        if backend is None:
+            from .backends import create_backend
+
+            backend = config.stash[_terminable_backend_key] = create_backend(
+                config, out_of_process=True
+            )
+    return backend
+
+
+def _get_warm_caches(config: Config, backend: "MypyBackend") -> Optional["WarmCaches"]:
+    snapshot_dir = config.option.mypy_testing_warm_cache
+    if snapshot_dir is None and (
+        backend.warms_cache or not config.getini("mypy_testing_share_cache")
+    ):
+        return None
+    warm_caches = config.stash.get(_warm_caches_key, None)
+    if warm_caches is None:
+        from .caching import WarmCaches
+
+        warm_caches = config.stash[_warm_caches_key] = WarmCaches(
+            snapshot_dir=(
+                os.path.abspath(snapshot_dir) if snapshot_dir is not None else None
+            ),
+            packages=config.getini("mypy_testing_warm_cache_packages"),
+        )
+    return warm_caches
+
+
+def _get_reveal_inspector(config: Config) -> Optional["RevealInspector"]:
+    if not getattr(config.option, "mypy_testing_inspect_reveals", False):
+        return None
+    inspector = config.stash.get(_reveal_inspector_key, None)
+    if inspector is None:
+        from .inspection import RevealInspector
+
+        inspector = config.stash[_reveal_inspector_key] = RevealInspector()
+    return inspector
 
 
 def _add_reveal_type_to_builtins():
@@ -250,3 +1997,6 @@ def _add_reveal_type_to_builtins():
 
     if not hasattr(builtins, "reveal_type"):
         setattr(builtins, "reveal_type", lambda x: x)  # noqa: B010
+
+
+IMPORT_SECONDS = time.perf_counter() - _import_start
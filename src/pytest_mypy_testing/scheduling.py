@@ -0,0 +1,206 @@
+# SPDX-FileCopyrightText: David Fritzsche
+# SPDX-License-Identifier: Apache-2.0 OR MIT
+"""Duration-aware scheduling of mypy checks.
+
+The mypy durations of all files are stored in the pytest cache after
+every session. Later sessions start the files with the longest predicted
+duration first (longest processing time first, LPT) so that no long
+check is started last while the rest of the pool idles.
+"""
+
+import heapq
+import os
+import threading
+import zlib
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    TypeVar,
+    Union,
+)
+
+from .backends import MypyBackend
+
+
+__all__ = [
+    "MypyExecutor",
+    "assign_shards",
+    "estimate_duration",
+    "load_durations",
+    "lpt_order",
+    "pack_batches",
+    "store_durations",
+]
+
+DURATIONS_CACHE_KEY = "mypy_testing/durations"
+
+# Size based estimate for files without a recorded duration
+BASE_SECONDS = 1.0
+SECONDS_PER_BYTE = 1e-4
+
+K = TypeVar("K", bound=Hashable)
+
+
+def load_durations(config) -> Dict[str, float]:
+    """Return the mypy durations recorded in the pytest cache."""
+    cache = getattr(config, "cache", None)
+    if cache is None:
+        return {}
+    durations = cache.get(DURATIONS_CACHE_KEY, {})
+    if not isinstance(durations, dict):
+        return {}
+    return {
+        str(key): float(value)
+        for key, value in durations.items()
+        if isinstance(value, (int, float))
+    }
+
+
+def store_durations(config, durations: Mapping[str, float]) -> None:
+    """Merge *durations* into the mypy durations in the pytest cache."""
+    cache = getattr(config, "cache", None)
+    if cache is None or not durations:
+        return
+    merged = load_durations(config)
+    merged.update(durations)
+    cache.set(DURATIONS_CACHE_KEY, dict(sorted(merged.items())))
+
+
+def estimate_duration(
+    key: str, path: Union["os.PathLike[str]", str], durations: Mapping[str, float]
+) -> float:
+    """Predict the mypy duration of the file *path* recorded as *key*.
+
+    Files without a recorded duration are estimated by their size.
+    """
+    if key in durations:
+        return durations[key]
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        size = 0
+    return BASE_SECONDS + size * SECONDS_PER_BYTE
+
+
+def lpt_order(costs: Mapping[K, float]) -> List[K]:
+    """Return the keys of *costs* ordered by descending cost.
+
+    Keys with equal cost keep their original order.
+    """
+    return sorted(costs, key=lambda key: -costs[key])
+
+
+def pack_batches(costs: Mapping[K, float], n: int) -> List[List[K]]:
+    """Distribute the keys of *costs* over *n* batches of similar total cost.
+
+    Uses the greedy LPT heuristic: The most expensive remaining key is
+    added to the batch with the lowest total cost so far. The result is
+    deterministic for a given mapping.
+    """
+    if n < 1:
+        raise ValueError(f"Number of batches must be positive, got {n}")
+    batches: List[List[K]] = [[] for _ in range(n)]
+    heap = [(0.0, index) for index in range(n)]
+    for key in lpt_order(costs):
+        total, index = heapq.heappop(heap)
+        batches[index].append(key)
+        heapq.heappush(heap, (total + costs[key], index))
+    return batches
+
+
+def assign_shards(
+    keys: Iterable[str], durations: Mapping[str, float], n: int
+) -> Dict[str, int]:
+    """Assign each of *keys* to one of *n* shards (numbered from 0).
+
+    Keys with a recorded duration are packed into shards of similar total
+    duration, all other keys are distributed by a stable hash. The result
+    only depends on the keys and durations, not on their order, so every
+    shard computes the same assignment given the same durations.
+    """
+    keys = sorted(set(keys))
+    recorded = {key: durations[key] for key in keys if key in durations}
+    shards = {
+        key: zlib.crc32(key.encode("utf-8")) % n for key in keys if key not in recorded
+    }
+    for index, batch in enumerate(pack_batches(recorded, n)):
+        for key in batch:
+            shards[key] = index
+    return shards
+
+
+class MypyExecutor:
+    """Run mypy checks ahead of time in a pool of worker threads.
+
+    Every thread uses its own backend created by *backend_factory*, so
+    the backends should run mypy outside of the pytest process.
+    """
+
+    def __init__(self, jobs: int, backend_factory: Callable[[], MypyBackend]) -> None:
+        self._pool = ThreadPoolExecutor(
+            max_workers=jobs, thread_name_prefix="pytest-mypy-testing"
+        )
+        self._backend_factory = backend_factory
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._backends: List[MypyBackend] = []
+        self._cancelled = False
+
+    def submit_all(
+        self,
+        fn: Callable[[MypyBackend, Any], Any],
+        args: Sequence[Any],
+        costs: Optional[Sequence[float]] = None,
+    ) -> List["Future[Any]"]:
+        """Submit ``fn(backend, arg)`` for every element of *args*.
+
+        The calls are started in LPT order of *costs*. The futures are
+        returned in the order of *args*.
+        """
+        if costs is None:
+            costs = [0.0] * len(args)
+        order = lpt_order(dict(enumerate(costs)))
+        futures: Dict[int, "Future[Any]"] = {}
+        for index in order:
+            futures[index] = self._pool.submit(self._call, fn, args[index])
+        return [futures[index] for index in range(len(args))]
+
+    def _call(self, fn: Callable[[MypyBackend, Any], Any], arg: Any) -> Any:
+        return fn(self._backend(), arg)
+
+    def _backend(self) -> MypyBackend:
+        backend = getattr(self._local, "backend", None)
+        if backend is None:
+            backend = self._local.backend = self._backend_factory()
+            with self._lock:
+                self._backends.append(backend)
+        with self._lock:
+            if self._cancelled:
+                raise CancelledError()
+        return backend
+
+    def cancel(self) -> None:
+        """Drop pending checks, terminate running ones and close the backends."""
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        with self._lock:
+            self._cancelled = True
+            backends = list(self._backends)
+        for backend in backends:
+            backend.terminate()
+        self.close()
+
+    def close(self) -> None:
+        """Wait for running checks, drop pending ones and close the backends."""
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        with self._lock:
+            backends, self._backends = self._backends, []
+        for backend in backends:
+            backend.close()
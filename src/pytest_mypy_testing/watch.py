@@ -0,0 +1,267 @@
+# SPDX-FileCopyrightText: David Fritzsche
+# SPDX-License-Identifier: Apache-2.0 OR MIT
+"""Watch mypy test files and re-check them on every change.
+
+The watched files are checked by fine-grained incremental mypy engines
+(the engine behind the mypy daemon ``dmypy``) shared by all files with
+the same mypy options and distinct module names. After a change only
+the affected parts of the build are updated. The engines check the parsed source of the files via shadow
+files, so the variants of parametrized test functions are checked in
+place of their templates and test functions with other options are
+blanked out.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from .message import Message
+from .output_processing import (
+    OutputMismatch,
+    diff_message_sequences,
+    parse_messages,
+    select_file_messages,
+    split_messages_by_item,
+)
+from .parser import MypyTestFile, MypyTestItem, parse_file
+
+
+__all__ = ["WatchEngine", "WatchedFile", "partition_files", "watch"]
+
+WriteLine = Callable[[str], None]
+
+
+def partition_files(filenames: Sequence[str], flags: List[str]) -> List[List[str]]:
+    """Split *filenames* into groups of files with distinct module names.
+
+    Every group can be checked by one engine. Mypy names the module of
+    every file without a Python extension ``__main__``, so these files
+    end up in separate groups. Raises `SystemExit` if dmypy does not
+    support *flags*.
+    """
+    from mypy.dmypy_server import process_start_options
+    from mypy.find_sources import create_source_list
+
+    options = process_start_options(flags, allow_sources=False)
+    groups: List[Tuple[Set[str], List[str]]] = []
+    for filename in filenames:
+        modules = {source.module for source in create_source_list([filename], options)}
+        for group_modules, group in groups:
+            if not modules & group_modules:
+                group_modules.update(modules)
+                group.append(filename)
+                break
+        else:
+            groups.append((modules, [filename]))
+    return [group for _, group in groups]
+
+
+class WatchEngine:
+    """Fine-grained incremental mypy engine checking files with the same flags.
+
+    Mypy reads the *filenames* from shadow files written by
+    :meth:`set_source`. The module names of the files must be distinct
+    (see :func:`partition_files`). Raises `SystemExit` if dmypy does not
+    support *flags*.
+    """
+
+    def __init__(
+        self, filenames: Sequence[str], flags: List[str], rootdir: str
+    ) -> None:
+        from mypy.dmypy_server import Server, process_start_options
+
+        self.filenames = list(filenames)
+        self.rootdir = os.path.abspath(rootdir)
+        self._tmp_dir = tempfile.mkdtemp(prefix="pytest-mypy-testing-watch-")
+        self._shadow_files: Dict[str, str] = {}
+        shadow_flags: List[str] = []
+        for index, filename in enumerate(self.filenames):
+            shadow_file = os.path.join(
+                self._tmp_dir, f"{index}-{os.path.basename(filename)}"
+            )
+            self._shadow_files[filename] = shadow_file
+            shadow_flags += ["--shadow-file", filename, shadow_file]
+        try:
+            options = process_start_options(flags + shadow_flags, allow_sources=False)
+        except SystemExit:
+            self.close()
+            raise
+        self.server = Server(options, os.path.join(self._tmp_dir, "status.json"))
+        self._stats: Dict[str, Optional[Tuple[int, int]]] = {}
+
+    def set_source(self, filename: str, source_text: str) -> None:
+        """Check *source_text* in place of the content of *filename*."""
+        with open(self._shadow_files[filename], "w", encoding="utf-8") as f:
+            f.write(source_text)
+
+    def check(self) -> List[Message]:
+        """Update the build and return the messages about all files."""
+        response = self.server.cmd_check(
+            self.filenames, export_types=False, is_tty=False, terminal_width=80
+        )
+        self._stats = {path: _stat(path) for path in self.watched_paths()}
+        lines = (str(response.get("out", "")) + str(response.get("err", ""))).split(
+            "\n"
+        )
+        return parse_messages(lines)
+
+    def watched_paths(self) -> List[str]:
+        """Return the watched files and all local modules they depend on."""
+        paths = set(self.filenames)
+        manager = self.server.fine_grained_manager
+        if manager is not None:
+            for state in manager.graph.values():
+                if not state.path:
+                    continue
+                path = os.path.abspath(state.path)
+                if os.path.commonpath([path, self.rootdir]) == self.rootdir:
+                    paths.add(path)
+        return sorted(paths)
+
+    def has_changed(self) -> bool:
+        """Return `True` if a watched path changed since the last check."""
+        return {path: _stat(path) for path in self.watched_paths()} != self._stats
+
+    def close(self) -> None:
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)
+
+
+class WatchedFile:
+    """A mypy test file checked by an engine together with its last results.
+
+    Only the test functions *selected* (all if `None`) are checked, the
+    others are blanked out.
+    """
+
+    def __init__(
+        self, filename: str, engine: WatchEngine, selected: Optional[Set[str]] = None
+    ) -> None:
+        self.filename = filename
+        self.engine = engine
+        self.selected = selected
+        self.mypy_file: MypyTestFile = self._parse()
+        self._source_stat = _stat(filename)
+        self._results: Dict[str, List[OutputMismatch]] = {}
+
+    def refresh(self) -> bool:
+        """Parse the file again if it changed and return whether it did."""
+        source_stat = _stat(self.filename)
+        if source_stat == self._source_stat:
+            return False
+        self.mypy_file = self._parse()
+        self._source_stat = source_stat
+        return True
+
+    def report(
+        self,
+        messages: Sequence[Message],
+        write_line: Optional[WriteLine] = None,
+        *,
+        file_changed: bool = False,
+    ) -> None:
+        """Compare the *messages* of a check with the expected messages.
+
+        The items whose results changed are reported, all items if the
+        test file itself changed.
+        """
+        items = [
+            item
+            for item in self.mypy_file.items
+            if self.selected is None or item.name in self.selected
+        ]
+        item_messages, non_item_messages = split_messages_by_item(
+            items, select_file_messages(messages, self.filename)
+        )
+        results: Dict[str, List[OutputMismatch]] = {}
+        for item, actual in zip(items, item_messages, strict=True):
+            if "skip" in item.marks:
+                continue
+            results[item.name] = diff_message_sequences(
+                sorted(actual + non_item_messages, key=lambda msg: msg.lineno),
+                item.expected_messages,
+            )
+
+        if write_line is not None:
+            for item in items:
+                errors = results.get(item.name)
+                if errors is None:
+                    continue
+                if file_changed or self._results.get(item.name) != errors:
+                    self._report(write_line, item, errors)
+        self._results = results
+
+    def _parse(self) -> MypyTestFile:
+        mypy_file = parse_file(self.filename, config=None)
+        source_lines = mypy_file.source_lines
+        if self.selected is not None:
+            source_lines = mypy_file.reduced_source_lines(self.selected)
+        self.engine.set_source(self.filename, "\n".join(source_lines) + "\n")
+        return mypy_file
+
+    def _report(
+        self,
+        write_line: WriteLine,
+        item: MypyTestItem,
+        errors: Sequence[OutputMismatch],
+    ) -> None:
+        xfail = "xfail" in item.marks
+        if xfail:
+            outcome = "XFAIL" if errors else "XPASS"
+        else:
+            outcome = "FAILED" if errors else "PASSED"
+        write_line(f"{self.filename}::[mypy]{item.name} {outcome}")
+        if xfail:
+            return
+        for mismatch in errors:
+            # Report the lines of parametrized variants on their template
+            lineno = mismatch.lineno - item.line_offset
+            write_line(f"{self.filename}:{lineno}: {mismatch.error_message}")
+            for line in mismatch.lines:
+                write_line(line)
+
+
+def _stat(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def watch(
+    watched_files: Sequence[WatchedFile],
+    write_line: WriteLine,
+    *,
+    poll_interval: float = 0.25,
+    max_iterations: Optional[int] = None,
+    sleep: Callable[[float], None] = time.sleep,
+) -> None:
+    """Re-check *watched_files* whenever one of their dependencies changes.
+
+    Runs until interrupted or for *max_iterations* polling intervals.
+    """
+    engines: Dict[WatchEngine, List[WatchedFile]] = {}
+    for watched_file in watched_files:
+        engines.setdefault(watched_file.engine, []).append(watched_file)
+    for engine, engine_files in engines.items():
+        messages = engine.check()
+        for watched_file in engine_files:
+            watched_file.report(messages)
+    write_line(
+        f"mypy-testing: watching {len(watched_files)} file(s) for changes "
+        "(press Ctrl-C to stop)"
+    )
+    iteration = 0
+    while max_iterations is None or iteration < max_iterations:
+        sleep(poll_interval)
+        iteration += 1
+        for engine, engine_files in engines.items():
+            if not engine.has_changed():
+                continue
+            # Update the sources of all changed files before checking them
+            changed = [watched_file.refresh() for watched_file in engine_files]
+            messages = engine.check()
+            for watched_file, file_changed in zip(engine_files, changed, strict=True):
+                watched_file.report(messages, write_line, file_changed=file_changed)
@@ -0,0 +1,403 @@
+# SPDX-FileCopyrightText: David Fritzsche
+# SPDX-License-Identifier: Apache-2.0 OR MIT
+"""Worker process running mypy on behalf of the pytest process.
+
+The worker reads one JSON encoded request per line from stdin and
+writes one JSON encoded response per line to its original stdout.
+Anything else written to stdout (e.g., by mypy plugins) is redirected
+to stderr.
+
+Started with ``--zygote`` the worker acts as a zygote: It imports mypy
+and checks an empty module once per set of mypy flags to build a warm
+cache of the standard library. Each request is then handled by a forked
+child process which starts from a copy of the warm cache.
+
+Requests with ``"profile": true`` time the hook callbacks of the
+configured mypy plugins (see :func:`profile_plugin_hooks`).
+
+This module must only depend on the standard library and mypy.
+"""
+
+import contextlib
+import functools
+import importlib
+import inspect
+import io
+import json
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import time
+import traceback
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+
+__all__ = [
+    "HookTiming",
+    "capture_crash_reports",
+    "current_rss",
+    "main",
+    "mypy_api_run",
+    "profile_plugin_hooks",
+    "seed_cache_dir",
+]
+
+_CACHE_DIR_PREFIX = "--cache-dir="
+_SHADOW_FILE_FLAG = "--shadow-file"
+
+# Exit status requested by SIGTERM (mypy.api.run swallows SystemExit)
+_terminated: Optional[int] = None
+
+
+def current_rss() -> Optional[int]:
+    """Return the resident set size of this process in bytes (if known)."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:  # pragma: no cover
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is given in bytes on macOS and in KiB everywhere else
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def seed_cache_dir(source_dir: str, target_dir: str) -> None:
+    """Populate the mypy cache *target_dir* with the files of *source_dir*.
+
+    Files are hard linked if possible and copied otherwise. This is safe
+    as mypy replaces cache files instead of writing into them.
+    """
+    for dirpath, _, filenames in os.walk(source_dir):
+        target_dirpath = os.path.join(target_dir, os.path.relpath(dirpath, source_dir))
+        os.makedirs(target_dirpath, exist_ok=True)
+        for filename in filenames:
+            source = os.path.join(dirpath, filename)
+            target = os.path.join(target_dirpath, filename)
+            if os.path.exists(target):
+                continue
+            try:
+                os.link(source, target)
+            except OSError:
+                shutil.copy2(source, target)
+
+
+def split_cache_dir(flags: List[str]) -> Tuple[List[str], Optional[str]]:
+    """Split the ``--cache-dir`` option from the other mypy *flags*."""
+    other_flags = [flag for flag in flags if not flag.startswith(_CACHE_DIR_PREFIX)]
+    cache_dirs = [
+        flag[len(_CACHE_DIR_PREFIX) :]
+        for flag in flags
+        if flag.startswith(_CACHE_DIR_PREFIX)
+    ]
+    return other_flags, (cache_dirs[-1] if cache_dirs else None)
+
+
+def split_shadow_files(flags: List[str]) -> Tuple[List[str], List[Tuple[str, str]]]:
+    """Split the ``--shadow-file SOURCE SHADOW`` options from the other *flags*."""
+    other_flags: List[str] = []
+    shadow_files: List[Tuple[str, str]] = []
+    i = 0
+    while i < len(flags):
+        if flags[i] == _SHADOW_FILE_FLAG and i + 2 < len(flags):
+            shadow_files.append((flags[i + 1], flags[i + 2]))
+            i += 3
+        else:
+            other_flags.append(flags[i])
+            i += 1
+    return other_flags, shadow_files
+
+
+# Methods of mypy.plugin.Plugin returning hook callbacks (some only exist
+# in newer mypy versions)
+_PLUGIN_HOOKS = (
+    "get_type_analyze_hook",
+    "get_function_signature_hook",
+    "get_function_hook",
+    "get_method_signature_hook",
+    "get_method_hook",
+    "get_attribute_hook",
+    "get_class_attribute_hook",
+    "get_class_decorator_hook",
+    "get_class_decorator_hook_2",
+    "get_metaclass_hook",
+    "get_base_class_hook",
+    "get_customize_class_mro_hook",
+    "get_dynamic_class_hook",
+)
+
+
+class HookTiming(NamedTuple):
+    """Time spent in the callbacks of a plugin hook for one source line."""
+
+    hook: str
+    #: Absolute path of the checked file (if known)
+    path: Optional[str]
+    line: int
+    calls: int
+    seconds: float
+
+
+@contextlib.contextmanager
+def profile_plugin_hooks() -> Iterator[List[HookTiming]]:
+    """Time the hook callbacks of the mypy plugins loaded within the context.
+
+    Mypy imports the configured plugins with :func:`importlib.import_module`,
+    which is replaced within the context to subclass the plugin classes
+    returned by their entry points. The yielded list is filled with the
+    timings on exit. Not thread-safe.
+    """
+    totals: Dict[Tuple[str, Optional[str], int], List[float]] = {}
+    import_module = importlib.import_module
+
+    def profiling_import_module(name: str, package: Optional[str] = None) -> Any:
+        return _ProfilingModule(import_module(name, package), totals)
+
+    timings: List[HookTiming] = []
+    importlib.import_module = profiling_import_module
+    try:
+        yield timings
+    finally:
+        importlib.import_module = import_module
+        timings.extend(
+            HookTiming(hook, path, line, int(calls), seconds)
+            for (hook, path, line), (calls, seconds) in totals.items()
+        )
+
+
+class _ProfilingModule:
+    """Module proxy whose functions return profiling plugin classes."""
+
+    def __init__(self, module: Any, totals: Dict[Any, List[float]]) -> None:
+        self._module = module
+        self._totals = totals
+
+    def __getattr__(self, name: str) -> Any:
+        value = getattr(self._module, name)
+        if not inspect.isfunction(value):
+            return value
+
+        @functools.wraps(value)
+        def entry_point(*args, **kwargs):
+            from mypy.plugin import Plugin
+
+            result = value(*args, **kwargs)
+            if isinstance(result, type) and issubclass(result, Plugin):
+                return _profiling_plugin(result, self._totals)
+            return result
+
+        return entry_point
+
+
+def _profiling_plugin(plugin_type: type, totals: Dict[Any, List[float]]) -> type:
+    namespace = {
+        name: _timed_hook_getter(getattr(plugin_type, name), name, totals)
+        for name in _PLUGIN_HOOKS
+        if hasattr(plugin_type, name)
+    }
+    return type(plugin_type.__name__, (plugin_type,), namespace)
+
+
+def _timed_hook_getter(
+    get_hook: Callable[..., Any], name: str, totals: Dict[Any, List[float]]
+) -> Callable[..., Any]:
+    def timed_get_hook(self, fullname: str) -> Any:
+        callback = get_hook(self, fullname)
+        if callback is None:
+            return None
+
+        def timed_callback(ctx: Any) -> Any:
+            start = time.perf_counter()
+            try:
+                return callback(ctx)
+            finally:
+                total = totals.setdefault((name, *_hook_location(ctx)), [0, 0.0])
+                total[0] += 1
+                total[1] += time.perf_counter() - start
+
+        return timed_callback
+
+    return timed_get_hook
+
+
+def _hook_location(ctx: Any) -> Tuple[Optional[str], int]:
+    """Return the file and line a plugin hook callback is called for."""
+    line = -1
+    for attr in ("context", "cls", "call"):
+        node = getattr(ctx, attr, None)
+        if node is not None:
+            line = getattr(node, "line", -1)
+            break
+    # Type checker, semantic analyzer or type analyzer (wrapping the latter)
+    api = getattr(ctx, "api", None)
+    for candidate in (api, getattr(api, "api", None)):
+        path = getattr(candidate, "path", None)
+        if path is None:
+            path = getattr(getattr(candidate, "cur_mod_node", None), "path", None)
+        if isinstance(path, str):
+            return os.path.abspath(path), line
+    return None, line
+
+
+@contextlib.contextmanager
+def capture_crash_reports(stream: IO[str]) -> Iterator[None]:
+    """Redirect :data:`sys.stdout` and :data:`sys.stderr` to *stream*.
+
+    Mypy writes the report of an internal error (including the traceback)
+    to them instead of the streams passed to it.
+    """
+    with contextlib.redirect_stdout(stream), contextlib.redirect_stderr(stream):
+        yield
+
+
+def mypy_api_run(args: List[str]) -> Tuple[str, str, int]:
+    """Run :func:`mypy.api.run` with the command line arguments *args*.
+
+    Crash reports are appended to the returned error output.
+    """
+    import mypy.api
+
+    captured = io.StringIO()
+    with capture_crash_reports(captured):
+        out, err, returncode = mypy.api.run(args)
+    return out, err + captured.getvalue(), returncode
+
+
+def run_mypy(
+    flags: List[str], files: List[str], profile: bool = False
+) -> Dict[str, Any]:
+    timings: List[HookTiming] = []
+    try:
+        with contextlib.ExitStack() as stack:
+            if profile:
+                timings = stack.enter_context(profile_plugin_hooks())
+            out, err, returncode = mypy_api_run(flags + files)
+    except Exception:  # pragma: no cover
+        out, err, returncode = "", traceback.format_exc(), 2
+    if _terminated is not None:
+        # Terminated while mypy was running, do not report its aborted output
+        raise SystemExit(_terminated)
+    response: Dict[str, Any] = {"out": out, "err": err, "returncode": returncode}
+    if profile:
+        response["hook_timings"] = timings
+    return response
+
+
+def handle_request(request: Dict[str, Any]) -> Dict[str, Any]:
+    response = run_mypy(
+        request["flags"], request["files"], request.get("profile", False)
+    )
+    response["rss"] = current_rss()
+    return response
+
+
+class Zygote:
+    """Handle requests in forked children of a pre-warmed process."""
+
+    def __init__(self) -> None:
+        self.tmp_dir = tempfile.mkdtemp(prefix="pytest-mypy-testing-zygote-")
+        self.warm_cache_dirs: Dict[Tuple[str, ...], str] = {}
+
+    def warm_cache_dir(self, flags: List[str]) -> str:
+        other_flags, _ = split_cache_dir(flags)
+        other_flags, _ = split_shadow_files(other_flags)
+        key = tuple(other_flags)
+        if key not in self.warm_cache_dirs:
+            warm_dir = os.path.join(self.tmp_dir, str(len(self.warm_cache_dirs)))
+            cache_dir = os.path.join(warm_dir, "mypy_cache")
+            empty_module = os.path.join(warm_dir, "pytest_mypy_testing_empty.py")
+            os.makedirs(cache_dir)
+            with open(empty_module, "w", encoding="utf-8"):
+                pass
+            run_mypy(other_flags + [_CACHE_DIR_PREFIX + cache_dir], [empty_module])
+            self.warm_cache_dirs[key] = cache_dir
+        return self.warm_cache_dirs[key]
+
+    def handle_request(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        warm_cache_dir = self.warm_cache_dir(request["flags"])
+        _, cache_dir = split_cache_dir(request["flags"])
+
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:  # pragma: no cover  # child
+            os.close(read_fd)
+            try:
+                if cache_dir:
+                    seed_cache_dir(warm_cache_dir, cache_dir)
+                response = run_mypy(
+                    request["flags"], request["files"], request.get("profile", False)
+                )
+                with os.fdopen(write_fd, "w", encoding="utf-8") as f:
+                    f.write(json.dumps(response))
+            finally:
+                os._exit(0)
+
+        os.close(write_fd)
+        with os.fdopen(read_fd, "r", encoding="utf-8") as f:
+            data = f.read()
+        _, status = os.waitpid(pid, 0)
+        if data:
+            response = json.loads(data)
+        else:
+            response = {
+                "out": "",
+                "err": f"mypy child process {pid} failed (wait status {status})\n",
+                "returncode": 2,
+            }
+        response["rss"] = current_rss()
+        return response
+
+    def close(self) -> None:
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+def _exit_on_sigterm(signum, frame) -> None:
+    global _terminated
+    _terminated = 128 + signum
+    raise SystemExit(_terminated)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    # Clean up (e.g., the zygote's warm caches) when terminated
+    signal.signal(signal.SIGTERM, _exit_on_sigterm)
+    responses = os.fdopen(os.dup(sys.stdout.fileno()), "w", encoding="utf-8")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    import mypy.main  # noqa: F401  # import mypy before the first request arrives
+
+    zygote = Zygote() if "--zygote" in argv else None
+    try:
+        for line in sys.stdin:
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            if zygote is not None:
+                response = zygote.handle_request(request)
+            else:
+                response = handle_request(request)
+            responses.write(json.dumps(response) + "\n")
+            responses.flush()
+    finally:
+        if zygote is not None:
+            zygote.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
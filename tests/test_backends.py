@@ -0,0 +1,275 @@
+# SPDX-FileCopyrightText: David Fritzsche
+# SPDX-License-Identifier: CC0-1.0
+
+import pathlib
+import sys
+import threading
+import time
+
+import pytest
+
+from pytest_mypy_testing.backends import (
+    BuildBackend,
+    ForkServerBackend,
+    InProcessBackend,
+    MypyBackend,
+    SubprocessBackend,
+    is_backend_supported,
+    run_with_timeout,
+)
+from pytest_mypy_testing.strutil import dedent
+from pytest_mypy_testing.worker import HookTiming
+
+
+CONTENT = dedent(
+    """
+    a: int = "abc"
+    """
+)
+
+
+def mypy_args(tmp_path: pathlib.Path):
+    path = tmp_path / "z.py"
+    path.write_text(CONTENT)
+    flags = [
+        "--cache-dir={}".format(tmp_path / "mypy_cache"),
+        "--no-error-summary",
+        "--show-error-codes",
+    ]
+    return flags, [str(path)]
+
+
+@pytest.mark.parametrize(
+    "backend_cls",
+    [
+        InProcessBackend,
+        BuildBackend,
+        SubprocessBackend,
+        pytest.param(
+            ForkServerBackend,
+            marks=pytest.mark.skipif(
+                not is_backend_supported("forkserver"), reason="requires os.fork"
+            ),
+        ),
+    ],
+)
+def test_backend_run(tmp_path, backend_cls):
+    backend: MypyBackend = backend_cls()
+    try:
+        out, err, returncode = backend.run(*mypy_args(tmp_path))
+    finally:
+        backend.close()
+
+    assert returncode == 1
+    assert "[assignment]" in out
+
+
+def test_subprocess_backend_recycles_worker(tmp_path):
+    backend = SubprocessBackend(max_files_per_worker=2)
+    try:
+        backend.run(*mypy_args(tmp_path))
+        assert backend._worker is not None
+        pid = backend._worker.pid
+        backend.run(*mypy_args(tmp_path))
+        assert backend._worker is None
+        backend.run(*mypy_args(tmp_path))
+        assert backend._worker is not None
+        assert backend._worker.pid != pid
+    finally:
+        backend.close()
+
+
+def test_subprocess_backend_recycles_worker_on_rss(tmp_path):
+    backend = SubprocessBackend(max_worker_rss=1)
+    try:
+        backend.run(*mypy_args(tmp_path))
+        assert backend._worker is None
+    finally:
+        backend.close()
+
+
+class DyingSubprocessBackend(SubprocessBackend):
+    @property
+    def worker_command(self):
+        return [sys.executable, "-c", "pass"]
+
+
+def test_subprocess_backend_reports_dead_worker(tmp_path):
+    backend = DyingSubprocessBackend()
+    try:
+        out, err, returncode = backend.run(*mypy_args(tmp_path))
+    finally:
+        backend.close()
+
+    assert returncode == 2
+    assert "terminated unexpectedly" in err
+
+
+class HangingSubprocessBackend(SubprocessBackend):
+    @property
+    def worker_command(self):
+        return [sys.executable, "-c", "import time; time.sleep(60)"]
+
+
+def test_subprocess_backend_terminate(tmp_path):
+    backend = HangingSubprocessBackend()
+    results = []
+    thread = threading.Thread(
+        target=lambda: results.append(backend.run(*mypy_args(tmp_path)))
+    )
+    thread.start()
+    try:
+        while backend._worker is None or not backend._worker.busy:
+            time.sleep(0.01)
+        backend.terminate()
+        thread.join(timeout=10)
+        assert not thread.is_alive()
+    finally:
+        backend.close()
+
+    ((out, err, returncode),) = results
+    assert returncode == 2
+    assert "terminated unexpectedly" in err
+
+
+def test_run_with_timeout_terminates_backend(tmp_path):
+    backend = HangingSubprocessBackend()
+    try:
+        start = time.perf_counter()
+        flags, filenames = mypy_args(tmp_path)
+        output = run_with_timeout(backend, flags, filenames, timeout=0.2)
+        assert output is None
+        assert time.perf_counter() - start < 10
+        assert backend._worker is None
+    finally:
+        backend.close()
+
+
+SLEEPING_PLUGIN = dedent(
+    """
+    import time
+
+    def plugin(version):
+        time.sleep(60)
+    """
+)
+
+
+def test_subprocess_backend_checks_after_timeout(tmp_path):
+    plugin_path = tmp_path / "sleeping_plugin.py"
+    plugin_path.write_text(SLEEPING_PLUGIN)
+    config_path = tmp_path / "mypy.ini"
+    config_path.write_text(f"[mypy]\nplugins = {plugin_path}\n")
+    flags, filenames = mypy_args(tmp_path)
+
+    backend = SubprocessBackend()
+    try:
+        sleeping_flags = flags + [f"--config-file={config_path}"]
+        assert run_with_timeout(backend, sleeping_flags, filenames, timeout=2) is None
+        out, err, returncode = backend.run(flags, filenames)
+    finally:
+        backend.close()
+
+    assert returncode == 1, err
+    assert "[assignment]" in out
+
+
+@pytest.mark.skipif(not is_backend_supported("forkserver"), reason="requires os.fork")
+def test_fork_server_backend_reuses_zygote(tmp_path):
+    backend = ForkServerBackend()
+    try:
+        for i in range(2):
+            case_dir = tmp_path / str(i)
+            case_dir.mkdir()
+            out, err, returncode = backend.run(*mypy_args(case_dir))
+            assert returncode == 1
+            assert "[assignment]" in out
+            assert (case_dir / "mypy_cache").is_dir()
+        assert backend._worker is not None
+        assert backend._worker.files_checked == 2
+    finally:
+        backend.close()
+
+
+def test_build_backend_uses_texts_and_reuses_options(tmp_path):
+    backend = BuildBackend()
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    flags, filenames = mypy_args(tmp_path / "a")
+    texts = {filenames[0]: "b: str = 1\n"}
+
+    out, err, returncode = backend.run(flags, filenames, texts)
+    assert returncode == 1
+    assert '(expression has type "int", variable has type "str")' in out
+
+    out, err, returncode = backend.run(*mypy_args(tmp_path / "b"))
+    assert returncode == 1
+    assert '(expression has type "str", variable has type "int")' in out
+    assert len(backend._options) == 1
+
+
+def test_build_backend_reports_invalid_flags(tmp_path):
+    out, err, returncode = BuildBackend().run(["--no-such-flag"], [])
+    assert returncode == 2
+    assert "--no-such-flag" in err
+
+
+@pytest.mark.parametrize("backend_cls", [InProcessBackend, BuildBackend])
+def test_backend_shadow_file(tmp_path, backend_cls):
+    flags, filenames = mypy_args(tmp_path)
+    shadow = tmp_path / "shadow.py"
+    shadow.write_text("a: int = 1\n")
+    flags += ["--shadow-file", filenames[0], str(shadow)]
+
+    out, err, returncode = backend_cls().run(flags, filenames)
+    assert returncode == 0
+    assert "[assignment]" not in out
+
+
+PLUGIN = dedent(
+    """
+    from mypy.plugin import Plugin
+
+    class DoublePlugin(Plugin):
+        def get_function_hook(self, fullname):
+            if fullname.endswith(".double"):
+                return lambda ctx: ctx.default_return_type
+            return None
+
+    def plugin(version):
+        return DoublePlugin
+    """
+)
+
+
+@pytest.mark.parametrize(
+    "backend_cls", [InProcessBackend, BuildBackend, SubprocessBackend]
+)
+def test_backend_profiles_plugin_hooks(tmp_path, backend_cls):
+    (tmp_path / "double_plugin.py").write_text(PLUGIN)
+    config_file = tmp_path / "mypy.ini"
+    config_file.write_text("[mypy]\nplugins = double_plugin.py\n")
+    path = tmp_path / "z.py"
+    path.write_text(
+        "def double(x: int) -> int:\n    return x\n\ndouble(1)\ndouble(2)\n"
+    )
+    flags = [
+        f"--config-file={config_file}",
+        "--cache-dir={}".format(tmp_path / "mypy_cache"),
+    ]
+
+    backend: MypyBackend = backend_cls()
+    backend.profile_plugin_hooks = True
+    try:
+        out, err, returncode = backend.run(flags, [str(path)])
+        timings = backend.take_hook_timings()
+    finally:
+        backend.close()
+
+    assert returncode == 0, out + err
+    assert [timing[:4] for timing in sorted(timings)] == [
+        ("get_function_hook", str(path), 4, 1),
+        ("get_function_hook", str(path), 5, 1),
+    ]
+    assert all(isinstance(timing, HookTiming) for timing in timings)
+    assert backend.take_hook_timings() == []
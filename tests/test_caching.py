@@ -0,0 +1,102 @@
+# SPDX-FileCopyrightText: David Fritzsche
+# SPDX-License-Identifier: CC0-1.0
+
+import importlib.metadata
+import os
+import stat
+
+from pytest_mypy_testing import caching
+from pytest_mypy_testing.backends import InProcessBackend
+from pytest_mypy_testing.caching import WarmCaches
+
+
+FLAGS = ["--no-error-summary", "--show-error-codes"]
+
+
+def test_warm_caches(tmp_path):
+    warm_caches = WarmCaches()
+    backend = InProcessBackend()
+    try:
+        warm_caches.expect(FLAGS)
+        assert warm_caches.get(backend, FLAGS) is None
+
+        warm_caches.expect(FLAGS + ["--cache-dir=foo"])
+        warm_cache_dir = warm_caches.get(backend, FLAGS)
+        assert warm_cache_dir is not None
+        assert warm_caches.get(backend, FLAGS) == warm_cache_dir
+
+        cache_dir = tmp_path / "mypy_cache"
+        warm_caches.seed(backend, FLAGS, str(cache_dir))
+        assert sorted(os.listdir(cache_dir)) == sorted(os.listdir(warm_cache_dir))
+    finally:
+        warm_caches.close()
+    assert not os.path.exists(warm_cache_dir)
+
+
+class CountingBackend(InProcessBackend):
+    def __init__(self):
+        self.calls = []
+
+    def run(self, flags, filenames, texts=None):
+        self.calls.append(filenames)
+        return super().run(flags, filenames, texts)
+
+
+def test_warm_cache_snapshots(tmp_path):
+    snapshot_dir = tmp_path / "snapshots"
+    backend = CountingBackend()
+
+    warm_caches = WarmCaches(str(snapshot_dir), packages=["json"])
+    warm_cache_dir = warm_caches.get(backend, FLAGS)
+    assert warm_cache_dir is not None
+    assert len(backend.calls) == 1
+
+    (snapshot,) = os.listdir(snapshot_dir)
+    assert snapshot == warm_caches.snapshot_name(FLAGS)
+    warm_module = snapshot_dir / snapshot / "pytest_mypy_testing_warm.py"
+    assert warm_module.read_text() == "import json\n"
+    for dirpath, _, filenames in os.walk(warm_cache_dir):
+        for filename in filenames:
+            mode = os.stat(os.path.join(dirpath, filename)).st_mode
+            assert not mode & stat.S_IWUSR
+
+    other_warm_caches = WarmCaches(str(snapshot_dir), packages=["json"])
+    assert other_warm_caches.get(backend, FLAGS) == warm_cache_dir
+    assert len(backend.calls) == 1
+
+    assert WarmCaches(str(snapshot_dir)).snapshot_name(FLAGS) != snapshot
+
+
+def test_snapshot_name_depends_on_installed_versions(monkeypatch):
+    warm_caches = WarmCaches("snapshots", packages=["packaging.version"])
+    name = warm_caches.snapshot_name(FLAGS)
+    assert caching._package_versions(["packaging.version"]) == {
+        "packaging.version": [f"packaging=={importlib.metadata.version('packaging')}"]
+    }
+
+    monkeypatch.setattr(importlib.metadata, "version", lambda name: "0.0")
+    assert warm_caches.snapshot_name(FLAGS) != name
+    assert warm_caches.snapshot_name(FLAGS + ["--no-site-packages"]) != name
+
+
+def test_installed_packages():
+    names = ["os", "__future__", "pytest", "mypy", "pytest_mypy_testing", "missing"]
+    assert caching.installed_packages(names) == ["mypy", "pytest"]
+
+
+def test_warm_cache_includes_imported_packages(tmp_path):
+    snapshot_dir = tmp_path / "snapshots"
+    warm_caches = WarmCaches(str(snapshot_dir), packages=["json"])
+    name = warm_caches.snapshot_name(FLAGS)
+
+    warm_caches.expect(FLAGS, ["typing_extensions"])
+    warm_caches.expect(FLAGS + ["--cache-dir=foo"], ["json"])
+    warm_caches.expect(["--strict"], ["pytest"])
+    assert warm_caches.packages_for(FLAGS) == ["json", "typing_extensions"]
+    assert warm_caches.snapshot_name(FLAGS) != name
+
+    warm_caches.get(InProcessBackend(), FLAGS)
+    warm_module = snapshot_dir / warm_caches.snapshot_name(FLAGS)
+    assert (warm_module / "pytest_mypy_testing_warm.py").read_text() == (
+        "import json\nimport typing_extensions\n"
+    )
@@ -0,0 +1,103 @@
+# SPDX-FileCopyrightText: David Fritzsche
+# SPDX-License-Identifier: CC0-1.0
+
+import pytest
+
+from pytest_mypy_testing.inspection import RevealInspector, RevealSpan, reveal_spans
+from pytest_mypy_testing.message import Severity
+from pytest_mypy_testing.parser import parse_file
+from pytest_mypy_testing.strutil import dedent
+
+
+FLAGS = [
+    "--check-untyped-defs",
+    "--no-error-summary",
+    "--show-error-codes",
+    "--show-column-numbers",
+]
+
+CONTENT = dedent(
+    """
+    import pytest
+
+
+    @pytest.mark.mypy_testing
+    def mypy_test_reveal():
+        x: int = 1
+        reveal_type(x)  # R: builtins.int
+        reveal_type( [x] )  # N: Revealed type is "builtins.list[builtins.int]"
+    """
+)
+
+
+def write_test_file(tmp_path, content, name="test_z.mypy-testing"):
+    path = tmp_path / name
+    path.write_text(content)
+    return parse_file(path, config=None)
+
+
+def test_reveal_spans(tmp_path):
+    mypy_file = write_test_file(tmp_path, CONTENT)
+    assert reveal_spans(mypy_file) == [
+        RevealSpan(7, 17, 7, 17),
+        RevealSpan(8, 18, 8, 20),
+    ]
+
+
+@pytest.mark.parametrize(
+    "line",
+    [
+        "y: str = 1  # E: Incompatible types in assignment",
+        "reveal_type(1); reveal_type(2)  # R: Literal[1]?",
+        "print(1)  # R: builtins.int",
+    ],
+)
+def test_reveal_spans_of_other_expectations(tmp_path, line):
+    mypy_file = write_test_file(tmp_path, CONTENT + f"    {line}\n")
+    assert reveal_spans(mypy_file) is None
+
+
+def test_inspector_replaces_revealed_type_notes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    mypy_file = write_test_file(tmp_path, CONTENT + '    y: int = "a"\n')
+    other_file = write_test_file(tmp_path, CONTENT, "test_other.mypy-testing")
+
+    inspector = RevealInspector()
+    try:
+        result = inspector.check(
+            FLAGS, mypy_file.filename, reveal_spans(mypy_file) or []
+        )
+        other_result = inspector.check(
+            FLAGS, other_file.filename, reveal_spans(other_file) or []
+        )
+    finally:
+        inspector.close()
+
+    assert result is not None
+    (out, err, returncode), revealed = result
+    assert "Revealed type" not in out
+    assert ":9:14: error: Incompatible types in assignment" in out
+    assert returncode == 1
+    assert [
+        (msg.filename, msg.lineno, msg.colno, msg.severity, msg.revealed_type)
+        for msg in revealed
+    ] == [
+        (mypy_file.filename, 7, 17, Severity.NOTE, "builtins.int"),
+        (mypy_file.filename, 8, 18, Severity.NOTE, "builtins.list[builtins.int]"),
+    ]
+    assert revealed == mypy_file.messages
+
+    assert other_result is not None
+    assert other_result[0].returncode == 0
+    assert other_result[1] == other_file.messages
+
+
+def test_inspector_rejects_flags_not_supported_by_dmypy(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    mypy_file = write_test_file(tmp_path, CONTENT)
+    inspector = RevealInspector()
+    try:
+        flags = FLAGS + ["--follow-imports=silent"]
+        assert inspector.check(flags, mypy_file.filename, []) is None
+    finally:
+        inspector.close()
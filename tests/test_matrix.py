@@ -0,0 +1,80 @@
+# SPDX-FileCopyrightText: David Fritzsche
+# SPDX-License-Identifier: CC0-1.0
+
+import os
+import sys
+
+import pytest
+
+from pytest_mypy_testing.matrix import (
+    MypyVersion,
+    detect_versions,
+    resolve_python,
+    version_matches,
+)
+
+
+def mk_python(tmp_path, version):
+    """Create an interpreter wrapper reporting the mypy *version*."""
+    site_dir = tmp_path / f"site-{version}"
+    dist_info = site_dir / f"mypy-{version}.dist-info"
+    dist_info.mkdir(parents=True)
+    (dist_info / "METADATA").write_text(
+        f"Metadata-Version: 2.1\nName: mypy\nVersion: {version}\n"
+    )
+    python = tmp_path / f"python-{version}"
+    python.write_text(f'#!/bin/sh\nPYTHONPATH={site_dir} exec {sys.executable} "$@"\n')
+    python.chmod(0o755)
+    return str(python)
+
+
+posix_only = pytest.mark.skipif(sys.platform == "win32", reason="needs /bin/sh")
+
+
+@posix_only
+def test_detect_versions(tmp_path):
+    pythons = [mk_python(tmp_path, "1.8.0"), mk_python(tmp_path, "1.19.1")]
+
+    assert detect_versions(pythons) == [
+        MypyVersion("mypy-1.8", pythons[0], "1.8.0"),
+        MypyVersion("mypy-1.19", pythons[1], "1.19.1"),
+    ]
+
+
+@posix_only
+def test_detect_versions_labels_ambiguous_versions_in_full(tmp_path):
+    pythons = [mk_python(tmp_path, "1.19.0"), mk_python(tmp_path, "1.19.1")]
+
+    labels = [version.label for version in detect_versions(pythons)]
+    assert labels == ["mypy-1.19.0", "mypy-1.19.1"]
+
+
+@posix_only
+def test_detect_versions_errors(tmp_path):
+    python = mk_python(tmp_path, "1.8.0")
+    with pytest.raises(ValueError, match="same mypy version"):
+        detect_versions([python, python])
+    with pytest.raises(ValueError, match="Cannot run"):
+        detect_versions([str(tmp_path / "missing")])
+
+
+def test_resolve_python(tmp_path):
+    venv = tmp_path / "venv"
+    venv.mkdir()
+    assert resolve_python(str(venv)).startswith(str(venv) + os.sep)
+    assert resolve_python("python3.12") == "python3.12"
+
+
+@pytest.mark.parametrize(
+    "version, specifier, expected",
+    [
+        ("1.19.1", ">=1.10", True),
+        ("1.8.0", ">=1.10", False),
+        ("1.19.1", ">=1.10,<1.19", False),
+        ("1.19.1", "==1.19.*", True),
+        ("1.20.0+dev", ">=1.20.0", True),
+        (None, ">=1.10", True),
+    ],
+)
+def test_version_matches(version, specifier, expected):
+    assert version_matches(version, specifier) == expected
@@ -9,7 +9,9 @@ from pytest_mypy_testing.message import Message, Severity
 from pytest_mypy_testing.output_processing import (
     OutputMismatch,
     diff_message_sequences,
+    find_crash,
     iter_msg_seq_diff_chunks,
+    parse_messages,
 )
 
 
@@ -162,3 +164,24 @@ def test_diff_message_sequences():
     actual = diff_message_sequences(A, B)
 
     assert actual == expected
+
+
+def test_parse_messages_ignores_other_lines():
+    messages = parse_messages(["z.py:1: error: foo", "Traceback", ""])
+    assert [msg.message for msg in messages] == ["foo"]
+
+
+def test_find_crash():
+    traceback = [
+        "z.py:3: error: INTERNAL ERROR -- Please try using mypy master on GitHub:",
+        "Traceback (most recent call last):",
+        '  File "mypy/checker.py", line 1, in check',
+        "AssertionError",
+    ]
+    syntax_error = ["z.py:3: error: Invalid syntax  [syntax]"]
+
+    assert find_crash(1, ["z.py:1: error: foo"]) is None
+    assert find_crash(2, syntax_error) is None
+    assert find_crash(2, ["z.py:1: note: foo"] + traceback) == "\n".join(traceback)
+    assert find_crash(2, ["worker died"]) == "worker died"
+    assert find_crash(-9, []) == "mypy failed with exit code -9"
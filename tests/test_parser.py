@@ -12,8 +12,10 @@ from _pytest.config import Config
 
 from pytest_mypy_testing.parser import (
     MypyTestItem,
+    expand_templates,
     generate_per_line_token_lists,
     parse_file,
+    parse_files,
 )
 from pytest_mypy_testing.strutil import dedent
 
@@ -130,3 +132,196 @@ def test_parse_async(tmp_path):
     assert len(result.items) == 1
     item = result.items[0]
     assert item.name == "mypy_test_invalid_assginment"
+
+
+def test_parse_mark_kwargs(tmp_path):
+    path = tmp_path / "test_mark_kwargs.mypy-testing"
+    path.write_text(
+        dedent(
+            r"""
+            import pytest
+
+            @pytest.mark.mypy_testing(max_seconds=2.5, other=SOME_NAME)
+            @pytest.mark.xfail(reason="foo")
+            @pytest.mark.skip
+            def mypy_test_kwargs():
+                pass
+            """
+        )
+    )
+    config = Mock(spec=Config)
+    result = parse_file(str(path), config)
+    (item,) = result.items
+    assert item.marks == {"mypy_testing", "xfail", "skip"}
+    assert item.mark_kwargs == {
+        "mypy_testing": {"max_seconds": 2.5},
+        "xfail": {"reason": "foo"},
+    }
+
+
+def test_reduced_source_lines(tmp_path):
+    path = tmp_path / "test_reduce.mypy-testing"
+    path.write_text(
+        dedent(
+            r"""
+            import pytest
+
+            @pytest.mark.mypy_testing
+            def mypy_test_one():
+                a: int = 1
+
+            @pytest.mark.mypy_testing
+            def mypy_test_two():
+                b: int = "b"
+            """
+        )
+    )
+    result = parse_file(str(path), None)
+    lines = result.reduced_source_lines(["mypy_test_one"])
+
+    assert len(lines) == len(result.source_lines)
+    assert lines[:6] == result.source_lines[:6]
+    assert lines[6:] == ["", "", ""]
+
+
+def test_parse_parametrized_template(tmp_path):
+    path = tmp_path / "test_template.mypy-testing"
+    path.write_text(
+        dedent(
+            r"""
+            import pytest
+
+            @pytest.mark.mypy_testing
+            @pytest.mark.parametrize("T", ["int", "str"])
+            @pytest.mark.xfail
+            def mypy_test_list(T) -> None:
+                x: list[T] = []
+                reveal_type(x)  # R: builtins.list[builtins.{T}]
+
+            @pytest.mark.mypy_testing
+            def mypy_test_plain():
+                pass
+            """
+        )
+    )
+    result = parse_file(str(path), None)
+
+    assert result.generated
+    assert [item.name for item in result.items] == [
+        "mypy_test_list[int]",
+        "mypy_test_list[str]",
+        "mypy_test_plain",
+    ]
+    int_item, str_item, plain_item = result.items
+    assert result.source_lines[2:8] == [""] * 6
+    assert "def mypy_test_list__mypy_testing_1() -> None:" in result.source_lines
+    assert "    x: list[str] = []" in result.source_lines
+    assert int_item.marks == str_item.marks == {"mypy_testing", "xfail"}
+    assert plain_item.line_offset == 0
+    for item in (int_item, str_item):
+        assert item.lineno - item.line_offset == 3
+        (message,) = item.expected_messages
+        assert message.lineno - item.line_offset == 8
+    assert str_item.expected_messages[0].revealed_type == (
+        "builtins.list[builtins.str]"
+    )
+
+
+def test_expand_templates_product_and_ids():
+    source = dedent(
+        r"""
+        import pytest
+
+        @pytest.mark.mypy_testing
+        @pytest.mark.parametrize("x", [0, 1])
+        @pytest.mark.parametrize("a, b", [("A", None)], ids=["custom"])
+        def mypy_test_product(x, a, b):
+            a.x = x
+        """
+    )
+    expanded = expand_templates(source)
+    assert expanded is not None
+    generated, variants = expanded
+
+    assert sorted(name for name, _ in variants.values()) == [
+        "mypy_test_product[custom-0]",
+        "mypy_test_product[custom-1]",
+    ]
+    assert "    A.x = 1" in generated.splitlines()
+    assert expand_templates("x = 1\n") is None
+
+
+def test_expand_templates_keeps_functions_without_literals(tmp_path):
+    source = dedent(
+        r"""
+        @pytest.mark.mypy_testing
+        @pytest.mark.parametrize("T", TYPES)
+        def mypy_test_list(T):
+            pass
+        """
+    )
+    with pytest.warns(UserWarning, match="literal"):
+        assert expand_templates(source) is None
+
+    path = tmp_path / "test_template.mypy-testing"
+    path.write_text(source)
+    with pytest.warns(UserWarning, match="checking it without parameters"):
+        mypy_file = parse_file(path, config=None)
+    assert not mypy_file.generated
+    assert [item.name for item in mypy_file.items] == ["mypy_test_list"]
+
+
+def test_parse_files(tmp_path):
+    with_items = tmp_path / "test_items.mypy-testing"
+    with_items.write_text(
+        dedent(
+            r"""
+            @pytest.mark.mypy_testing
+            def mypy_test_foo():
+                a: int = "x"  # E: Incompatible types in assignment
+            """
+        )
+    )
+    without_items = tmp_path / "test_plain.py"
+    without_items.write_text("def test_foo():\n    pass  # E: not a mypy test\n")
+    invalid = tmp_path / "test_invalid.mypy-testing"
+    invalid.write_text("@pytest.mark.mypy_testing\ndef mypy_test_foo(:\n")
+
+    parsed = parse_files([with_items, without_items, invalid], 2, keep_ast=False)
+
+    assert sorted(parsed) == [str(with_items), str(without_items)]
+    expected = parse_file(with_items, config=None)
+    for item in expected.items:
+        item.func_node = None
+    assert parsed[str(with_items)] == expected
+    assert parsed[str(without_items)].items == []
+    assert parsed[str(without_items)].source_lines == []
+
+
+def test_parse_imports(tmp_path):
+    path = tmp_path / "test_imports.mypy-testing"
+    path.write_text(
+        dedent(
+            r"""
+            import os.path, typing_extensions as te
+            from . import sibling
+            from pytest import mark
+
+            @mark.mypy_testing
+            def mypy_test_foo():
+                import json
+            """
+        )
+    )
+    mypy_file = parse_file(path, config=None)
+    assert mypy_file.imports == ["json", "os", "pytest", "typing_extensions"]
+
+
+def test_parse_file_without_marker_skips_parsing(tmp_path):
+    path = tmp_path / "test_plain.py"
+    path.write_text("def test_foo(:  # E: not parsed\n")
+
+    mypy_file = parse_file(path, config=None)
+    assert mypy_file.items == []
+    assert mypy_file.messages == []
+    assert mypy_file.source_lines == ["def test_foo(:  # E: not parsed"]
@@ -1,21 +1,63 @@
 # SPDX-FileCopyrightText: David Fritzsche
 # SPDX-License-Identifier: CC0-1.0
 
+import argparse
+import json
+import os
 import pathlib
+import subprocess
+import sys
+import threading
 from types import SimpleNamespace
+from typing import List
 from unittest.mock import Mock
 
+import pluggy
 import pytest
 from _pytest.config import Config
 
-from pytest_mypy_testing.message import Severity
+from pytest_mypy_testing import hooks, plugin
+from pytest_mypy_testing.backends import (
+    BACKENDS,
+    BuildBackend,
+    InProcessBackend,
+    MypyBackend,
+    MypyOutput,
+    SubprocessBackend,
+)
+from pytest_mypy_testing.matrix import MypyVersion
+from pytest_mypy_testing.message import Message, Severity
 from pytest_mypy_testing.parser import MypyTestFile
 from pytest_mypy_testing.plugin import (
+    BACKEND_NAMES,
     MypyAssertionError,
+    MypyCrashError,
+    MypyFileAssertionError,
+    MypyResult,
+    MypyRun,
+    MypyTimeBudgetError,
+    MypyTimeoutError,
     PytestMypyFile,
+    PytestMypyFileItem,
+    _backend_key,
+    _candidate_files,
+    _durations_key,
+    _matrix_key,
+    _mismatch_stats_key,
+    _parse_shard,
+    _parsed_files_key,
+    _share_runs,
+    _warm_caches_key,
+    _watch,
+    _write_json_report,
     pytest_collect_file,
+    pytest_collection_finish,
+    pytest_collection_modifyitems,
+    pytest_sessionfinish,
+    pytest_unconfigure,
 )
 from pytest_mypy_testing.strutil import dedent
+from pytest_mypy_testing.worker import HookTiming
 
 
 PYTEST_VERSION = pytest.__version__
@@ -35,14 +77,44 @@ def test_create_mypy_assertion_error():
     MypyAssertionError(None, [])
 
 
-def mk_dummy_parent(tmp_path: pathlib.Path, filename, content=""):
+INI_DEFAULTS = {
+    "python_files": ["test_*.py", "*_test.py"],
+    "mypy_testing_lean": True,
+    "mypy_testing_max_seconds": None,
+    "mypy_testing_flags": [],
+    "mypy_testing_follow_imports": [],
+    "mypy_testing_share_cache": True,
+    "mypy_testing_granularity": "function",
+    "mypy_testing_max_mismatches": "20",
+    "mypy_testing_max_session_mismatches": "200",
+    "mypy_testing_bisect_crashes": False,
+    "mypy_testing_timeout": None,
+}
+
+
+def mk_dummy_parent(tmp_path: pathlib.Path, filename, content="", ini=None, plugins=()):
     path = tmp_path / filename
     path.write_text(content)
 
+    pluginmanager = pluggy.PluginManager("pytest")
+    pluginmanager.add_hookspecs(hooks)
+    for plugin_module in [plugin, *plugins]:
+        pluginmanager.register(plugin_module)
+
     config = Mock(spec=Config)
+    config.hook = pluginmanager.hook
     config.rootdir = str(tmp_path)
     config.rootpath = str(tmp_path)
-    config.getini.return_value = ["test_*.py", "*_test.py"]
+    config.getini.side_effect = {**INI_DEFAULTS, **(ini or {})}.__getitem__
+    config.stash = pytest.Stash()
+    config.option = SimpleNamespace(
+        mypy_testing_follow_imports=None,
+        mypy_testing_inspect_reveals=False,
+        mypy_testing_json_report=None,
+        mypy_testing_profile_plugins=False,
+        mypy_testing_warm_cache=None,
+        mypy_testing_timeout=None,
+    )
     session = SimpleNamespace(
         config=config, isinitpath=lambda p: True, _initialpaths=[]
     )
@@ -87,3 +159,1085 @@ def test_pytest_collect_file(tmp_path, filename):
     actual.mypy_file.items = []
 
     assert actual.mypy_file == expected
+
+
+@pytest.mark.parametrize(
+    "max_seconds,duration,exceeded",
+    [(1, 0.5, False), (1, 1.5, True), (None, 100.0, False)],
+)
+def test_max_seconds_from_marker(tmp_path, max_seconds, duration, exceeded):
+    content = dedent(
+        f"""
+        @pytest.mark.mypy_testing(max_seconds={max_seconds!r})
+        def foo():
+            pass
+        """
+    )
+    parent = mk_dummy_parent(tmp_path, "test_z.py", content)
+    file = call_pytest_collect_file(parent.path, parent)
+    file._mypy_results[tuple(file.mypy_flags())] = MypyResult(
+        [], 0, [], [], [], duration=duration
+    )
+    (item,) = file.collect()
+
+    assert item.max_seconds == max_seconds
+    if exceeded:
+        with pytest.raises(MypyTimeBudgetError):
+            item.runtest()
+    else:
+        item.runtest()
+
+
+def test_max_seconds_from_ini(tmp_path):
+    content = dedent(
+        """
+        @pytest.mark.mypy_testing
+        def foo():
+            pass
+        """
+    )
+    parent = mk_dummy_parent(
+        tmp_path, "test_z.py", content, ini={"mypy_testing_max_seconds": "2.5"}
+    )
+    file = call_pytest_collect_file(parent.path, parent)
+    file._mypy_results[tuple(file.mypy_flags())] = MypyResult(
+        [], 0, [], [], [], duration=3.0
+    )
+    (item,) = file.collect()
+
+    assert item.max_seconds == 2.5
+    with pytest.raises(MypyTimeBudgetError, match="exceeding the time budget"):
+        item.runtest()
+
+
+@pytest.mark.parametrize("lean", [True, False])
+def test_lean_mode_releases_memory(tmp_path, lean):
+    content = dedent(
+        """
+        @pytest.mark.mypy_testing
+        def foo():
+            pass
+        """
+    )
+    parent = mk_dummy_parent(
+        tmp_path, "test_z.py", content, ini={"mypy_testing_lean": lean}
+    )
+    file = call_pytest_collect_file(parent.path, parent)
+    (item,) = file.collect()
+
+    assert (item.mypy_item.func_node is None) == lean
+
+    file._mypy_results[()] = MypyResult([], 0, ["z.py:3: error: foo"], [], [])
+    file.teardown()
+    assert file._mypy_results
+
+    file.expect_items(1)
+    item.teardown()
+    assert (not file._mypy_results) == lean
+    assert (file.mypy_file.source_lines == []) == lean
+
+
+class CountingBackend(BuildBackend):
+    warms_cache = True
+
+    def __init__(self):
+        super().__init__()
+        self.checked = []
+
+    def run(self, flags, filenames, texts=None):
+        self.checked.extend(filenames)
+        return super().run(flags, filenames, texts)
+
+
+def test_lean_mode_keeps_results_of_interleaved_files(tmp_path):
+    template = dedent(
+        """
+        import pytest
+        from typing import List
+
+        @pytest.mark.mypy_testing
+        @pytest.mark.parametrize("T", ["int", "str"])
+        def mypy_test_list(T) -> None:
+            x: List[T] = []
+            reveal_type(x)  # R: builtins.list[builtins.{T}]
+        """
+    )
+    plain = dedent(
+        """
+        import pytest
+
+        @pytest.mark.mypy_testing
+        def mypy_test_one() -> None:
+            reveal_type(1)  # R: Literal[1]?
+
+        @pytest.mark.mypy_testing
+        def mypy_test_two() -> None:
+            reveal_type("a")  # R: Literal['a']?
+        """
+    )
+    parent = mk_dummy_parent(tmp_path, "test_a.mypy-testing", template)
+    other_parent = mk_dummy_parent(tmp_path, "test_b.mypy-testing", plain)
+    other_parent.config = parent.config
+    backend = parent.config.stash[_backend_key] = CountingBackend()
+    file = call_pytest_collect_file(parent.path, parent)
+    other_file = call_pytest_collect_file(other_parent.path, other_parent)
+    assert file.mypy_file.generated
+
+    items = list(file.collect())
+    other_items = list(other_file.collect())
+    assert [item.name for item in items] == [
+        "[mypy]mypy_test_list[int]",
+        "[mypy]mypy_test_list[str]",
+    ]
+    file.expect_items(len(items))
+    other_file.expect_items(len(other_items))
+    # Items of both files run alternately, e.g. with --failed-first
+    for item, other_item in zip(items, other_items, strict=True):
+        for test_item in (item, other_item):
+            test_item.runtest()
+            test_item.teardown()
+        file.teardown()
+        other_file.teardown()
+
+    assert backend.checked == [str(file.path), str(other_file.path)]
+    assert not file._mypy_results and not other_file._mypy_results
+    assert file.mypy_file.source_lines == []
+
+    # Checking the file again after releasing it uses the generated source
+    assert "    x: List[str] = []" in file.source_text().splitlines()
+    items[1].runtest()
+    assert backend.checked[2:] == [str(file.path)]
+
+
+@pytest.mark.parametrize("xdist_worker", [False, True])
+def test_lean_mode_keeps_results_on_xdist_workers(tmp_path, xdist_worker):
+    content = dedent(
+        """
+        import pytest
+
+        @pytest.mark.mypy_testing
+        def mypy_test_one() -> None:
+            pass
+
+        @pytest.mark.mypy_testing
+        def mypy_test_two() -> None:
+            pass
+        """
+    )
+    parent = mk_dummy_parent(
+        tmp_path,
+        "test_a.mypy-testing",
+        content,
+        ini={"mypy_testing_reduce": False, "mypy_testing_dedupe": False},
+    )
+    if xdist_worker:
+        # The scheduler may send the other items to other workers
+        parent.config.workerinput = {"workerid": "gw0"}
+    parent.config.stash[_backend_key] = CountingBackend()
+    file = call_pytest_collect_file(parent.path, parent)
+    items = list(file.collect())
+    pytest_collection_finish(SimpleNamespace(config=parent.config, items=items))
+
+    file._mypy_results[()] = MypyResult([], 0, [], [], [])
+    items[0].teardown()
+    assert file._mypy_results
+    items[1].teardown()
+    assert (not file._mypy_results) != xdist_worker
+
+
+@pytest.mark.parametrize("xdist_worker", [False, True])
+def test_xdist_workers_do_not_prefetch(tmp_path, monkeypatch, xdist_worker):
+    parent = mk_dummy_parent(tmp_path, "test_a.mypy-testing")
+    if xdist_worker:
+        parent.config.workerinput = {"workerid": "gw0"}
+    parent.config.option.collectonly = False
+    parent.config.option.mypy_testing_jobs = 2
+    parent.config.option.mypy_testing_watch = False
+    prefetched: List[SimpleNamespace] = []
+    monkeypatch.setattr(plugin, "_prefetch", prefetched.append)
+    session = SimpleNamespace(
+        config=parent.config, items=[], shouldfail=False, shouldstop=False
+    )
+
+    loop = plugin.pytest_runtestloop(session)
+    next(loop)
+    with pytest.raises(StopIteration):
+        loop.send(True)
+    assert prefetched == ([] if xdist_worker else [session])
+
+
+@pytest.mark.parametrize("value,expected", [("1/1", (0, 1)), ("3/4", (2, 4))])
+def test_parse_shard(value, expected):
+    assert _parse_shard(value) == expected
+
+
+@pytest.mark.parametrize("value", ["", "1", "a/b", "0/2", "3/2", "1/2/3"])
+def test_parse_shard_invalid(value):
+    with pytest.raises(argparse.ArgumentTypeError):
+        _parse_shard(value)
+
+
+def test_shards_cover_all_files_without_overlap(tmp_path):
+    content = dedent(
+        """
+        @pytest.mark.mypy_testing
+        def foo():
+            pass
+
+        @pytest.mark.mypy_testing
+        def bar():
+            pass
+        """
+    )
+    items = []
+    for index in range(7):
+        parent = mk_dummy_parent(tmp_path, f"test_{index}.mypy-testing", content)
+        parent.nodeid = f"test_{index}.mypy-testing"
+        items.extend(call_pytest_collect_file(parent.path, parent).collect())
+    other_item = object()
+    items.append(other_item)
+
+    selected_files = []
+    for k in range(1, 4):
+        config = Mock()
+        config.option.mypy_testing_shard = _parse_shard(f"{k}/3")
+        selected = list(items)
+        pytest_collection_modifyitems(None, config, selected)
+        assert other_item in selected
+        selected.remove(other_item)
+        files = {item.parent.nodeid for item in selected}
+        assert len(selected) == 2 * len(files)
+        selected_files.append(files)
+
+    assert set.union(*selected_files) == {f"test_{i}.mypy-testing" for i in range(7)}
+    assert sum(len(files) for files in selected_files) == 7
+
+
+class DictCache:
+    """In-memory stand-in for the pytest cache."""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key, default):
+        return self.data.get(key, default)
+
+    def set(self, key, value):
+        self.data[key] = json.loads(json.dumps(value))
+
+
+def test_shards_are_stable_across_sharded_sessions(tmp_path):
+    content = "@pytest.mark.mypy_testing\ndef foo():\n    pass\n"
+    cache = DictCache()
+    nodeids = [f"test_{index}.mypy-testing" for index in range(6)]
+
+    def run_session(shard):
+        parent = mk_dummy_parent(tmp_path, "test_0.mypy-testing", content)
+        config = parent.config
+        config.cache = cache
+        config.option.mypy_testing_shard = shard
+        items = []
+        for nodeid in nodeids:
+            file_parent = mk_dummy_parent(tmp_path, nodeid, content)
+            file_parent.config = config
+            file_parent.nodeid = nodeid
+            items.extend(
+                call_pytest_collect_file(file_parent.path, file_parent).collect()
+            )
+        config.hook = Mock()
+        pytest_collection_modifyitems(None, config, items)
+        # Durations differ between sessions, e.g. by the cache warmed up
+        slowdown = 1.0 if shard is None else 100.0
+        config.stash[_durations_key] = {
+            item.parent.nodeid: slowdown * (1 + nodeids.index(item.parent.nodeid))
+            for item in items
+        }
+        pytest_sessionfinish(SimpleNamespace(config=config))
+        return {item.parent.nodeid for item in items}
+
+    # Durations of an unsharded session
+    assert run_session(None) == set(nodeids)
+    recorded = dict(cache.data)
+    assert recorded
+
+    selected_files = [run_session(_parse_shard(f"{k}/2")) for k in (1, 2)]
+    assert set.union(*selected_files) == set(nodeids)
+    assert not set.intersection(*selected_files)
+    assert cache.data == recorded
+    assert selected_files == [run_session(_parse_shard(f"{k}/2")) for k in (1, 2)]
+
+
+def test_mypy_run_relocate(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    old = str(tmp_path / "a" / "test_z.mypy-testing")
+    new = str(tmp_path / "b" / "test_z.mypy-testing")
+    run = MypyRun(
+        ["--flag", old],
+        MypyOutput(
+            f"{old}:1: error: foo\na/test_z.mypy-testing:2: note: bar\nother.py:3: x\n",
+            "",
+            1,
+        ),
+        1.5,
+    )
+
+    relocated = run.relocate(old, new)
+
+    assert relocated.mypy_args == ["--flag", new]
+    assert relocated.output.out.splitlines() == [
+        f"{new}:1: error: foo",
+        f"{new}:2: note: bar",
+        "other.py:3: x",
+    ]
+    assert relocated.duration == 1.5
+
+
+def test_identical_files_share_mypy_run(tmp_path):
+    content = dedent(
+        """
+        @pytest.mark.mypy_testing
+        def foo():
+            a: int = "abc"  # E: Incompatible types in assignment (expression has type "str", variable has type "int")  [assignment]
+        """
+    )
+    files = []
+    for name in ["a", "b"]:
+        (tmp_path / name).mkdir()
+        parent = mk_dummy_parent(tmp_path / name, "test_z.mypy-testing", content)
+        files.append(call_pytest_collect_file(parent.path, parent))
+    parent = mk_dummy_parent(tmp_path, "test_y.mypy-testing", content + "\n")
+    files.append(call_pytest_collect_file(parent.path, parent))
+
+    _share_runs(files)
+    assert files[0]._mypy_share is files[1]._mypy_share
+    assert files[2]._mypy_share is None
+
+    calls = []
+
+    def own_run(filename, flags_key):
+        calls.append(filename)
+        line = (
+            f"{filename}:3:14: error: Incompatible types in assignment "
+            '(expression has type "str", variable has type "int")  [assignment]'
+        )
+        return MypyRun([str(filename)], MypyOutput(line + "\n", "", 1), 0.5)
+
+    files[0]._own_run = own_run
+
+    for file in reversed(files[:2]):
+        (item,) = file.collect()
+        item.runtest()
+    assert calls == [files[0].path]
+
+
+def test_select_items_blanks_other_items(tmp_path):
+    content = dedent(
+        """
+        @pytest.mark.mypy_testing
+        def foo():
+            pass
+
+        @pytest.mark.mypy_testing
+        def bar():
+            pass
+        """
+    )
+    parent = mk_dummy_parent(tmp_path, "test_z.mypy-testing", content)
+    file = call_pytest_collect_file(parent.path, parent)
+    full_key = file.content_key()
+    ((flags_key, selected),) = file.flag_groups().items()
+    assert selected is None
+    assert file.source_text(selected) == content
+
+    file.select_items(["bar"])
+    assert file.flag_groups() == {flags_key: {"bar"}}
+    reduced = "\n" * 4 + content.split("\n\n", 1)[1]
+    assert file.source_text({"bar"}) == reduced
+    assert file.content_key() != full_key
+
+    file.mypy_file.source_lines = []
+    assert file.source_text({"bar"}) == reduced
+
+
+def test_mypy_flags_per_directory_and_item(tmp_path):
+    content = dedent(
+        """
+        @pytest.mark.mypy_testing
+        def foo():
+            pass
+
+        @pytest.mark.mypy_testing(flags=["--strict"])
+        def bar():
+            pass
+
+        @pytest.mark.mypy_testing(flags="--strict")
+        def baz():
+            pass
+        """
+    )
+    (tmp_path / "strict").mkdir()
+    parent = mk_dummy_parent(
+        tmp_path / "strict",
+        "test_z.mypy-testing",
+        content,
+        ini={
+            "mypy_testing_flags": [
+                "strict: --warn-unreachable",
+                "other: --no-implicit-reexport",
+            ]
+        },
+    )
+    parent.config.rootpath = str(tmp_path)
+    file = call_pytest_collect_file(parent.path, parent)
+    foo, bar, baz = file.mypy_file.items
+
+    base_flags = file.mypy_flags()
+    assert base_flags[-1] == "--warn-unreachable"
+    assert "--no-implicit-reexport" not in base_flags
+    assert file.mypy_flags(foo) == base_flags
+    assert file.mypy_flags(bar) == file.mypy_flags(baz) == base_flags + ["--strict"]
+    assert file.flag_groups() == {
+        tuple(base_flags): {"foo"},
+        tuple(base_flags + ["--strict"]): {"bar", "baz"},
+    }
+    assert file.content_key() is None
+
+
+def test_invalid_directory_flags(tmp_path):
+    parent = mk_dummy_parent(
+        tmp_path,
+        "test_z.mypy-testing",
+        "@pytest.mark.mypy_testing\ndef foo():\n    pass\n",
+        ini={"mypy_testing_flags": ["--strict"]},
+    )
+    with pytest.raises(pytest.UsageError, match="DIR: OPTIONS"):
+        call_pytest_collect_file(parent.path, parent)
+
+
+def test_follow_imports_policy_per_directory(tmp_path):
+    content = "@pytest.mark.mypy_testing\ndef foo():\n    pass\n"
+    (tmp_path / "sub").mkdir()
+    ini = {"mypy_testing_follow_imports": ["silent", "sub: skip", "other: full"]}
+    parent = mk_dummy_parent(tmp_path, "test_z.mypy-testing", content, ini=ini)
+    sub_parent = mk_dummy_parent(
+        tmp_path / "sub", "test_z.mypy-testing", content, ini=ini
+    )
+    sub_parent.config.rootpath = str(tmp_path)
+    file = call_pytest_collect_file(parent.path, parent)
+    sub_file = call_pytest_collect_file(sub_parent.path, sub_parent)
+
+    flags = file.mypy_flags()
+    sub_flags = sub_file.mypy_flags()
+    assert "--no-silence-site-packages" not in flags
+    assert "--no-site-packages" not in flags
+    assert sub_flags[sub_flags.index("--no-site-packages") + 1] == (
+        "--ignore-missing-imports"
+    )
+    assert file.content_key() != sub_file.content_key()
+
+    sub_parent.config.option.mypy_testing_follow_imports = "full"
+    sub_file = call_pytest_collect_file(sub_parent.path, sub_parent)
+    assert "--no-silence-site-packages" in sub_file.mypy_flags()
+
+    parent = mk_dummy_parent(
+        tmp_path,
+        "test_z.mypy-testing",
+        content,
+        ini={"mypy_testing_follow_imports": ["sub: none"]},
+    )
+    with pytest.raises(pytest.UsageError, match="mypy_testing_follow_imports"):
+        call_pytest_collect_file(parent.path, parent)
+
+
+def test_file_granularity(tmp_path):
+    content = dedent(
+        """
+        @pytest.mark.mypy_testing
+        def foo():
+            a: int = "abc"  # E: foo
+
+        @pytest.mark.mypy_testing
+        def bar():
+            pass
+
+        @pytest.mark.mypy_testing
+        @pytest.mark.skip
+        def baz():
+            a: int = "abc"  # E: baz
+
+        @pytest.mark.mypy_testing
+        @pytest.mark.xfail
+        def qux():
+            a: int = "abc"  # E: qux
+        """
+    )
+    parent = mk_dummy_parent(
+        tmp_path,
+        "test_z.mypy-testing",
+        content,
+        ini={"mypy_testing_granularity": "file", "mypy_testing_max_seconds": "5"},
+    )
+    file = call_pytest_collect_file(parent.path, parent)
+    (item,) = file.collect()
+    assert isinstance(item, PytestMypyFileItem)
+    assert item.name == "[mypy-file]"
+    assert item.max_seconds == 5.0
+
+    file._mypy_results[tuple(file.mypy_flags())] = MypyResult([], 0, [], [], [])
+    with pytest.raises(MypyFileAssertionError) as excinfo:
+        item.runtest()
+    assert list(excinfo.value.errors_by_function) == ["foo"]
+    (error,) = excinfo.value.errors
+    assert error.lineno == 3
+
+
+def test_plugin_import_does_not_load_mypy_internals():
+    code = (
+        "import sys, pytest, pytest_mypy_testing.plugin; "
+        "print(sorted(m for m in sys.modules if 'mypy' in m))"
+    )
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    output = subprocess.check_output([sys.executable, "-c", code], env=env, text=True)
+
+    assert output.strip() == "['pytest_mypy_testing', 'pytest_mypy_testing.plugin']"
+
+
+def test_backend_names():
+    assert sorted(BACKEND_NAMES) == sorted(BACKENDS)
+
+
+def test_mismatches_are_capped_and_reported(tmp_path):
+    content = "\n".join(
+        ["@pytest.mark.mypy_testing", "def mypy_test_many():"]
+        + [f"    reveal_type({i})  # R: int" for i in range(5)]
+    )
+    parent = mk_dummy_parent(
+        tmp_path,
+        "test_z.mypy-testing",
+        content,
+        ini={
+            "mypy_testing_max_mismatches": "2",
+            "mypy_testing_max_session_mismatches": "3",
+        },
+    )
+    report_path = tmp_path / "report.json"
+    parent.config.option.mypy_testing_json_report = str(report_path)
+    file = call_pytest_collect_file(parent.path, parent)
+    (item,) = file.collect()
+    file._mypy_results[tuple(file.mypy_flags())] = MypyResult([], 0, [], [], [])
+
+    for expected_shown in (2, 1, 0):
+        with pytest.raises(MypyAssertionError) as excinfo:
+            item.runtest()
+        entries = item.repr_failure(excinfo).reprtraceback.reprentries
+        assert len(entries) == expected_shown + 1
+        assert entries[-1].reprfileloc.message == (
+            f"... {5 - expected_shown} more mismatch(es) not shown"
+        )
+
+    stats = parent.config.stash[_mismatch_stats_key]
+    assert (stats.items, stats.shown, stats.hidden) == (3, 3, 12)
+
+    _write_json_report(parent.config, str(report_path))
+    mismatches = json.loads(report_path.read_text())["mismatches"]
+    assert len(mismatches) == 15
+    assert mismatches[0] == {
+        "nodeid": item.nodeid,
+        "function": "mypy_test_many",
+        "line": 3,
+        "kind": "missing",
+        "actual": [],
+        "expected": ["note: Revealed type is 'int'"],
+    }
+
+
+class CrashingBackend(MypyBackend):
+    """Crash if the checked source contains CRASH."""
+
+    warms_cache = True
+
+    def __init__(self):
+        self.checked = []
+
+    def run(self, flags, filenames, texts=None):
+        (filename,) = filenames
+        if "--shadow-file" in flags:
+            filename = flags[flags.index("--shadow-file") + 2]
+        with open(filename) as f:
+            source = f.read()
+        self.checked.append(source.count("def "))
+        if "CRASH" in source:
+            err = "Traceback (most recent call last):\nRuntimeError: CRASH\n"
+            return MypyOutput("", err, 2)
+        return MypyOutput("", "", 0)
+
+
+@pytest.mark.parametrize("bisect", [False, True])
+def test_crash_is_reported_once_and_bisected(tmp_path, bisect):
+    content = "\n".join(
+        line
+        for name in ["one", "two", "three", "four"]
+        for line in [
+            "@pytest.mark.mypy_testing",
+            f"def mypy_test_{name}():",
+            "    CRASH" if name == "three" else "    pass",
+        ]
+    )
+    parent = mk_dummy_parent(
+        tmp_path,
+        "test_z.mypy-testing",
+        content,
+        ini={"mypy_testing_bisect_crashes": bisect},
+    )
+    backend = parent.config.stash[_backend_key] = CrashingBackend()
+    file = call_pytest_collect_file(parent.path, parent)
+
+    failures = []
+    for item in file.collect():
+        try:
+            item.runtest()
+        except MypyCrashError as e:
+            failures.append((item.name, str(e)))
+
+    if bisect:
+        assert failures == [
+            (
+                "[mypy]mypy_test_three",
+                "mypy crashed\nTraceback (most recent call last):\nRuntimeError: CRASH",
+            ),
+        ]
+        assert backend.checked == [4, 2, 2, 1, 1]
+    else:
+        assert len(failures) == 4
+        assert failures[0][1].startswith("mypy crashed\nTraceback")
+        assert failures[1][1] == "mypy crashed, see mypy_test_one"
+
+
+CRASHING_PLUGIN = dedent(
+    """
+    from mypy.plugin import Plugin
+
+    def crash(ctx):
+        raise RuntimeError("boom")
+
+    class CrashingPlugin(Plugin):
+        def get_function_hook(self, fullname):
+            return crash if fullname.endswith(".crash") else None
+
+    def plugin(version):
+        return CrashingPlugin
+    """
+)
+
+
+@pytest.mark.parametrize(
+    "backend_cls", [InProcessBackend, BuildBackend, SubprocessBackend]
+)
+def test_crash_of_mypy_plugin_is_reported(tmp_path, backend_cls):
+    (tmp_path / "crashing_plugin.py").write_text(CRASHING_PLUGIN)
+    config_file = tmp_path / "mypy.ini"
+    config_file.write_text(f"[mypy]\nplugins = {tmp_path / 'crashing_plugin.py'}\n")
+    content = dedent(
+        """
+        def crash() -> None: ...
+
+        @pytest.mark.mypy_testing
+        def mypy_test_one():
+            crash()
+
+        @pytest.mark.mypy_testing
+        def mypy_test_two():
+            a: int = "a"  # E: Incompatible types in assignment
+        """
+    )
+    parent = mk_dummy_parent(
+        tmp_path,
+        "test_z.mypy-testing",
+        content,
+        ini={
+            "mypy_testing_flags": [f".: --config-file={config_file}"],
+            "mypy_testing_share_cache": False,
+        },
+    )
+    backend = parent.config.stash[_backend_key] = backend_cls()
+    try:
+        file = call_pytest_collect_file(parent.path, parent)
+        failures = []
+        for item in file.collect():
+            with pytest.raises(MypyCrashError) as excinfo:
+                item.runtest()
+            failures.append(str(excinfo.value))
+    finally:
+        backend.close()
+
+    assert ": error: INTERNAL ERROR" in failures[0]
+    assert "RuntimeError: boom" in failures[0]
+    assert failures[1] == "mypy crashed, see mypy_test_one"
+
+
+class HangingBackend(MypyBackend):
+    warms_cache = True
+    terminable = True
+
+    def __init__(self):
+        self.terminated = threading.Event()
+
+    def run(self, flags, filenames, texts=None):
+        self.terminated.wait(10)
+        return MypyOutput("", "", 2)
+
+    def terminate(self):
+        self.terminated.set()
+
+
+def test_timeout_fails_all_items_of_file(tmp_path):
+    content = dedent(
+        """
+        @pytest.mark.mypy_testing
+        def mypy_test_one():
+            pass
+
+        @pytest.mark.mypy_testing(timeout=0.1)
+        def mypy_test_two():
+            pass
+        """
+    )
+    parent = mk_dummy_parent(
+        tmp_path, "test_z.mypy-testing", content, ini={"mypy_testing_timeout": "0.05"}
+    )
+    backend = parent.config.stash[_backend_key] = HangingBackend()
+    file = call_pytest_collect_file(parent.path, parent)
+    assert file.mypy_timeout({"mypy_test_one"}) == 0.05
+    assert file.mypy_timeout() == 0.1
+
+    for item in file.collect():
+        with pytest.raises(MypyTimeoutError) as excinfo:
+            item.runtest()
+        assert excinfo.value.timeout == 0.1
+        assert str(excinfo.value).startswith("mypy was terminated after")
+    assert backend.terminated.is_set()
+
+
+@pytest.mark.parametrize(
+    "ini, expected",
+    [("60", 60.0), ("0.05", 0.1), ("", None)],
+)
+def test_marker_timeout_does_not_shorten_default_timeout(tmp_path, ini, expected):
+    content = dedent(
+        """
+        @pytest.mark.mypy_testing
+        def mypy_test_one():
+            pass
+
+        @pytest.mark.mypy_testing(timeout=0.1)
+        def mypy_test_two():
+            pass
+        """
+    )
+    parent = mk_dummy_parent(
+        tmp_path, "test_z.mypy-testing", content, ini={"mypy_testing_timeout": ini}
+    )
+    file = call_pytest_collect_file(parent.path, parent)
+    assert file.mypy_timeout() == expected
+    assert file.mypy_timeout({"mypy_test_two"}) == 0.1
+
+
+def test_watch_rejects_item_flags_not_supported_by_dmypy(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    content = dedent(
+        """
+        @pytest.mark.mypy_testing
+        def mypy_test_one():
+            pass
+
+        @pytest.mark.mypy_testing(flags=["--follow-imports=silent"])
+        def mypy_test_two():
+            pass
+        """
+    )
+    parent = mk_dummy_parent(tmp_path, "test_z.mypy-testing", content)
+    parent.config.pluginmanager = Mock()
+    file = call_pytest_collect_file(parent.path, parent)
+    session = SimpleNamespace(config=parent.config, items=list(file.collect()))
+
+    with pytest.raises(pytest.UsageError, match="follow-imports=silent not supported"):
+        _watch(session)
+
+
+class ResultCache:
+    def __init__(self):
+        self.results = {}
+
+    @pytest.hookimpl
+    def pytest_mypy_testing_mypy_args(self, mypy_args):
+        mypy_args.append("--strict")
+
+    @pytest.hookimpl
+    def pytest_mypy_testing_lookup_result(self, path, mypy_args, source_text):
+        return self.results.get((path, tuple(mypy_args), source_text))
+
+    @pytest.hookimpl
+    def pytest_mypy_testing_store_result(self, path, mypy_args, source_text, output):
+        self.results[(path, tuple(mypy_args), source_text)] = output
+
+
+class MessageRunner:
+    def __init__(self):
+        self.calls = []
+
+    @pytest.hookimpl
+    def pytest_mypy_testing_run_mypy(self, mypy_args, filenames):
+        self.calls.append(mypy_args)
+        (filename,) = filenames
+        return [Message(filename, 2, None, ERROR, "Oops", None, "misc")]
+
+
+def test_hooks_adjust_args_run_mypy_and_cache_results(tmp_path):
+    content = dedent(
+        """
+        @pytest.mark.mypy_testing
+        def mypy_test_one():
+            pass
+        """
+    )
+    cache, runner = ResultCache(), MessageRunner()
+    parent = mk_dummy_parent(
+        tmp_path, "test_z.mypy-testing", content, plugins=[cache, runner]
+    )
+    parent.config.stash[_backend_key] = CrashingBackend()
+    file = call_pytest_collect_file(parent.path, parent)
+
+    run = file.check(parent.config.stash[_backend_key])
+    assert run.output == MypyOutput(f"{parent.path}:2: error: Oops  [misc]\n", "", 1)
+    assert len(runner.calls) == 1
+    assert "--strict" in runner.calls[0]
+    assert list(cache.results.values()) == [run.output]
+
+    cached = file.check(parent.config.stash[_backend_key])
+    assert cached.output == run.output
+    assert cached.duration == 0.0
+    assert len(runner.calls) == 1
+
+
+def test_failed_runs_are_not_stored(tmp_path):
+    content = dedent(
+        """
+        @pytest.mark.mypy_testing
+        def mypy_test_one():
+            CRASH
+        """
+    )
+    cache = ResultCache()
+    parent = mk_dummy_parent(tmp_path, "test_z.mypy-testing", content, plugins=[cache])
+    backend = parent.config.stash[_backend_key] = CrashingBackend()
+    file = call_pytest_collect_file(parent.path, parent)
+
+    assert file.check(backend).output.returncode == 2
+    assert cache.results == {}
+
+
+class RecordingWarmCaches:
+    def __init__(self):
+        self.seeded = []
+
+    def seed(self, backend, flags, cache_dir):
+        self.seeded.append(flags)
+
+
+def test_warm_cache_is_seeded_with_hook_adjusted_args(tmp_path):
+    content = dedent(
+        """
+        @pytest.mark.mypy_testing
+        def mypy_test_one():
+            pass
+        """
+    )
+    parent = mk_dummy_parent(
+        tmp_path,
+        "test_z.mypy-testing",
+        content,
+        plugins=[ResultCache(), MessageRunner()],
+    )
+    warm_caches = parent.config.stash[_warm_caches_key] = RecordingWarmCaches()
+    file = call_pytest_collect_file(parent.path, parent)
+    (flags_key,) = file.flag_groups()
+    assert file.mypy_args(flags_key) == [*flags_key, "--strict"]
+
+    file.check(MypyBackend())
+    assert warm_caches.seeded == [[*flags_key, "--strict"]]
+
+
+@pytest.mark.parametrize("granularity", ["function", "file"])
+def test_matrix_items_per_mypy_version(tmp_path, granularity):
+    content = dedent(
+        """
+        @pytest.mark.mypy_testing
+        def mypy_test_one():
+            pass
+
+        @pytest.mark.mypy_testing(mypy_versions=">=1.10")
+        def mypy_test_new():
+            pass
+        """
+    )
+    parent = mk_dummy_parent(
+        tmp_path,
+        "test_z.mypy-testing",
+        content,
+        ini={"mypy_testing_granularity": granularity},
+    )
+    old = MypyVersion("mypy-1.8", "python-old", "1.8.0")
+    new = MypyVersion("mypy-1.19", "python-new", "1.19.1")
+    parent.config.stash[_matrix_key] = [old, new]
+    file = call_pytest_collect_file(parent.path, parent)
+    items = list(file.collect())
+
+    assert file.version_skip_reason(file.mypy_file.items[1], old) == (
+        "requires mypy>=1.10, got mypy 1.8.0"
+    )
+    assert file.version_skip_reason(file.mypy_file.items[1], new) is None
+    assert [item.mypy_version for item in items] == (
+        [old, new] if granularity == "file" else [old, old, new, new]
+    )
+    if granularity == "file":
+        assert [item.name for item in items] == [
+            "[mypy-1.8-file]",
+            "[mypy-1.19-file]",
+        ]
+    else:
+        assert [item.name for item in items] == [
+            "[mypy-1.8]mypy_test_one",
+            "[mypy-1.8]mypy_test_new",
+            "[mypy-1.19]mypy_test_one",
+            "[mypy-1.19]mypy_test_new",
+        ]
+        skipped = [
+            item.name
+            for item in items
+            if any(mark.name == "skip" for mark in item.own_markers)
+        ]
+        assert skipped == ["[mypy-1.8]mypy_test_new"]
+
+
+def test_candidate_files(tmp_path):
+    for name in [
+        "a/test_a.py",
+        "a/helper.py",
+        "a/test_b.mypy-testing",
+        "build/test_c.py",
+        "venv/test_d.py",
+        "venv/pyvenv.cfg",
+        "test_e.py",
+    ]:
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).write_text("")
+    config = Mock(spec=Config)
+    config.args = ["a", "test_e.py::test_foo"]
+    config.invocation_params = SimpleNamespace(dir=tmp_path)
+    config.getini.side_effect = {
+        **INI_DEFAULTS,
+        "norecursedirs": ["build"],
+    }.__getitem__
+
+    assert _candidate_files(config) == [
+        tmp_path / "a/test_a.py",
+        tmp_path / "a/test_b.mypy-testing",
+        tmp_path / "test_e.py",
+    ]
+    config.args = ["."]
+    assert _candidate_files(config) == [
+        tmp_path / "test_e.py",
+        tmp_path / "a/test_a.py",
+        tmp_path / "a/test_b.mypy-testing",
+    ]
+
+
+def test_collect_parsed_file(tmp_path):
+    parent = mk_dummy_parent(tmp_path, "test_z.mypy-testing", "x = 1\n")
+    parsed = MypyTestFile(str(parent.path.resolve()), ["x = 1"])
+    parent.config.stash[_parsed_files_key] = {parsed.filename: parsed}
+
+    file = PytestMypyFile.from_parent(parent=parent, path=parent.path)
+    assert file.mypy_file is parsed
+    assert parent.config.stash[_parsed_files_key] == {}
+
+
+def test_hook_timings_are_attributed_to_test_functions(tmp_path):
+    content = dedent(
+        """
+        @pytest.mark.mypy_testing
+        def mypy_test_one():
+            pass
+
+        @pytest.mark.mypy_testing
+        def mypy_test_two():
+            pass
+        """
+    )
+    parent = mk_dummy_parent(tmp_path, "test_z.mypy-testing", content)
+    parent.config.option.mypy_testing_profile_plugins = True
+    file = call_pytest_collect_file(parent.path, parent)
+    path = str(parent.path)
+    file._record_hook_timings(
+        [
+            HookTiming("get_function_hook", path, 3, 2, 0.5),
+            HookTiming("get_method_hook", path, 3, 1, 0.25),
+            HookTiming("get_function_hook", path, 6, 1, 0.125),
+            HookTiming("get_function_hook", path, 8, 1, 1.0),
+            HookTiming("get_function_hook", None, 1, 1, 1.0),
+        ],
+        None,
+    )
+
+    report_path = tmp_path / "report.json"
+    _write_json_report(parent.config, str(report_path))
+    report = json.loads(report_path.read_text())
+    assert [
+        (record["function"], record["hook"], record["calls"], record["seconds"])
+        for record in report["plugin_hooks"]
+    ] == [
+        (None, "get_function_hook", 2, 2.0),
+        ("mypy_test_one", "get_function_hook", 2, 0.5),
+        ("mypy_test_one", "get_method_hook", 1, 0.25),
+        ("mypy_test_two", "get_function_hook", 1, 0.125),
+    ]
+    assert (
+        report["plugin_hooks"][1]["nodeid"]
+        == "test_z.mypy-testing::[mypy]mypy_test_one"
+    )
+
+
+def test_inspect_files_with_only_revealed_types(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    content = dedent(
+        """
+        import pytest
+
+        @pytest.mark.mypy_testing
+        def mypy_test_one():
+            reveal_type(1)  # R: Literal[1]?
+
+        @pytest.mark.mypy_testing
+        def mypy_test_two():
+            reveal_type("a")  # R: builtins.int
+        """
+    )
+    parent = mk_dummy_parent(tmp_path, "test_z.mypy-testing", content)
+    parent.config.option.mypy_testing_inspect_reveals = True
+    backend = parent.config.stash[_backend_key] = CrashingBackend()
+    file = call_pytest_collect_file(parent.path, parent)
+    try:
+        run = file.check(backend)
+        item_one, item_two = file.collect()
+        item_one.runtest()
+        with pytest.raises(MypyAssertionError):
+            item_two.runtest()
+    finally:
+        pytest_unconfigure(parent.config)
+
+    assert backend.checked == []
+    assert "Revealed type" not in run.output.out
+    assert [msg.revealed_type for msg in run.revealed_messages] == [
+        "Literal[1]?",
+        "Literal['a']?",
+    ]
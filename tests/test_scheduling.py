@@ -0,0 +1,149 @@
+# SPDX-FileCopyrightText: David Fritzsche
+# SPDX-License-Identifier: CC0-1.0
+
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from pytest_mypy_testing.backends import MypyBackend
+from pytest_mypy_testing.scheduling import (
+    BASE_SECONDS,
+    DURATIONS_CACHE_KEY,
+    MypyExecutor,
+    assign_shards,
+    estimate_duration,
+    load_durations,
+    lpt_order,
+    pack_batches,
+    store_durations,
+)
+
+
+class DictCache:
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key, default):
+        return self.data.get(key, default)
+
+    def set(self, key, value):
+        self.data[key] = value
+
+
+def test_store_and_load_durations():
+    config = SimpleNamespace(cache=DictCache())
+    store_durations(config, {"b.py": 2.0})
+    store_durations(config, {"a.py": 1.0, "b.py": 3.0})
+
+    assert load_durations(config) == {"a.py": 1.0, "b.py": 3.0}
+    assert list(config.cache.data[DURATIONS_CACHE_KEY]) == ["a.py", "b.py"]
+
+
+def test_load_durations_without_cache():
+    assert load_durations(SimpleNamespace(cache=None)) == {}
+
+
+def test_estimate_duration(tmp_path):
+    small = tmp_path / "small.py"
+    small.write_text("x = 1\n")
+    large = tmp_path / "large.py"
+    large.write_text("x = 1\n" * 1000)
+
+    assert estimate_duration("small.py", small, {"small.py": 42.0}) == 42.0
+    assert BASE_SECONDS < estimate_duration("small.py", small, {})
+    assert estimate_duration("small.py", small, {}) < estimate_duration(
+        "large.py", large, {}
+    )
+    assert estimate_duration("missing.py", tmp_path / "missing.py", {}) == (
+        BASE_SECONDS
+    )
+
+
+def test_lpt_order():
+    assert lpt_order({"a": 1.0, "b": 3.0, "c": 1.0, "d": 2.0}) == ["b", "d", "a", "c"]
+
+
+def test_pack_batches():
+    costs = {"a": 90.0, "b": 50.0, "c": 40.0, "d": 30.0, "e": 20.0, "f": 10.0}
+    batches = pack_batches(costs, 2)
+
+    assert sorted(key for batch in batches for key in batch) == sorted(costs)
+    totals = [sum(costs[key] for key in batch) for batch in batches]
+    assert totals == [120.0, 120.0]
+    assert pack_batches(costs, 2) == batches
+
+
+def test_pack_batches_requires_positive_n():
+    with pytest.raises(ValueError):
+        pack_batches({"a": 1.0}, 0)
+
+
+def test_assign_shards():
+    keys = [f"test_{i}.py" for i in range(10)]
+    durations = {"test_0.py": 90.0, "test_1.py": 40.0, "test_2.py": 50.0}
+    shards = assign_shards(keys, durations, 2)
+
+    assert set(shards) == set(keys)
+    assert set(shards.values()) <= {0, 1}
+    assert shards["test_0.py"] != shards["test_1.py"] == shards["test_2.py"]
+    assert assign_shards(reversed(keys), durations, 2) == shards
+
+
+class RecordingBackend(MypyBackend):
+    closed = 0
+
+    def close(self) -> None:
+        RecordingBackend.closed += 1
+
+
+def test_executor_starts_longest_first():
+    started = []
+    gate = threading.Event()
+
+    def check(backend, name):
+        if name == "block":
+            gate.wait()
+        started.append(name)
+        return name.upper()
+
+    executor = MypyExecutor(1, RecordingBackend)
+    try:
+        block = executor.submit_all(check, ["block"])[0]
+        futures = executor.submit_all(check, ["a", "b", "c"], [1.0, 3.0, 2.0])
+        gate.set()
+        assert [future.result() for future in futures] == ["A", "B", "C"]
+        assert block.result() == "BLOCK"
+    finally:
+        executor.close()
+
+    assert started == ["block", "b", "c", "a"]
+    assert RecordingBackend.closed == 1
+
+
+class TerminableBackend(MypyBackend):
+    def __init__(self):
+        self.terminated = threading.Event()
+
+    def terminate(self) -> None:
+        self.terminated.set()
+
+
+def test_executor_cancel():
+    started = []
+    running = threading.Event()
+
+    def check(backend, name):
+        started.append(name)
+        running.set()
+        backend.terminated.wait(10)
+        return name
+
+    executor = MypyExecutor(1, TerminableBackend)
+    futures = executor.submit_all(check, ["a", "b", "c"], [3.0, 2.0, 1.0])
+    running.wait(10)
+    executor.cancel()
+
+    assert started == ["a"]
+    assert futures[0].result() == "a"
+    assert futures[1].cancelled() and futures[2].cancelled()
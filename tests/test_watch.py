@@ -0,0 +1,145 @@
+# SPDX-FileCopyrightText: David Fritzsche
+# SPDX-License-Identifier: CC0-1.0
+
+import os
+import pathlib
+from typing import List
+
+import pytest
+
+from pytest_mypy_testing.strutil import dedent
+from pytest_mypy_testing.watch import (
+    WatchedFile,
+    WatchEngine,
+    partition_files,
+    watch,
+)
+
+
+FLAGS = [
+    "--check-untyped-defs",
+    "--no-error-summary",
+    "--show-error-codes",
+    "--show-column-numbers",
+]
+
+CONTENT = dedent(
+    """
+    import pytest
+    from helper import VALUE
+
+
+    @pytest.mark.mypy_testing
+    def mypy_test_value():
+        reveal_type(VALUE)  # R: builtins.int
+
+
+    @pytest.mark.mypy_testing
+    def mypy_test_other():
+        reveal_type(1.0)  # R: builtins.float
+    """
+)
+
+
+def touch_later(path, content):
+    stat = os.stat(path)
+    path.write_text(content)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_watch_reports_items_affected_by_changed_import(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    helper = tmp_path / "helper.py"
+    helper.write_text("VALUE = 1\n")
+    path = tmp_path / "test_watch.py"
+    path.write_text(CONTENT)
+    other_path = tmp_path / "test_other.py"
+    other_path.write_text(CONTENT.replace("builtins.float", "builtins.str"))
+    filenames = [str(path), str(other_path)]
+    assert partition_files(filenames, FLAGS) == [filenames]
+
+    lines: List[str] = []
+    engine = WatchEngine(filenames, FLAGS, str(tmp_path))
+    try:
+        watched_files = [
+            WatchedFile(str(path), engine),
+            # Blank out the failing function of the other file
+            WatchedFile(str(other_path), engine, {"mypy_test_value"}),
+        ]
+        watch(
+            watched_files,
+            lines.append,
+            max_iterations=1,
+            sleep=lambda _: touch_later(helper, "VALUE = 'abc'\n"),
+        )
+        assert engine.watched_paths() == [str(helper), str(other_path), str(path)]
+    finally:
+        engine.close()
+
+    mismatch = [
+        '  A: note: Revealed type is "builtins.str"',
+        "  E: note: Revealed type is 'builtins.int'",
+        "                         ^",
+    ]
+    assert lines == [
+        "mypy-testing: watching 2 file(s) for changes (press Ctrl-C to stop)",
+        f"{path}::[mypy]mypy_test_value FAILED",
+        f"{path}:7: note (mismatch):",
+        *mismatch,
+        f"{other_path}::[mypy]mypy_test_value FAILED",
+        f"{other_path}:7: note (mismatch):",
+        *mismatch,
+    ]
+
+
+def test_partition_files_separates_equal_module_names(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    filenames = [
+        str(tmp_path / "test_a.mypy-testing"),
+        str(tmp_path / "test_b.mypy-testing"),
+        str(tmp_path / "test_c.py"),
+    ]
+    for filename in filenames:
+        pathlib.Path(filename).write_text(CONTENT)
+    assert partition_files(filenames, FLAGS) == [filenames[::2], filenames[1:2]]
+
+    with pytest.raises(SystemExit):
+        partition_files(filenames, FLAGS + ["--follow-imports=silent"])
+
+
+def test_watch_checks_parametrized_variants(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / "test_watch.mypy-testing"
+    content = dedent(
+        """
+        import pytest
+
+
+        @pytest.mark.mypy_testing
+        @pytest.mark.parametrize("T", ["int", "str"])
+        def mypy_test_list():
+            x: list[T] = []
+            reveal_type(x)  # R: builtins.list[builtins.{T}]
+        """
+    )
+    path.write_text(content)
+
+    lines: List[str] = []
+    engine = WatchEngine([str(path)], FLAGS, str(tmp_path))
+    try:
+        watch(
+            [WatchedFile(str(path), engine)],
+            lines.append,
+            max_iterations=1,
+            sleep=lambda _: touch_later(path, content + "    x.append(1)\n"),
+        )
+    finally:
+        engine.close()
+
+    assert lines == [
+        "mypy-testing: watching 1 file(s) for changes (press Ctrl-C to stop)",
+        f"{path}::[mypy]mypy_test_list[int] PASSED",
+        f"{path}::[mypy]mypy_test_list[str] FAILED",
+        f"{path}:9: error (unexpected): Argument 1 to "
+        '"append" of "list" has incompatible type "int"; expected "str"',
+    ]